@@ -0,0 +1,223 @@
+################################################################
+# Benchmarks for the path from the log to the charts
+###############################################################
+
+# Generates synthetic logs in the v1 long format (100k, 1M and 10M rows by
+# default, kept in bench_data/ and reused by the next run, --regenerate makes
+# new ones; the timings run on a copy) and times for each size:
+#  - parse:      parsing the whole log (what a dashboard does at startup)
+#  - load:       first snapshot incl. derived values (loaddata() when cold)
+#  - tick:       loaddata() after one new sample was appended
+#  - filter:     the series of one chart, and only a visible 2 h range
+#  - figure:     the traces of each dashboard chart, full range and 2 h
+#  - serialize:  the figure to JSON as Dash sends it, with its size
+#  - legacy:     the same with the old dashboard code, for comparison: every
+#                callback read the whole csv, filtered it and drew all rows
+#                with px.line (logs up to --legacy-max-rows)
+# and the throughput of the log writers (v1 csv, v2 csv, binary).
+# Every timing is the best of `repeat` runs. The results go to a JSON file,
+# so two versions can be compared:
+#   python benchmark.py [--sizes 100k,1M] [--out benchmark.json]
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+from sensorlog import CHANNELS, V1_DATE_FORMAT
+
+SIZES = {'100k': 100000, '1M': 1000000, '10M': 10000000}
+# the charts of the dashboards: series and hover label
+CHARTS = {
+    'temp': (['Temp1', 'Temp2'], "Temperature (°C)"),
+    'humid': (['Humid1', 'Humid2'], "Humidity (%)"),
+    'vpd': (['vpd1', 'vpd2'], "VPD"),
+}
+CHART_POINTS = dict(max_points=500, method='lttb')
+
+
+def synthetic_log(path, rows, interval=10, seed=0):
+    """Write a v1 log with `rows` rows, one sample (8 rows) per interval seconds."""
+    rng = np.random.default_rng(seed)
+    n = rows // len(CHANNELS)
+    t = np.arange(n) * interval
+    day = np.sin(2 * np.pi * (t / 3600 - 9) / 24)
+    temp = 22 + 3 * day
+    humid = 60 - 10 * day
+    press = 1013 + 5 * np.sin(2 * np.pi * t / (3 * 86400))
+    columns = [temp, temp + 0.5, humid, humid - 2, press, press + 0.3, 0.9 + 0.3 * day, 1.0 + 0.3 * day]
+    values = np.stack([c + rng.normal(0, 0.1, n) for c in columns], axis=1)
+    start = pd.Timestamp('2024-01-01 00:00:00')
+    dates = (start + pd.to_timedelta(t, unit='s')).strftime(V1_DATE_FORMAT)
+    df = pd.DataFrame({'date': np.repeat(np.asarray(dates), len(CHANNELS)),
+                       'value': values.ravel(),
+                       'type': np.tile(CHANNELS, n)})
+    tmp = path + '.tmp'
+    df.to_csv(tmp, index=False, float_format='%.2f')
+    os.replace(tmp, path)
+    return start + pd.Timedelta(seconds=int(t[-1]))
+
+
+def best(func, repeat):
+    """(best time in seconds, result of the last call)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def bench_log(path, repeat):
+    from dataloader import SnapshotCache, loader_for
+    from derived import with_derived
+    from figures import _clip, line_traces
+    from plotly.io.json import to_json_plotly
+
+    result = {'rows': sum(1 for _ in open(path, 'rb')) - 1}
+    result['parse'], df = best(lambda: loader_for(path).load(), repeat)
+
+    cache = None
+
+    def cold():
+        nonlocal cache
+        cache = SnapshotCache(loader_for(path), derive=with_derived)
+        return cache.get()
+    result['load'], snap = best(cold, repeat)
+
+    # one new sample, as the logger appends it every 10 s
+    last = snap.latest('Temp1')[0]
+    sample_time = pd.Timestamp(last) + pd.Timedelta(seconds=10)
+    rows = ''.join('{},{},{}\n'.format(sample_time.strftime(V1_DATE_FORMAT), 20.0, c) for c in CHANNELS)
+    with open(path, 'a') as f:
+        f.write(rows)
+    start = time.perf_counter()
+    snap = cache.get()
+    result['tick'] = time.perf_counter() - start
+
+    end = snap.latest('Temp1')[0]
+    x_range = (end - np.timedelta64(2, 'h'), end)
+    result['filter'], _ = best(lambda: [snap.get(n) for n in CHARTS['temp'][0]], repeat)
+    result['filter_2h'], _ = best(lambda: [_clip(*snap.get(n), x_range) for n in CHARTS['temp'][0]], repeat)
+
+    result['charts'] = {}
+    for chart, (names, ylabel) in CHARTS.items():
+        r = {}
+        for label, rng in (('all', None), ('2h', x_range)):
+            r['figure_' + label], traces = best(
+                lambda: line_traces(snap, names, ylabel, x_range=rng, **CHART_POINTS), repeat)
+            r['serialize_' + label], data = best(lambda: to_json_plotly(dict(data=traces)), repeat)
+            r['bytes_' + label] = len(data)
+        result['charts'][chart] = r
+    return result
+
+
+def bench_legacy(path, repeat):
+    """The chart callbacks of the old dashboard: loaddata() read and parsed the
+    whole csv on every tick, px.line drew every row of the chart."""
+    import plotly.express as px
+
+    def loaddata():
+        df = pd.read_csv(path)
+        df["date"] = pd.to_datetime(df["date"], dayfirst=True)
+        return df
+    result = {}
+    result['load'], df = best(loaddata, repeat)
+    result['charts'] = {}
+    for chart, (names, ylabel) in CHARTS.items():
+        r = {}
+        r['figure'], fig = best(lambda: px.line(df[df['type'].isin(names)], x="date", y="value", color="type",
+                                                labels=dict(date="Time", value=ylabel, type="Sensor")), repeat)
+        r['serialize'], data = best(fig.to_json, repeat)
+        r['bytes'] = len(data)
+        result['charts'][chart] = r
+    return result
+
+
+def bench_writers(directory, samples, repeat):
+    import logwriter
+    import sensorlog
+    result = {}
+    values = [21.5, 21.0, 55.0, 54.0, 1013.2, 1013.5, 1.1, 1.2]
+    date = time.strftime(V1_DATE_FORMAT)
+    stamp = pd.Timestamp.now(tz='UTC').to_pydatetime()
+    formats = {
+        'csv': (logwriter.format_v1, b'date,value,type\n', logwriter.repair_text_log),
+        'csv2': (logwriter.format_v2, sensorlog.v2_header().encode(), logwriter.repair_text_log),
+        'binary': (logwriter.format_binary, sensorlog.binlog_header(), logwriter.repair_binlog),
+    }
+    for name, (fmt, header, repair) in formats.items():
+        path = os.path.join(directory, 'writer.' + name)
+
+        def write():
+            if os.path.exists(path):
+                os.remove(path)
+            w = logwriter.LogWriter(path, fmt, header, repair)
+            for _ in range(samples):
+                w.log(date, stamp, values)
+            w.close()
+            return w.bytes_written
+        seconds, written = best(write, repeat)
+        result[name] = dict(samples_per_s=samples / seconds, bytes_per_sample=written / samples)
+        os.remove(path)
+    return result
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark log loading, charts and log writers.')
+    parser.add_argument('--sizes', default=','.join(SIZES), help='comma separated, e.g. 100k,1M')
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--data', default='bench_data', help='directory for the generated logs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--writer-samples', type=int, default=100000)
+    parser.add_argument('--regenerate', action='store_true', help='make new logs even if they exist')
+    parser.add_argument('--legacy-max-rows', type=int, default=1000000,
+                        help='time the old dashboard code for logs up to this size')
+    args = parser.parse_args()
+
+    os.makedirs(args.data, exist_ok=True)
+    results = dict(version=version(), python=platform.python_version(), machine=platform.machine(),
+                   time=time.strftime('%Y-%m-%dT%H:%M:%S'), sizes={})
+    for size in args.sizes.split(','):
+        rows = SIZES[size] if size in SIZES else int(size)
+        path = os.path.join(args.data, 'log_{}.csv'.format(size))
+        if args.regenerate or not os.path.isfile(path):
+            print("{}: generating {} rows".format(size, rows))
+            synthetic_log(path, rows)
+        # the tick benchmark appends to the log, keep the generated one as it is
+        work = os.path.join(args.data, 'work_{}.csv'.format(size))
+        shutil.copyfile(path, work)
+        results['sizes'][size] = r = bench_log(work, args.repeat)
+        os.remove(work)
+        print("{}: parse {:.2f} s, load {:.2f} s, tick {:.4f} s, temp figure {:.4f} s, {} bytes".format(
+            size, r['parse'], r['load'], r['tick'], r['charts']['temp']['figure_all'],
+            r['charts']['temp']['bytes_all']))
+        if rows <= args.legacy_max_rows:
+            r['legacy'] = old = bench_legacy(path, args.repeat)
+            print("{}: legacy load {:.2f} s, temp figure {:.4f} s, {} bytes".format(
+                size, old['load'], old['charts']['temp']['figure'], old['charts']['temp']['bytes']))
+    results['writers'] = bench_writers(args.data, args.writer_samples, args.repeat)
+    for name, r in results['writers'].items():
+        print("writer {}: {:.0f} samples/s, {:.0f} bytes/sample".format(
+            name, r['samples_per_s'], r['bytes_per_sample']))
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=1)
+    print("results in {}".format(args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+################################################################
+# Callback profiling for the dashboards
+###############################################################
+
+# The interval callbacks are most of the load of the dashboard, but nothing
+# told which one is slow or how much each sends. CallbackProfiler wraps every
+# registered callback of a Dash app and records per callback:
+#  - wall time of the whole request handling
+#  - load:      time in `with phase('load'):` blocks (reading the data)
+#  - figure:    time in `with phase('figure'):` blocks (building traces)
+#  - serialize: the rest, Dash preparing the response and encoding the JSON
+#  - bytes:     size of the JSON response
+# phase() costs nothing when profiling is off or outside a callback.
+# With dump_dir every call is sampled: a thread looks at the stack of the
+# callback thread every `interval` seconds. For calls slower than `slow`
+# seconds the stacks are written to dump_dir as a folded file, one
+# "a;b;c count" line per stack, for flamegraph.pl or speedscope.
+#
+# Opt-in, after all callbacks are registered:
+#   profiler = CallbackProfiler(slow=0.5, dump_dir='profiles')
+#   profiler.install(app)
+
+import collections
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+
+from dash.exceptions import PreventUpdate
+
+_current = threading.local()
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Count the time of the block as phase name of the running callback."""
+    call = getattr(_current, 'call', None)
+    if call is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        call[name] = call.get(name, 0.0) + time.perf_counter() - start
+
+
+class CallbackStats:
+    def __init__(self, name, keep=200):
+        self.name = name
+        self.calls = 0
+        self.prevented = 0
+        self.errors = 0
+        self.slow = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.phases = collections.Counter()     # phase -> seconds, summed
+        self.bytes = 0
+        self.max_bytes = 0
+        self.recent = collections.deque(maxlen=keep)   # wall times, for p95
+        self.last_dump = None
+
+    def summary(self):
+        recent = sorted(self.recent)
+        n = max(self.calls, 1)
+        return dict(callback=self.name, calls=self.calls, prevented=self.prevented,
+                    errors=self.errors, slow=self.slow, mean=self.total / n, max=self.max,
+                    p95=recent[int(0.95 * (len(recent) - 1))] if recent else None,
+                    load=self.phases['load'] / n, figure=self.phases['figure'] / n,
+                    serialize=self.phases['serialize'] / n,
+                    mean_bytes=self.bytes / n, max_bytes=self.max_bytes, last_dump=self.last_dump)
+
+
+class StackSampler:
+    """Folded stacks of threads, sampled from one background thread."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stacks = {}           # thread id -> Counter of folded stacks
+        self._active = threading.Event()    # set while a call is sampled
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._stacks[thread_id] = collections.Counter()
+            self._active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        with self._lock:
+            stacks = self._stacks.pop(thread_id, collections.Counter())
+            if not self._stacks:
+                self._active.clear()
+            return stacks
+
+    def _loop(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                frames = sys._current_frames()
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                         frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class CallbackProfiler:
+    """Time, phases and response size of the callbacks of a Dash app."""
+
+    def __init__(self, slow=0.5, dump_dir=None, interval=0.005):
+        self.slow = slow
+        self.dump_dir = dump_dir
+        self._sampler = StackSampler(interval) if dump_dir else None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def install(self, app):
+        """Wrap every callback registered on app so far."""
+        for key, entry in app.callback_map.items():
+            func = entry['callback']
+            if not getattr(func, '_profiled', False):
+                entry['callback'] = self.wrap(func, getattr(func, '__name__', key))
+
+    def wrap(self, func, name):
+        with self._lock:
+            stats = self._stats.setdefault(name, CallbackStats(name))
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            call = _current.call = {}
+            thread_id = threading.get_ident()
+            if self._sampler is not None:
+                self._sampler.start(thread_id)
+            start = time.perf_counter()
+            outcome = 'ok'
+            response = None
+            try:
+                response = func(*args, **kwargs)
+                return response
+            except PreventUpdate:
+                outcome = 'prevented'
+                raise
+            except Exception:
+                outcome = 'error'
+                raise
+            finally:
+                wall = time.perf_counter() - start
+                _current.call = None
+                stacks = self._sampler.stop(thread_id) if self._sampler is not None else None
+                self._record(stats, wall, call, outcome, response, stacks)
+        profiled._profiled = True
+        return profiled
+
+    def _record(self, stats, wall, call, outcome, response, stacks):
+        size = len(response) if isinstance(response, (str, bytes)) else 0
+        dump = None
+        if stacks and wall >= self.slow:
+            dump = self._dump(stats.name, wall, stacks)
+        with self._lock:
+            stats.calls += 1
+            stats.prevented += outcome == 'prevented'
+            stats.errors += outcome == 'error'
+            stats.total += wall
+            stats.max = max(stats.max, wall)
+            stats.recent.append(wall)
+            for name, seconds in call.items():
+                stats.phases[name] += seconds
+            stats.phases['serialize'] += max(wall - sum(call.values()), 0.0)
+            stats.bytes += size
+            stats.max_bytes = max(stats.max_bytes, size)
+            if wall >= self.slow:
+                stats.slow += 1
+                print("Slow callback {}: {:.3f} s, {} bytes".format(stats.name, wall, size))
+            if dump is not None:
+                stats.last_dump = dump
+
+    def _dump(self, name, wall, stacks):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = os.path.join(self.dump_dir, '{}-{}-{:.0f}ms.folded'.format(
+            name, time.strftime('%Y%m%d-%H%M%S'), 1000 * wall))
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        return path
+
+    def worst(self, n=10, key='p95'):
+        """Summaries of the n callbacks with the highest key (p95, max, mean, mean_bytes)."""
+        with self._lock:
+            rows = [s.summary() for s in self._stats.values() if s.calls]
+        return sorted(rows, key=lambda r: r[key] or 0, reverse=True)[:n]
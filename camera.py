@@ -0,0 +1,301 @@
+################################################################
+# Camera capture
+###############################################################
+
+# cam() used to open the camera for every picture, never released it and
+# saved full-size PNGs. CameraGrabber keeps the device open and grabs frames
+# on a background thread; the newest decoded frame is always available from
+# latest(). Saving goes through a FrameEncoder worker, which resizes and
+# encodes to JPEG or WebP off the capture thread.
+
+import os
+import queue
+import threading
+import time
+
+
+def _cv2():
+    # imported on first use, so this module loads without OpenCV
+    import cv2
+    return cv2
+
+
+def encode(frame, fmt='jpg', quality=80, width=None):
+    """Encode a frame to JPEG or WebP bytes, optionally scaled to width pixels."""
+    cv2 = _cv2()
+    if width and frame.shape[1] > width:
+        height = round(frame.shape[0] * width / frame.shape[1])
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    if fmt == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    ok, buf = cv2.imencode('.' + fmt, frame, params)
+    if not ok:
+        raise RuntimeError('could not encode frame as ' + fmt)
+    return buf.tobytes()
+
+
+def write_atomic(path, data):
+    # readers (the dashboard) never see a half written file
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class CameraGrabber:
+    """Keep the camera open and hold the latest frame.
+
+    The thread calls grab() all the time, which only takes the frame off the
+    device and keeps the driver's buffer fresh, but decodes (retrieve()) at
+    most `fps` frames per second.
+    """
+
+    def __init__(self, device=0, width=None, height=None, fps=2):
+        self.device = device
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self._cap = None
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._frame = None
+        self._time = None
+        self.seq = 0            # number of decoded frames so far
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _open(self):
+        cv2 = _cv2()
+        cap = cv2.VideoCapture(self.device)
+        if self.width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if not cap.isOpened():
+            cap.release()
+            raise RuntimeError('could not open camera {}'.format(self.device))
+        return cap
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='camera', daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        next_decode = 0
+        while not self._stop.is_set():
+            try:
+                if self._cap is None:
+                    self._cap = self._open()
+                if not self._cap.grab():
+                    raise RuntimeError('camera {} returned no frame'.format(self.device))
+                now = time.monotonic()
+                if now < next_decode:
+                    continue
+                ok, frame = self._cap.retrieve()
+                if not ok:
+                    continue
+                next_decode = now + 1 / self.fps
+                with self._lock:
+                    self._frame = frame
+                    self._time = time.time()
+                    self.seq += 1
+                    self._new_frame.notify_all()
+            except Exception as e:
+                # camera unplugged or busy: release it and try again later
+                self.errors += 1
+                print("Camera: {}".format(e))
+                if self._cap is not None:
+                    self._cap.release()
+                    self._cap = None
+                self._stop.wait(5)
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def latest(self):
+        """Return (frame, unix time, seq) of the newest frame, frame None if none yet."""
+        with self._lock:
+            return self._frame, self._time, self.seq
+
+    def wait(self, after_seq, timeout=None):
+        """Wait for a frame newer than after_seq and return it like latest()."""
+        with self._lock:
+            self._new_frame.wait_for(lambda: self.seq > after_seq, timeout)
+            return self._frame, self._time, self.seq
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+class FrameEncoder:
+    """Encode and save frames on a worker thread.
+
+    The queue is short; when the worker can't keep up, new frames are dropped
+    rather than piling up in memory.
+    """
+
+    def __init__(self, fmt='jpg', quality=80, width=None, maxsize=2):
+        self.fmt = fmt
+        self.quality = quality
+        self.width = width
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.saved = 0
+        self.dropped = 0
+        self.encode_seconds = 0.0   # duration of the last encode
+        self._thread = threading.Thread(target=self._loop, name='encoder', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, paths, on_saved=None):
+        """Encode frame once and write it to every path in paths.
+
+        on_saved(paths, data) is called after writing, on the worker thread.
+        """
+        try:
+            self._queue.put_nowait((frame, paths, on_saved))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            frame, paths, on_saved = item
+            try:
+                start = time.perf_counter()
+                data = encode(frame, self.fmt, self.quality, self.width)
+                self.encode_seconds = time.perf_counter() - start
+                for path in paths:
+                    write_atomic(path, data)
+                self.saved += 1
+                if on_saved is not None:
+                    on_saved(paths, data)
+            except Exception as e:
+                print("Encoder: {!r}".format(e))
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+
+
+################################################################
+# Live stream
+###############################################################
+
+# The camera belongs to main_scheduler.py, the stream is served by the Dash
+# app, a different process. LivePublisher (in the scheduler) encodes each new
+# frame once and writes it to a file on tmpfs (no SD card writes);
+# FileFrameSource (in the Dash app) picks up every new version of that file
+# into one in-memory FrameBuffer, which all viewers stream from.
+
+LIVE_PATH = '/dev/shm/greenbox_live.jpg'
+
+
+class LivePublisher:
+    """Encode the newest camera frame at most `fps` times per second into path."""
+
+    def __init__(self, grabber, path=LIVE_PATH, fps=2, quality=70, width=640):
+        self.grabber = grabber
+        self.path = path
+        self.fps = fps
+        self.encoder = FrameEncoder('jpg', quality, width, maxsize=1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='live', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        seq = 0
+        while not self._stop.is_set():
+            frame, t, new_seq = self.grabber.wait(seq, timeout=5)
+            if new_seq > seq and frame is not None:
+                seq = new_seq
+                self.encoder.submit(frame, [self.path])
+            self._stop.wait(1 / self.fps)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=10)
+        self.encoder.stop()
+
+
+class FrameBuffer:
+    """Newest encoded frame, shared by all stream viewers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.data = None
+        self.seq = 0
+
+    def put(self, data):
+        with self._cond:
+            self.data = data
+            self.seq += 1
+            self._cond.notify_all()
+
+    def wait(self, after_seq, timeout=None):
+        """Return (data, seq) of a frame newer than after_seq, or the current one on timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > after_seq, timeout)
+            return self.data, self.seq
+
+
+class FileFrameSource:
+    """Load every new version of an image file into a FrameBuffer.
+
+    The file is checked `fps` times per second; it is read once per change,
+    however many viewers there are.
+    """
+
+    def __init__(self, buffer, path=LIVE_PATH, fps=2):
+        self.buffer = buffer
+        self.path = path
+        self.fps = fps
+        self._thread = threading.Thread(target=self._loop, name='frames', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        last = None
+        while True:
+            try:
+                st = os.stat(self.path)
+                version = (st.st_ino, st.st_mtime_ns, st.st_size)
+                if version != last:
+                    with open(self.path, 'rb') as f:
+                        self.buffer.put(f.read())
+                    last = version
+            except FileNotFoundError:
+                pass
+            time.sleep(1 / self.fps)
+
+
+def mjpeg_stream(buffer, max_fps=2, timeout=30):
+    """Generator for a multipart/x-mixed-replace response (boundary 'frame').
+
+    Sends each new frame once, at most max_fps per second. The frames are
+    already encoded, so a viewer costs no encoding work.
+    """
+    seq = 0
+    while True:
+        start = time.monotonic()
+        data, new_seq = buffer.wait(seq, timeout)
+        if data is None:
+            continue
+        # on timeout the last frame is sent again, which keeps the
+        # connection alive
+        seq = new_seq
+        yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+               + str(len(data)).encode() + b'\r\n\r\n' + data + b'\r\n')
+        wait = 1 / max_fps - (time.monotonic() - start)
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,140 @@
+################################################################
+# Camera picture storage
+###############################################################
+
+# A picture every 30 s fills the SD card, and at night most of them are the
+# same black frame. CamStore decides on a worker thread which pictures to
+# keep:
+#  - a picture is skipped when it hardly differs from the last saved one:
+#    both are scaled down to 32x24 grey pixels and compared by their mean
+#    absolute difference (0-255). Unlike a perceptual hash this stays stable
+#    on dark, noisy frames, where the scaling averages the noise out.
+#    One picture per max_interval seconds is saved anyway.
+#  - every saved picture also gets a small thumbnail for the dashboard
+#  - prune() deletes full size pictures after keep_days and thumbnails after
+#    keep_thumb_days
+# bytes_saved estimates the disk space the skipped pictures would have used
+# (the size of the last saved picture for each one).
+
+import os
+import queue
+import threading
+import time
+
+from camera import _cv2, encode, write_atomic
+from timelapse import picture_time
+
+SIGNATURE_SIZE = (32, 24)
+
+
+def signature(frame):
+    """Small grey version of a frame for comparing pictures."""
+    cv2 = _cv2()
+    grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(grey, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).astype('float32')
+
+
+def difference(a, b):
+    """Mean absolute difference of two signatures, 0 (same) to 255."""
+    return float(abs(a - b).mean())
+
+
+class CamStore:
+    """Save camera pictures with deduplication, thumbnails and retention."""
+
+    def __init__(self, directory, fmt='jpg', quality=80, width=None, threshold=2.0,
+                 max_interval=1800, thumb_dir=None, thumb_width=160, keep_days=14,
+                 keep_thumb_days=365, maxsize=2):
+        self.directory = directory
+        self.fmt = fmt
+        self.quality = quality
+        self.width = width
+        self.threshold = threshold
+        self.max_interval = max_interval
+        self.thumb_dir = thumb_dir or os.path.join(directory, 'thumbs')
+        self.thumb_width = thumb_width
+        self.keep_days = keep_days
+        self.keep_thumb_days = keep_thumb_days
+        self._last = None           # signature of the last saved picture
+        self._last_time = None
+        self._last_size = 0
+        self.saved = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.bytes_saved = 0
+        self.bytes_deleted = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        os.makedirs(self.thumb_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._loop, name='camstore', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, t):
+        """Queue a frame taken at unix time t. Returns False if it was dropped."""
+        try:
+            self._queue.put_nowait((frame, t))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self.store(*item)
+            except Exception as e:
+                print("CamStore: {!r}".format(e))
+
+    def store(self, frame, t):
+        """Save frame unless it is a near duplicate. Returns the path or None."""
+        sig = signature(frame)
+        if (self._last is not None and t - self._last_time < self.max_interval
+                and difference(sig, self._last) < self.threshold):
+            self.skipped += 1
+            self.bytes_saved += self._last_size
+            return None
+        name = time.strftime("%Y%m%d-%H%M%S", time.localtime(t)) + "cam." + self.fmt
+        data = encode(frame, self.fmt, self.quality, self.width)
+        path = os.path.join(self.directory, name)
+        write_atomic(path, data)
+        # cam.<format> always holds the newest picture for the dashboard
+        write_atomic(os.path.join(self.directory, "cam." + self.fmt), data)
+        thumb = encode(frame, self.fmt, self.quality, self.thumb_width)
+        write_atomic(os.path.join(self.thumb_dir, name), thumb)
+        self._last, self._last_time, self._last_size = sig, t, len(data)
+        self.saved += 1
+        self.bytes_written += len(data) + len(thumb)
+        return path
+
+    def prune(self, now=None):
+        """Delete pictures and thumbnails past their retention time."""
+        now = time.time() if now is None else now
+        for directory, days in ((self.directory, self.keep_days),
+                                (self.thumb_dir, self.keep_thumb_days)):
+            if days is None:
+                continue
+            for name in os.listdir(directory):
+                t = picture_time(name)
+                if t is None or now - t < days * 86400:
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self.bytes_deleted += size
+        print(self.report())
+
+    def report(self):
+        return ("Pictures: {} saved, {} skipped as duplicates (~{:.1f} MB saved), "
+                "{} dropped, {:.1f} MB deleted by retention".format(
+                    self.saved, self.skipped, self.bytes_saved / 1e6, self.dropped,
+                    self.bytes_deleted / 1e6))
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join(timeout=10)
@@ -0,0 +1,231 @@
+################################################################
+# Closed-loop climate control
+###############################################################
+
+# checker() only printed when the humidity left 30-50 %, the humidifier and
+# the fan ran for fixed times started by hand. A Controller subscribes to the
+# Sampler and decides on every new sample whether its device should run:
+#  - Hysteresis: on below `low`, off above `high` (or the other way round)
+#  - PID: duty cycle from a PID on the error, turned into on/off time within
+#    a `window` of seconds (time proportioning)
+#  - vpd_target(): hysteresis on the VPD computed from the sample
+# min_on / min_off keep the device from switching too fast, max_switches
+# limits the switches per hour. The device is switched through the Actuator,
+# like humidon() / windon(), so there is only one place that drives the
+# relays in the scheduler. The dashboard switches the same relays
+# from its own process, so before deciding the controller takes the state of
+# the device from its relay; while steps of the device are still running it
+# doesn't decide at all.
+#
+# latency: seconds from reading the sensors to the relay being switched,
+# measured for every switch and printed when above LATENCY_WARNING.
+
+import collections
+import math
+import time
+
+import derived
+
+LATENCY_WARNING = 1.0
+
+
+class Device:
+    """Something switched by a sequence of relay steps, e.g. the humidifier.
+
+    relay: the relay that tells whether the device runs (its power).
+    """
+
+    def __init__(self, actuator, name, on_steps, off_steps, relay):
+        self.actuator = actuator
+        self.name = name
+        self.on_steps = on_steps
+        self.off_steps = off_steps
+        self.relay = relay
+
+    def switch(self, on, on_start=None):
+        # the action has the device's name, so humidon() / windon() of the
+        # scheduler and the controller replace each other's steps
+        self.actuator.run(self.name, self.on_steps if on else self.off_steps, on_start)
+
+    def is_on(self):
+        """State of the relay. The dashboard switches the relays from its own
+        process and actuator, the bank is shared, so this reads the pin back."""
+        return self.actuator.bank.get(self.relay)
+
+    def busy(self):
+        """An action of this process is still switching the device."""
+        return self.name in self.actuator.status()['actions']
+
+    def run_for(self, seconds):
+        """Switch on for seconds (humidon() / windon()).
+
+        When the device already runs only the end is moved, the on steps
+        aren't repeated: a second button pulse would switch it off.
+        """
+        if not self.actuator.keep_running(self.name, seconds):
+            start = max(offset for offset, relay, on in self.on_steps)
+            self.actuator.run(self.name, self.on_steps + [
+                (start + seconds + offset, relay, on) for offset, relay, on in self.off_steps])
+
+
+# The devices of the box, shared by the scheduler and the dashboard.
+def humidifier_device(actuator):
+    # R2 powers the humidifier, a short pulse on R3 presses its button
+    return Device(actuator, 'humidifier', [(0, 'R2', True), (3, 'R3', True), (4, 'R3', False)],
+                  [(0, 'R2', False)], relay='R2')
+
+
+def fan_device(actuator):
+    return Device(actuator, 'fan', [(0, 'R1', True)], [(0, 'R1', False)], relay='R1')
+
+
+def channel(name):
+    """Measurement: one channel of the sample, e.g. channel('Humid1')."""
+    return lambda sample: getattr(sample, name)
+
+
+def sample_vpd(sensor='1'):
+    """Measurement: VPD in kPa from the temperature and humidity of a sensor."""
+    temp, humid = derived.SENSORS[sensor]
+    return lambda sample: float(derived.vpd(getattr(sample, temp), getattr(sample, humid)))
+
+
+class Hysteresis:
+    """On below low, off above high; on_below=False for the other way round."""
+
+    def __init__(self, low, high, on_below=True):
+        self.low = low
+        self.high = high
+        self.on_below = on_below
+
+    def update(self, value, now, on):
+        if value < self.low:
+            return self.on_below
+        if value > self.high:
+            return not self.on_below
+        return on   # inside the band: keep the state
+
+
+class PID:
+    """PID on the error, switching on for duty * window seconds per window.
+
+    reverse=False: the device raises the value (humidifier on humidity),
+    reverse=True: it lowers it (fan on humidity).
+    """
+
+    def __init__(self, setpoint, kp, ki=0.0, kd=0.0, window=300, reverse=False):
+        self.setpoint = setpoint
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.window = window
+        self.reverse = reverse
+        self._integral = 0.0
+        self._error = None
+        self._time = None
+        self._window_start = None
+        self.duty = 0.0
+
+    def update(self, value, now, on):
+        error = self.setpoint - value
+        if self.reverse:
+            error = -error
+        dt = 0.0 if self._time is None else now - self._time
+        derivative = 0.0 if self._error is None or dt <= 0 else (error - self._error) / dt
+        integral = self._integral + error * dt
+        duty = self.kp * error + self.ki * integral + self.kd * derivative
+        # anti windup: only integrate while the output isn't saturated
+        if 0 < duty < 1:
+            self._integral = integral
+        self.duty = min(max(duty, 0.0), 1.0)
+        self._error, self._time = error, now
+        if self._window_start is None or now - self._window_start >= self.window:
+            self._window_start = now
+        return now - self._window_start < self.duty * self.window
+
+
+def vpd_target(device, target, band=0.1, sensor='1', **limits):
+    """Controller keeping the VPD of a sensor within target +- band.
+
+    Meant for the humidifier: the VPD is too high when the air is too dry.
+    """
+    return Controller(device, sample_vpd(sensor), Hysteresis(target - band, target + band,
+                                                              on_below=False), **limits)
+
+
+class Controller:
+    """Switch a device from the sample stream. Subscribe update() to the Sampler."""
+
+    def __init__(self, device, measure, mode, min_on=0, min_off=0, max_switches=None):
+        self.device = device
+        self.measure = measure
+        self.mode = mode
+        self.min_on = min_on
+        self.min_off = min_off
+        self.max_switches = max_switches        # per hour, None for no limit
+        self.on = False
+        self.value = None
+        self._changed = None                    # monotonic time of the last switch
+        self._switches = collections.deque()    # monotonic times in the last hour
+        self.switches = 0
+        self.limited = 0                        # switches held back by the limits
+        self.latency = None                     # of the last switch, seconds
+        self.max_latency = 0.0
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+    def update(self, sample):
+        now = time.monotonic()
+        value = self.measure(sample)
+        if value is None or math.isnan(value):
+            return
+        self.value = value
+        if self.device.busy():
+            # steps still running (humidon() or the last switch): switching
+            # now could pulse the humidifier's button again and toggle it off
+            return
+        # switched from the dashboard (or by hand) since the last sample?
+        self.on = self.device.is_on()
+        want = bool(self.mode.update(value, now, self.on))
+        if want == self.on:
+            return
+        if not self._allowed(want, now):
+            self.limited += 1
+            return
+        self.on = want
+        self._changed = now
+        self._switches.append(now)
+        self.switches += 1
+        read_time = sample.timestamp.timestamp()
+        self.device.switch(want, on_start=lambda t: self._switched(want, t - read_time))
+
+    def _allowed(self, want, now):
+        if self._changed is not None:
+            if want and now - self._changed < self.min_off:
+                return False
+            if not want and now - self._changed < self.min_on:
+                return False
+        while self._switches and now - self._switches[0] > 3600:
+            self._switches.popleft()
+        if self.max_switches is not None and len(self._switches) >= self.max_switches:
+            # always allow switching off
+            return not want
+        return True
+
+    def _switched(self, on, latency):
+        # on the actuator thread, right after the relay was switched
+        self.latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._latency_sum += latency
+        self._latency_count += 1
+        print("Controller {}: {} at {:.2f}, {:.3f} s after the sensor read".format(
+            self.device.name, 'on' if on else 'off', self.value, latency))
+        if latency > LATENCY_WARNING:
+            print("Controller {}: switching took longer than {} s".format(
+                self.device.name, LATENCY_WARNING))
+
+    def status(self):
+        mean = self._latency_sum / self._latency_count if self._latency_count else None
+        return dict(device=self.device.name, on=self.on, value=self.value,
+                    switches=self.switches, limited=self.limited,
+                    latency=self.latency, mean_latency=mean, max_latency=self.max_latency)
@@ -1,6 +1,8 @@
-from dash import Dash, dcc, html, Input, Output, State, callback
-import plotly.express as px
-import pandas as pd
+from dash import Dash, dcc, html, Input, Output, State, callback, no_update
+from dash.exceptions import PreventUpdate
+from figures import line_figure, visible_range, chart_range, UNCHANGED, tail_state, extend_data, trace_series
+from rollup import RollupSnapshots
+from derived import with_derived
 
 app = Dash(__name__)
 app.layout = html.Div([
@@ -10,18 +12,24 @@ app.layout = html.Div([
         #html.P("Temperatur:"),
         #dcc.Graph(id="time-series-chart_temp"),
         dcc.Graph(id='time-series-chart-temp', style={'width': '100vh', 'height': '40vh','padding': 5}),
+        # what this browser has of the chart, see figures.tail_state()
+        dcc.Store(id='time-series-chart-temp-state'),
         dcc.Interval(
             id='interval-component-t',
             interval=10*1000, # in milliseconds
             n_intervals=0
         ),
         dcc.Graph(id='time-series-chart-humid', style={'width': '100vh', 'height': '40vh','padding': 5}),
+        # what this browser has of the chart, see figures.tail_state()
+        dcc.Store(id='time-series-chart-humid-state'),
         dcc.Interval(
             id='interval-component-humid',
             interval=10*1000, # in milliseconds
             n_intervals=0
         ),
         dcc.Graph(id='time-series-chart-vpd', style={'width': '100vh', 'height': '40vh','padding': 5}),
+        # what this browser has of the chart, see figures.tail_state()
+        dcc.Store(id='time-series-chart-vpd-state'),
         dcc.Interval(
             id='interval-component-vpd',
             interval=10*1000, # in milliseconds
@@ -42,7 +50,18 @@ app.layout = html.Div([
             children='Enter a value in seconds and press Start'),
         html.Div(dcc.Input(id='input-on-submit-humid', type='text')),
         html.Button('Start', id='submit-val-humid', n_clicks=0),
-        html.Img(src=app.get_asset_url('cam.png'), id='campic')
+        # live MJPEG stream, see /camera.mjpg below
+        html.Img(src='/camera.mjpg', id='campic', style={'width': '100%'}),
+        html.P("Timelapse:"),
+        dcc.Dropdown(id='timelapse-segment', clearable=False),
+        html.Video(id='timelapse-video', controls=True, style={'width': '100%'}),
+        html.P("Latest pictures:"),
+        html.Div(id='cam-gallery'),
+        dcc.Interval(
+            id='interval-component-timelapse',
+            interval=60*1000, # in milliseconds
+            n_intervals=0
+        ),
         #html.Img(src=Dash.get_asset_url('opencv_frame_1.png')) 
     ], style={'padding': 10,'width': '50vh', 'flex': 1})
 ], style={'display': 'flex', 'flexDirection': 'row'})
@@ -54,71 +73,107 @@ app.layout = html.Div([
     #     clearable=False,
     # ),
 
-# for threading
-import threading
-def run_threaded(job_func):
-    job_thread = threading.Thread(target=job_func)
-    job_thread.start()
-
-# for relay control
-import time
-import RPi.GPIO as GPIO
-GPIO.setmode(GPIO.BCM) # GPIO Numbers instead of board numbers
-RELAIS_1_GPIO = 4
-RELAIS_2_GPIO = 17
-RELAIS_3_GPIO = 27
-RELAIS_4_GPIO = 22
-
-#GPIO.setup(RELAIS_1_GPIO, GPIO.OUT) # GPIO Assign mode
-       
-# Turn on / off Relais 1
-def R1on():
-    GPIO.setup(RELAIS_1_GPIO, GPIO.OUT) # GPIO Assign mode
-    print("R1 on")
-    GPIO.output(RELAIS_1_GPIO, GPIO.HIGH) # on
-    #	GPIO.cleanup()  
-def R1off():
-    GPIO.setup(RELAIS_1_GPIO, GPIO.OUT) # GPIO Assign mode
-    print("R1 off")
-    GPIO.output(RELAIS_1_GPIO, GPIO.LOW) # off
-# Turn on / off Relais 2
-def R2on():
-	GPIO.setup(RELAIS_2_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R2 on")
-	GPIO.output(RELAIS_2_GPIO, GPIO.HIGH) # on
-
-def R2off():
-	GPIO.setup(RELAIS_2_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R2 off")
-	GPIO.output(RELAIS_2_GPIO, GPIO.LOW) # off
-
-# Turn on / off Relais 3
-def R3on():
-	GPIO.setup(RELAIS_3_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R3 on")
-	GPIO.output(RELAIS_3_GPIO, GPIO.HIGH) # on
-
-def R3off():
-	GPIO.setup(RELAIS_3_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R3 off")
-	GPIO.output(RELAIS_3_GPIO, GPIO.LOW) # off
-
-# Turn on / off Relais 4
-def R4on():
-	GPIO.setup(RELAIS_4_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R4 on")
-	GPIO.output(RELAIS_4_GPIO, GPIO.HIGH) # on
-
-def R4off():
-	GPIO.setup(RELAIS_4_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R4 off")
-	GPIO.output(RELAIS_4_GPIO, GPIO.LOW) # off
+# for relay control (see relays.py); RELAY_BACKEND 'gpio' on the Pi,
+# 'sim' to run the dashboard without relays
+from relays import Actuator, RelayBank, RELAY_PINS, open_backend
+RELAY_BACKEND = 'gpio'
+# the scheduler switches the same relays, so the pins are read back
+relaybank = RelayBank(RELAY_PINS, open_backend(RELAY_BACKEND), shared=True)
+
+# Timed relay changes run on the actuator thread (see relays.py), the
+# callbacks only queue them. Pressing Start again restarts the countdown
+# (the humidifier keeps running, its button isn't pressed again), 0 seconds
+# stops the device.
+actuator = Actuator(relaybank)
+# the relay steps of the devices, the same as in the scheduler
+from controller import humidifier_device, fan_device
+humidifier = humidifier_device(actuator)
+fan = fan_device(actuator)
+
+def windon(duration=30):
+    print("Wind on for " + str(duration)+ " seconds")
+    fan.run_for(duration)
+
+def humidon(duration=30):
+    print("Humindifier on for "+ str(duration) +" seconds")
+    humidifier.run_for(duration)
+
+# Camera stream: main_scheduler.py publishes the newest frame (see camera.py),
+# it is read once into memory and streamed to all viewers
+from flask import Response
+from camera import FileFrameSource, FrameBuffer, LIVE_PATH, mjpeg_stream
+CAM_STREAM_FPS = 2
+frames = FrameBuffer()
+FileFrameSource(frames, LIVE_PATH, fps=CAM_STREAM_FPS)
+
+@app.server.route('/camera.mjpg')
+def camera_stream():
+    return Response(mjpeg_stream(frames, max_fps=CAM_STREAM_FPS),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# Timelapse segments written by main_scheduler.py (see timelapse.py)
+import os
+from flask import send_from_directory
+from timelapse import TIMELAPSE_DIR, segments, writing, newest_closed
+
+@app.server.route('/timelapse/<name>')
+def timelapse_video(name):
+    # send_from_directory answers range requests, so the player can seek
+    return send_from_directory(os.path.abspath(TIMELAPSE_DIR), name)
+
+@callback(
+    Output('timelapse-segment', 'options'),
+    Output('timelapse-segment', 'value'),
+    Input('interval-component-timelapse', 'n_intervals'),
+    State('timelapse-segment', 'value'))
+def update_timelapse_segments(n, value):
+    names = segments()
+    if value not in names:
+        # newest finished segment by default, today's can't be played yet
+        value = newest_closed(names)
+    open_segment = writing()
+    return [{'label': os.path.splitext(f)[0] + (' (recording)' if f == open_segment else ''), 'value': f}
+            for f in names], value
+
+# thumbnails written by camstore.py, newest first; links to the full size
+# picture while it is kept
+GALLERY_SIZE = 12
+
+@callback(
+    Output('cam-gallery', 'children'),
+    Input('interval-component-timelapse', 'n_intervals'))
+def update_gallery(n):
+    thumbs = os.path.join(app.config.assets_folder, 'thumbs')
+    names = sorted(os.listdir(thumbs), reverse=True)[:GALLERY_SIZE] if os.path.isdir(thumbs) else []
+    return [html.A(html.Img(src=app.get_asset_url('thumbs/' + name), title=name),
+                   href=app.get_asset_url(name), target='_blank')
+            for name in names]
+
+@callback(
+    Output('timelapse-video', 'src'),
+    Input('timelapse-segment', 'value'))
+def play_timelapse(name):
+    return '/timelapse/' + name if name else None
 
 # load Data
+# the loader keeps the parsed log between calls and only parses new rows
+# (the log format the logger writes, LOG_BACKEND in sensorlog.py)
+from dataloader import open_log, SnapshotCache
+loader = open_log()
+# one shared snapshot per data version for all callbacks and sessions,
+# VPD, dew point and absolute humidity are computed from Temp/Humid on read
+snapshots = SnapshotCache(loader, derive=with_derived)
+# 1 min / 15 min / 1 h rollups written by the logger, see rollup.py
+rollups = RollupSnapshots(snapshots)
 def loaddata():
-    df = pd.read_csv('sensor_readings_bme280_long.csv')
-    df["date"] = pd.to_datetime(df["date"],dayfirst=True) 
-    return df
+    return snapshots.get()
+
+# Points per trace sent to the browser, about the chart width in pixels
+CHART_POINTS = {
+    'temp': dict(max_points=1000, method='lttb'),
+    'humid': dict(max_points=1000, method='lttb'),
+    'vpd': dict(max_points=1000, method='lttb'),
+}
 
 # Fan
 @callback(
@@ -128,15 +183,12 @@ def loaddata():
     prevent_initial_call=True
 )
 def update_output(n_clicks, value):
-       
-    def windon(duration = 30):
-        print("Wind on for " + str(duration)+ " seconds")
-        R1on()
-        time.sleep(duration)
-        R1off()
-    
-    windon(duration=int(value))
-
+    duration = int(value)
+    if duration <= 0:
+        actuator.cancel('fan')
+        return 'Fan stopped'
+    # returns at once, the actuator switches the fan off later
+    windon(duration=duration)
     return 'Fan running for {} secondsand the button has been clicked {} times'.format(
         value,
         n_clicks
@@ -150,39 +202,31 @@ def update_output(n_clicks, value):
     prevent_initial_call=True
 )
 def update_output(n_clicks, value):
-    
-  
-    def humidon(duration=30):
-        print("Humindifier on for "+ str(duration) +" seconds")
-        R2on()
-        time.sleep(2)
-        R3on()
-        time.sleep(1)
-        R3off()
-        time.sleep(duration)
-        R2off()
-        print("Humindifier off")
-    
-    run_threaded(humidon(duration=int(value)))
+    duration = int(value)
+    if duration <= 0:
+        actuator.cancel('humidifier')
+        return 'Humidifier stopped'
+    humidon(duration=duration)
     return 'Humidifier is running for {} seconds and the button has been clicked {} times'.format(
         value,
         n_clicks
     )
 
 
-@app.callback(
-    Output("time-series-chart-temp", "figure"), 
-   # Output("time-series-chart_temp", "figure"), 
-   Input('interval-component-t', 'n_intervals'))
-
-def display_time_series(ticker):
-        
-    df = loaddata()
-    # selecting rows based on condition
-    df = df[((df['type'] == 'Temp1') | (df['type'] == 'Temp2'))]
-    
-    fig = px.line(df, x="date", y="value", color = "type", 
-                    labels=dict(date="Time", value="Temperature (°C)", type="Sensor"))
+# The charts are built when the page loads and when the visible range
+# changes; the interval then only appends new points (see live_updates).
+# Relayouts that don't move the x axis (autosize, pan mode, y zoom) keep the
+# figure; a rebuild then uses the range stored in the chart's state.
+def relayout_changes_range(relayout, state):
+    if state and visible_range(relayout) is UNCHANGED:
+        raise PreventUpdate
+
+def temp_figure(relayout, state=None):
+    # series straight from the store, no filtering,
+    # at the coarsest resolution that still fills the visible range
+    x_range = chart_range(relayout, state and state.get('range'))
+    resolution, snap = rollups.select(x_range, CHART_POINTS['temp']['max_points'])
+    fig = line_figure(snap, ['Temp1', 'Temp2'], "Temperature (°C)", x_range=x_range, **CHART_POINTS['temp'])
                     #range_x=['2024-04-30','2024-05-01'],)
     fig.update_xaxes(#rangeslider_visible=True, 
                      rangeselector=dict(
@@ -208,17 +252,21 @@ def display_time_series(ticker):
     fig.update_layout(uirevision="fix")
     #fig['layout']['uirevision'] = 'some-constant'
     
-    return fig
+    return fig, tail_state(fig, snap, trace_series(['Temp1', 'Temp2']), resolution, x_range)
+
 @app.callback(
-    Output("time-series-chart-humid", "figure"),
-    Input('interval-component-humid', 'n_intervals'))
+    Output("time-series-chart-temp", "figure"), 
+    Output("time-series-chart-temp-state", "data"),
+    Input("time-series-chart-temp", "relayoutData"),
+    State("time-series-chart-temp-state", "data"))
+def display_time_series(relayout, state):
+    relayout_changes_range(relayout, state)
+    return temp_figure(relayout, state)
 
-def display_time_series(ticker):
-    df = loaddata()
-    # selecting rows based on condition
-    df = df[((df['type'] == 'Humid1') | (df['type'] == 'Humid2'))]
-    
-    fig = px.line(df, x="date", y="value", color = "type",labels=dict(date="Time", value="Humidity (%)", type="Sensor"))
+def humid_figure(relayout, state=None):
+    x_range = chart_range(relayout, state and state.get('range'))
+    resolution, snap = rollups.select(x_range, CHART_POINTS['humid']['max_points'])
+    fig = line_figure(snap, ['Humid1', 'Humid2'], "Humidity (%)", x_range=x_range, **CHART_POINTS['humid'])
 
     fig.update_layout(title_text="Humidity in %", title_font_size=30, yaxis_range=[30,100])
     fig.update_yaxes(minor_tickmode="auto")
@@ -233,17 +281,21 @@ def display_time_series(ticker):
                         dict(step="all") ]))
                     )
     fig['layout']['uirevision'] = 'some-constant'
-    return fig
+    return fig, tail_state(fig, snap, trace_series(['Humid1', 'Humid2']), resolution, x_range)
 
 @app.callback(
-    Output("time-series-chart-vpd", "figure"),
-    Input('interval-component-vpd', 'n_intervals'))
+    Output("time-series-chart-humid", "figure"),
+    Output("time-series-chart-humid-state", "data"),
+    Input("time-series-chart-humid", "relayoutData"),
+    State("time-series-chart-humid-state", "data"))
+def display_time_series(relayout, state):
+    relayout_changes_range(relayout, state)
+    return humid_figure(relayout, state)
 
-def display_time_series(ticker):
-    df = loaddata()
-    # selecting rows based on condition
-    df = df[((df['type'] == 'vpd1') | (df['type'] == 'vpd2'))]
-    fig = px.line(df, x="date", y="value", color = "type",labels=dict(date="Time", value="VPD", type="Sensor"))
+def vpd_figure(relayout, state=None):
+    x_range = chart_range(relayout, state and state.get('range'))
+    resolution, snap = rollups.select(x_range, CHART_POINTS['vpd']['max_points'])
+    fig = line_figure(snap, ['vpd1', 'vpd2'], "VPD", x_range=x_range, **CHART_POINTS['vpd'])
     fig.update_layout(title_text="Vapor Pressure Deficit",
                   title_font_size=30)#,
                   #yaxis_range=[30,100])
@@ -259,7 +311,46 @@ def display_time_series(ticker):
                         dict(step="all") ]))
                     )
     fig['layout']['uirevision'] = 'some-constant'
-    return fig
+    return fig, tail_state(fig, snap, trace_series(['vpd1', 'vpd2']), resolution, x_range)
+
+@app.callback(
+    Output("time-series-chart-vpd", "figure"),
+    Output("time-series-chart-vpd-state", "data"),
+    Input("time-series-chart-vpd", "relayoutData"),
+    State("time-series-chart-vpd-state", "data"))
+def display_time_series(relayout, state):
+    relayout_changes_range(relayout, state)
+    return vpd_figure(relayout, state)
+
+# Each tick sends only the points newer than what the browser has. When too
+# many points were appended to the downsampled traces since the last build
+# (REBUILD_FRACTION of max_points), the figure is built again instead.
+REBUILD_FRACTION = 0.1
+
+def live_updates(chart, graph, interval, make_figure):
+    @app.callback(
+        Output(graph, "extendData"),
+        Output(graph, "figure", allow_duplicate=True),
+        Output(graph + "-state", "data", allow_duplicate=True),
+        Input(interval, 'n_intervals'),
+        State(graph + "-state", "data"),
+        State(graph, "relayoutData"),
+        prevent_initial_call=True)
+    def extend_time_series(ticker, state, relayout):
+        if not state or not state['live']:
+            # showing older data, nothing to append
+            raise PreventUpdate
+        extend, state = extend_data(rollups.get(state['resolution']), state)
+        if state['appended'] > REBUILD_FRACTION * CHART_POINTS[chart]['max_points']:
+            fig, state = make_figure(relayout, state)
+            return no_update, fig, state
+        if extend is None:
+            raise PreventUpdate
+        return extend, no_update, state
+
+live_updates('temp', "time-series-chart-temp", 'interval-component-t', temp_figure)
+live_updates('humid', "time-series-chart-humid", 'interval-component-humid', humid_figure)
+live_updates('vpd', "time-series-chart-vpd", 'interval-component-vpd', vpd_figure)
 
 
 app.run_server(debug=True)
\ No newline at end of file
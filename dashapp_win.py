@@ -2,9 +2,15 @@
 # Packages
 ###############################################################
 
-from dash import Dash, dcc, html, Input, Output, callback
-import plotly.express as px
-import pandas as pd
+from dash import Dash, dcc, html, Input, Output, State, Patch, ctx
+from dash.exceptions import PreventUpdate
+import plotly.graph_objects as go
+from dataloader import open_log, SnapshotCache
+from figures import line_traces, visible_range, range_data, stored_range, UNCHANGED
+from rollup import RollupSnapshots
+from derived import with_derived
+import metrics
+from callbackprofile import CallbackProfiler, phase
 
 ################################################################
 # Dash App Initialization
@@ -31,11 +37,36 @@ app.layout = html.Div([
 # Data Loading Function
 ###############################################################
 
-# Function to load data from CSV
+# Persistent loader: remembers the byte offset and the parsed data,
+# so every refresh only parses the rows appended since the last call
+# (the log format the logger writes, LOG_BACKEND in sensorlog.py)
+loader = open_log()
+# one shared snapshot per data version for all callbacks and sessions,
+# VPD, dew point and absolute humidity are computed from Temp/Humid on read
+snapshots = SnapshotCache(loader, derive=with_derived)
+# 1 min / 15 min / 1 h rollups written by the logger, see rollup.py
+rollups = RollupSnapshots(snapshots)
+
+# Points per trace sent to the browser, about the chart width in pixels.
+# method: 'lttb' keeps the shape of the line, 'minmax' every extreme value
+CHART_POINTS = {
+    'temp': dict(max_points=500, method='lttb'),
+    'humid': dict(max_points=500, method='lttb'),
+    'vpd': dict(max_points=500, method='lttb'),
+}
+
+# Callback profiling (see callbackprofile.py): time, phases and response size
+# of every callback, shown on the Misc tab; calls slower than PROFILE_SLOW
+# seconds are logged and their sampled stacks written to PROFILE_DIR
+PROFILE_CALLBACKS = False
+PROFILE_SLOW = 0.5
+PROFILE_DIR = 'profiles'
+profiler = CallbackProfiler(PROFILE_SLOW, PROFILE_DIR) if PROFILE_CALLBACKS else None
+
+# Function to load data: per-series arrays of the current data version
 def loaddata():
-    df = pd.read_csv('sensor_readings_bme280_long.csv')
-    df["date"] = pd.to_datetime(df["date"], dayfirst=True) 
-    return df
+    with phase('load'):
+        return snapshots.get()
 
 ################################################################
 # Callbacks
@@ -68,24 +99,27 @@ def render_content(tab):
                 html.Div(id='current-vpd-values2', style={'width': '33%', 'display': 'inline-block', 'background-color': 'green', 'color': 'white', 'font-size': '20px', 'text-align': 'center'}),
             ], style={'width': '100%', 'display': 'flex', 'justify-content': 'center'}),
             
-            # Placeholder Text in Row 3
+            # Derived values and placeholder text in Row 3
             html.Div(children=[
-                html.Div(children='Test', style={'width': '33%', 'display': 'inline-block'}),
-                html.Div(children='Test', style={'width': '33%', 'display': 'inline-block'}),
+                html.Div(id='current-dew-values', style={'width': '33%', 'display': 'inline-block'}),
+                html.Div(id='current-ah-values', style={'width': '33%', 'display': 'inline-block'}),
                 html.Div(children='Test', style={'width': '33%', 'display': 'inline-block'}),
             ], style={'width': '100%', 'display': 'flex', 'justify-content': 'center'}),
             
             # Temperature Chart in Row 4, Column A
             dcc.Graph(id='time-series-chart-temp', style={'width': '33%', 'display': 'inline-block'}),
             dcc.Interval(id='interval-component-t', interval=10*1000, n_intervals=0),
+            dcc.Store(id='time-series-chart-temp-range'),
             
             # Humidity Chart in Row 4, Column B
             dcc.Graph(id='time-series-chart-humid', style={'width': '33%', 'display': 'inline-block'}),
             dcc.Interval(id='interval-component-humid', interval=10*1000, n_intervals=0),
+            dcc.Store(id='time-series-chart-humid-range'),
             
             # Vapor Pressure Deficit Chart in Row 4, Column C
             dcc.Graph(id='time-series-chart-vpd', style={'width': '33%', 'display': 'inline-block'}),
             dcc.Interval(id='interval-component-vpd', interval=10*1000, n_intervals=0),
+            dcc.Store(id='time-series-chart-vpd-range'),
         ])
     elif tab == 'tab-historic':
         return html.Div(children=[
@@ -99,208 +133,120 @@ def render_content(tab):
         ])
     elif tab == 'tab-misc':
         return html.Div(children=[
-            html.H4('Misc')
-            # Add your content for Misc here
+            html.H4('Misc'),
+            html.Div(id='scheduler-metrics'),
+            html.H5('Callbacks'),
+            html.Div(id='callback-profile'),
+            dcc.Interval(id='interval-component-misc', interval=10*1000, n_intervals=0),
         ])
 
-# Callback to update the Temperature Chart
-@app.callback(
-    Output("time-series-chart-temp", "figure"), 
-    Input('interval-component-t', 'n_intervals'))
-def display_time_series_temp(ticker):
-    df = loaddata()
-    df = df[((df['type'] == 'Temp1') | (df['type'] == 'Temp2'))]
-    
-    fig = px.line(df, x="date", y="value", color="type", 
-                  labels=dict(date="Time", value="Temperature (°C)", type="Sensor"))
-    fig.update_xaxes(rangeslider_visible=True,
-                     rangeselector=dict(
-        buttons=list([
-            dict(count=10, label="10 mim", step="minute", stepmode="backward"),
-            dict(count=2, label="2 h", step="hour", stepmode="backward"),
-            dict(count=12, label="12 h", step="hour", stepmode="todate"),
-            dict(count=2, label="2 days", step="day", stepmode="backward"),
-            dict(step="all") 
-        ])
-    ))
-    fig.update_layout(title_text="Temperature in °C", title_font_size=16, title_x=0.5)
-    fig.update_yaxes(title=None)
-    fig.update_xaxes(tickangle=0)
-    fig.update_layout(
-        xaxis=dict(
-            rangeslider=dict(
-                thickness=0.05,  # Hier wird die Dicke des Rangesliders in vertikaler Richtung festgelegt
-            )
-        ),
-        legend=dict(orientation="h", yanchor="bottom", y=1, xanchor="center", x=0.5) # Legende zentral ausrichten
-    )
-    fig.update_layout(
-        xaxis_title="Time",
-        legend_title="Sensor"
-    )
-    fig.update_layout(uirevision="fix")
-    
-    # Neu: Breite des Div-Elements anpassen
-    fig.update_layout(width=500)
-    
-    # Neu: Buttons unterhalb der Grafik
+# Chart layouts
+# The layouts never change, so they are built once at startup. A callback
+# only computes the traces: when the graph is created or zoomed it sends the
+# traces with the cached layout, on an interval tick only the new trace data
+# as a dash.Patch, the browser keeps the rest of the figure.
+RANGE_BUTTONS = [
+    dict(count=10, label="10 mim", step="minute", stepmode="backward"),
+    dict(count=2, label="2 h", step="hour", stepmode="backward"),
+    dict(count=12, label="12 h", step="hour", stepmode="todate"),
+    dict(count=2, label="2 days", step="day", stepmode="backward"),
+    dict(step="all")
+]
+RANGE_BUTTONS_TODATE = [dict(b, stepmode="todate") if 'count' in b else b for b in RANGE_BUTTONS]
+
+def chart_layout(title, buttons=RANGE_BUTTONS, **layout):
+    fig = go.Figure()
     fig.update_layout(
+        title=dict(text=title, font_size=16, x=0.5),
         xaxis=dict(
+            title="Time",
+            tickangle=0,
+            rangeslider=dict(visible=True, thickness=0.05),
             rangeselector=dict(
-                buttons=list([
-                    dict(count=10, label="10 mim", step="minute", stepmode="backward"),
-                    dict(count=2, label="2 h", step="hour", stepmode="backward"),
-                    dict(count=12, label="12 h", step="hour", stepmode="todate"),
-                    dict(count=2, label="2 days", step="day", stepmode="backward"),
-                    dict(step="all") 
-                ]),
+                buttons=buttons,
                 x=0.1,
                 y=-0.2, # Positionierung der Buttons unterhalb der Grafik
                 xanchor='left',
                 yanchor='bottom',
                 bgcolor='rgba(0,0,0,0)'
             ),
-            showticklabels=False, # Die ursprünglichen Buttons über der Grafik ausblenden
-        )
+            showticklabels=False,
+        ),
+        legend=dict(title="Sensor", tracegroupgap=0, orientation="h",
+                    yanchor="bottom", y=1, xanchor="center", x=0.5), # Legende zentral ausrichten
+        margin=dict(t=60, l=50), # Graph etwas nach links verschieben
+        width=500,
+        uirevision='some-constant',
     )
-    
-    # Neu: Graph etwas nach links verschieben
-    fig.update_layout(margin=dict(l=50))
-    
-    return fig
+    fig.update_layout(**layout)
+    return fig.layout.to_plotly_json()
+
+LAYOUTS = {
+    'temp': chart_layout("Temperature in °C", uirevision="fix"),
+    'humid': chart_layout("Humidity in %", RANGE_BUTTONS_TODATE, yaxis_range=[30, 100]),
+    'vpd': chart_layout("Vapor Pressure Deficit in kPa"),
+}
+
+# series and hover label of each chart
+CHART_SERIES = {
+    'temp': (['Temp1', 'Temp2'], "Temperature (°C)"),
+    'humid': (['Humid1', 'Humid2'], "Humidity (%)"),
+    'vpd': (['vpd1', 'vpd2'], "VPD"),
+}
+
+# The visible range of each chart is kept in a dcc.Store: relayouts that
+# don't move the x axis (autosize, pan mode, y zoom) leave the chart as it
+# is, and the interval ticks keep drawing the stored range.
+def chart_figure(chart, relayout, stored):
+    names, ylabel = CHART_SERIES[chart]
+    tick = ctx.triggered_id is not None and ctx.triggered_id.startswith('interval-component')
+    x_range = visible_range(relayout)
+    if x_range is UNCHANGED:
+        if not tick:
+            raise PreventUpdate
+        x_range = stored_range(stored)
+    with phase('load'):
+        resolution, snap = rollups.select(x_range, CHART_POINTS[chart]['max_points'])
+    with phase('figure'):
+        traces = line_traces(snap, names, ylabel, x_range=x_range, **CHART_POINTS[chart])
+        if tick:
+            # the browser already has the figure, replace the trace data only
+            patch = Patch()
+            for i, trace in enumerate(traces):
+                patch['data'][i]['x'] = trace['x']
+                patch['data'][i]['y'] = trace['y']
+            return patch, range_data(x_range)
+        return dict(data=traces, layout=LAYOUTS[chart]), range_data(x_range)
+
+# Callback to update the Temperature Chart
+@app.callback(
+    Output("time-series-chart-temp", "figure"), 
+    Output("time-series-chart-temp-range", "data"),
+    Input('interval-component-t', 'n_intervals'),
+    Input("time-series-chart-temp", "relayoutData"),
+    State("time-series-chart-temp-range", "data"))
+def display_time_series_temp(ticker, relayout, stored):
+    return chart_figure('temp', relayout, stored)
 
 # Callback to update the Humidity Chart
 @app.callback(
     Output("time-series-chart-humid", "figure"),
-    Input('interval-component-humid', 'n_intervals'))
-def display_time_series_humid(ticker):
-    df = loaddata()
-    df = df[((df['type'] == 'Humid1') | (df['type'] == 'Humid2'))]
-    
-    fig = px.line(df, x="date", y="value", color="type",
-                  labels=dict(date="Time", value="Humidity (%)", type="Sensor"))
-    fig.update_layout(title_text="Humidity in %", title_font_size=16, title_x=0.5, yaxis_range=[30,100])
-    fig.update_yaxes(title=None)
-    fig.update_xaxes(tickangle=0)
-    fig.update_xaxes(rangeslider_visible=True, 
-                     rangeselector=dict(
-                         buttons=list([
-                             dict(count=10, label="10 mim", step="minute", stepmode="todate"),
-                             dict(count=2, label="2 h", step="hour", stepmode="todate"),
-                             dict(count=12, label="12 h", step="hour", stepmode="todate"),
-                             dict(count=2, label="2 days", step="day", stepmode="todate"),
-                             dict(step="all") 
-                         ])
-                     ))
-    fig.update_layout(
-        xaxis=dict(
-            rangeslider=dict(
-                thickness=0.05,  # Hier wird die Dicke des Rangesliders in vertikaler Richtung festgelegt
-            )
-        ),
-        legend=dict(orientation="h", yanchor="bottom", y=1, xanchor="center", x=0.5) # Legende zentral ausrichten
-    )
-    fig.update_layout(
-        xaxis_title="Time",
-        legend_title="Sensor"
-    )
-    fig['layout']['uirevision'] = 'some-constant'
-    
-    # Neu: Breite des Div-Elements anpassen
-    fig.update_layout(width=500)
-    
-    # Neu: Buttons unterhalb der Grafik
-    fig.update_layout(
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    dict(count=10, label="10 mim", step="minute", stepmode="todate"),
-                    dict(count=2, label="2 h", step="hour", stepmode="todate"),
-                    dict(count=12, label="12 h", step="hour", stepmode="todate"),
-                    dict(count=2, label="2 days", step="day", stepmode="todate"),
-                    dict(step="all") 
-                ]),
-                x=0.1,
-                y=-0.2, # Positionierung der Buttons unterhalb der Grafik
-                xanchor='left',
-                yanchor='bottom',
-                bgcolor='rgba(0,0,0,0)'
-            ),
-            showticklabels=False, # Die ursprünglichen Buttons über der Grafik ausblenden
-        )
-    )
-    
-    # Neu: Graph etwas nach links verschieben
-    fig.update_layout(margin=dict(l=50))
-    
-    return fig
+    Output("time-series-chart-humid-range", "data"),
+    Input('interval-component-humid', 'n_intervals'),
+    Input("time-series-chart-humid", "relayoutData"),
+    State("time-series-chart-humid-range", "data"))
+def display_time_series_humid(ticker, relayout, stored):
+    return chart_figure('humid', relayout, stored)
 
-# Callback to update the Vapor Pressure Deficit Chart
+# Callback to update the VPD Chart
 @app.callback(
     Output("time-series-chart-vpd", "figure"),
-    Input('interval-component-vpd', 'n_intervals'))
-def display_time_series_vpd(ticker):
-    df = loaddata()
-    df = df[((df['type'] == 'vpd1') | (df['type'] == 'vpd2'))]
-    
-    fig = px.line(df, x="date", y="value", color="type",
-                  labels=dict(date="Time", value="VPD", type="Sensor"))
-    fig.update_layout(title_text="Vapor Pressure Deficit in kPa", title_font_size=16, title_x=0.5)
-    fig.update_yaxes(title=None)
-    fig.update_xaxes(tickangle=0)
-    fig.update_xaxes(rangeslider_visible=True, 
-                     rangeselector=dict(
-                         buttons=list([
-                             dict(count=10, label="10 mim", step="minute", stepmode="backward"),
-                             dict(count=2, label="2 h", step="hour", stepmode="backward"),
-                             dict(count=12, label="12 h", step="hour", stepmode="todate"),
-                             dict(count=2, label="2 days", step="day", stepmode="backward"),
-                             dict(step="all") 
-                         ])
-                     ))
-    fig.update_layout(
-        xaxis=dict(
-            rangeslider=dict(
-                thickness=0.05,  # Hier wird die Dicke des Rangesliders in vertikaler Richtung festgelegt
-            )
-        ),
-        legend=dict(orientation="h", yanchor="bottom", y=1.0, xanchor="center", x=0.5) # Legende zentral ausrichten
-    )
-    fig.update_layout(
-        xaxis_title="Time",
-        legend_title="Sensor"
-    )
-    fig['layout']['uirevision'] = 'some-constant'
-    
-    # Neu: Breite des Div-Elements anpassen
-    fig.update_layout(width=500)
-    
-    # Neu: Buttons unterhalb der Grafik
-    fig.update_layout(
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    dict(count=10, label="10 mim", step="minute", stepmode="backward"),
-                    dict(count=2, label="2 h", step="hour", stepmode="backward"),
-                    dict(count=12, label="12 h", step="hour", stepmode="todate"),
-                    dict(count=2, label="2 days", step="day", stepmode="backward"),
-                    dict(step="all") 
-                ]),
-                x=0.1,
-                y=-0.2, # Positionierung der Buttons unterhalb der Grafik
-                xanchor='left',
-                yanchor='bottom',
-                bgcolor='rgba(0,0,0,0)'
-            ),
-            showticklabels=False, # Die ursprünglichen Buttons über der Grafik ausblenden
-        )
-    )
-    
-    # Neu: Graph etwas nach links verschieben
-    fig.update_layout(margin=dict(l=50))
-    
-    return fig
-
+    Output("time-series-chart-vpd-range", "data"),
+    Input('interval-component-vpd', 'n_intervals'),
+    Input("time-series-chart-vpd", "relayoutData"),
+    State("time-series-chart-vpd-range", "data"))
+def display_time_series_vpd(ticker, relayout, stored):
+    return chart_figure('vpd', relayout, stored)
 
 
 # Callback to update the current sensor values
@@ -311,17 +257,90 @@ def display_time_series_vpd(ticker):
     Output("current-temp-values2", "children"),
     Output("current-humid-values2", "children"),
     Output("current-vpd-values2", "children"),
+    Output("current-dew-values", "children"),
+    Output("current-ah-values", "children"),
     Input('interval-component-t', 'n_intervals'))
 def update_current_sensor_values(ticker):
-    df = loaddata()
-    current_temp1 = df[df['type'] == 'Temp1']['value'].iloc[-1]
-    current_temp2 = df[df['type'] == 'Temp2']['value'].iloc[-1]
-    current_humid1 = df[df['type'] == 'Humid1']['value'].iloc[-1]
-    current_humid2 = df[df['type'] == 'Humid2']['value'].iloc[-1]
-    current_vpd1 = df[df['type'] == 'vpd1']['value'].iloc[-1]
-    current_vpd2 = df[df['type'] == 'vpd2']['value'].iloc[-1]
+    snap = loaddata()
+    # last element of each series, no scan over the data
+    def current(name):
+        value = snap.latest(name)[1]
+        return None if value is None else round(float(value), 2)
+    current_temp1 = current('Temp1')
+    current_temp2 = current('Temp2')
+    current_humid1 = current('Humid1')
+    current_humid2 = current('Humid2')
+    current_vpd1 = current('vpd1')
+    current_vpd2 = current('vpd2')
+    current_dew1 = current('dew1')
+    current_dew2 = current('dew2')
+    current_ah1 = current('ah1')
+    current_ah2 = current('ah2')
     
-    return f'Temp1: {current_temp1}°C', f'Humid1: {current_humid1}%', f'VPD1: {current_vpd1} kPa', f'Temp2: {current_temp2}°C', f'Humid2: {current_humid2}%', f'VPD2: {current_vpd2} kPa'
+    return f'Temp1: {current_temp1}°C', f'Humid1: {current_humid1}%', f'VPD1: {current_vpd1} kPa', f'Temp2: {current_temp2}°C', f'Humid2: {current_humid2}%', f'VPD2: {current_vpd2} kPa', f'Dew point: {current_dew1}°C / {current_dew2}°C', f'Abs. humidity: {current_ah1} / {current_ah2} g/m³'
+
+# Scheduler metrics: main_scheduler.py serves them on port 9108 (see metrics.py)
+METRICS_URL = 'http://localhost:{}/metrics'.format(metrics.METRICS_PORT)
+
+def metrics_table(header, rows):
+    cell = {'padding': '2px 12px', 'text-align': 'right'}
+    return html.Table([html.Tr([html.Th(h, style=cell) for h in header])]
+                      + [html.Tr([html.Td(v, style=cell) for v in row]) for row in rows])
+
+def ms(seconds):
+    return '-' if seconds is None else '{:.1f} ms'.format(1000 * seconds)
+
+@app.callback(
+    Output('scheduler-metrics', 'children'),
+    Input('interval-component-misc', 'n_intervals'))
+def update_scheduler_metrics(ticker):
+    try:
+        parsed = metrics.fetch(METRICS_URL)
+    except OSError as e:
+        return html.P(f'No scheduler metrics at {METRICS_URL}: {e}')
+    durations = metrics.histogram_summary(parsed, 'scheduler_job_duration_seconds', 'job')
+    lags = metrics.histogram_summary(parsed, 'scheduler_start_lag_seconds', 'job')
+    waits = metrics.histogram_summary(parsed, 'scheduler_job_wait_seconds', 'job')
+    jobs = sorted(set(durations) | set(lags))
+    empty = dict(count=0, mean=None, p95=None)
+    job_rows = [[job, int(durations.get(job, empty)['count']),
+                 ms(durations.get(job, empty)['mean']), ms(durations.get(job, empty)['p95']),
+                 ms(lags.get(job, empty)['mean']), ms(lags.get(job, empty)['p95']),
+                 ms(waits.get(job, empty)['mean'])] for job in jobs]
+    def counter(name, key):
+        return int(parsed.get(name, {}).get((('key', key),), 0))
+    keys = sorted(dict(k)['key'] for k in parsed.get('scheduler_job_runs_total', {}))
+    key_rows = [[key] + [counter('scheduler_job_' + c, key) for c in
+                         ('runs_total', 'skipped_total', 'overruns_total', 'errors_total', 'running', 'queued')]
+                for key in keys]
+    reads = metrics.histogram_summary(parsed, 'sensor_read_seconds', None).get(None, empty)
+    handlers = metrics.histogram_summary(parsed, 'sampler_subscriber_seconds', 'subscriber')
+    handler_rows = [[name, int(h['count']), ms(h['mean']), ms(h['p95'])] for name, h in sorted(handlers.items())]
+    return [
+        html.H5('Jobs'),
+        metrics_table(['job', 'runs', 'duration', 'p95', 'start lag', 'p95', 'waiting'], job_rows),
+        metrics_table(['key', 'runs', 'skipped', 'overruns', 'errors', 'running', 'queued'], key_rows),
+        html.H5('Sensors'),
+        html.P(f"{int(reads['count'])} reads, {ms(reads['mean'])} on average, p95 {ms(reads['p95'])}"),
+        metrics_table(['subscriber', 'samples', 'duration', 'p95'], handler_rows),
+    ]
+
+# the slowest callbacks (by p95 of the wall time), when PROFILE_CALLBACKS is on
+@app.callback(
+    Output('callback-profile', 'children'),
+    Input('interval-component-misc', 'n_intervals'))
+def update_callback_profile(ticker):
+    if profiler is None:
+        return html.P('Callback profiling is off (PROFILE_CALLBACKS in dashapp_win.py)')
+    rows = [[r['callback'], r['calls'], ms(r['mean']), ms(r['p95']), ms(r['max']),
+             ms(r['load']), ms(r['figure']), ms(r['serialize']),
+             f"{r['mean_bytes'] / 1024:.1f} kB", f"{r['max_bytes'] / 1024:.1f} kB", r['slow']]
+            for r in profiler.worst()]
+    return metrics_table(['callback', 'calls', 'mean', 'p95', 'max', 'load', 'figure', 'serialize',
+                          'bytes', 'max bytes', 'slow'], rows)
+
+if profiler is not None:
+    profiler.install(app)
 
 # Run the Dash app
 app.config.suppress_callback_exceptions = True
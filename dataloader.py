@@ -0,0 +1,346 @@
+################################################################
+# Incremental loader for the sensor log
+###############################################################
+
+# The log only ever grows at the end (8 rows every 10 s), so instead of
+# re-reading the whole file on every dashboard refresh we remember how far we
+# got and only parse the bytes appended since the last call.
+
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import sensorlog
+from seriesstore import SeriesStore
+from sensorlog import BINFILE, LOCAL_TZ, V1_DATE_FORMAT, V1FILE, detect_version, read_binlog
+
+LOGFILE = V1FILE
+LONG_COLUMNS = ['date', 'value', 'type']
+# v1 format written by getSensors() in main_scheduler.py
+DATE_FORMAT = V1_DATE_FORMAT
+
+
+def empty_long_frame():
+    df = pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'),
+                       'value': pd.Series(dtype='float64'),
+                       'type': pd.Series(dtype='object')})
+    return df
+
+
+def parse_long_chunk(raw, columns=None):
+    # raw: bytes containing complete 'date,value,type' lines without header
+    if not raw.strip():
+        return empty_long_frame()
+    df = pd.read_csv(io.BytesIO(raw), names=LONG_COLUMNS, header=None,
+                     skipinitialspace=True)
+    # an explicit format is much faster than dayfirst inference
+    df['date'] = pd.to_datetime(df['date'], format=DATE_FORMAT, errors='coerce')
+    df['value'] = pd.to_numeric(df['value'], errors='coerce')
+    df['type'] = df['type'].astype(str).str.strip()
+    return df.dropna(subset=['date']).reset_index(drop=True)
+
+
+def wide_to_long(ts_ms, series, tz=LOCAL_TZ):
+    """Turn one-row-per-sample data into the long frame the dashboards expect.
+
+    ts_ms: epoch milliseconds (UTC), series: {name: values}.
+    """
+    if not len(ts_ms):
+        return empty_long_frame()
+    # dashboards show local time, like the timestamps in the v1 csv
+    dates = (pd.to_datetime(ts_ms, unit='ms', utc=True)
+             .tz_convert(tz).tz_localize(None).as_unit('ns'))
+    names = list(series)
+    n = len(ts_ms)
+    df = pd.DataFrame({
+        'date': np.tile(dates.to_numpy(), len(names)),
+        'value': np.concatenate([np.asarray(series[c], dtype='float64') for c in names]),
+        'type': np.repeat(np.array(names, dtype=object), n),
+    })
+    # keep the row order of the v1 csv: all channels of a sample together
+    order = np.arange(len(df)).reshape(len(names), n).T.ravel()
+    df = df.iloc[order].reset_index(drop=True)
+    return df.dropna(subset=['value']).reset_index(drop=True)
+
+
+def parse_v2_chunk(raw, columns):
+    # raw: bytes containing complete v2 rows (ts,Temp1,Temp2,...) without header
+    if not raw.strip():
+        return empty_long_frame()
+    df = pd.read_csv(io.BytesIO(raw), names=columns, header=None)
+    df = df.dropna(subset=['ts'])
+    ts_ms = df['ts'].to_numpy(dtype='int64') * 1000
+    return wide_to_long(ts_ms, {c: df[c].to_numpy(dtype='float64') for c in columns[1:]})
+
+
+class ChunkedFrame:
+    """refresh() / frame() / load() for the loaders below.
+
+    refresh() only appends the parsed new rows to a list of chunks, so it
+    costs as much as the new data. The chunks are concatenated into one
+    frame when frame() is called, and only if there are new ones. Callers
+    that refresh on every tick and need the data as arrays should use poll()
+    and a SeriesStore (see SnapshotCache) instead of frame().
+    """
+
+    def refresh(self):
+        """Read the rows appended since the last call. Returns their number."""
+        with self._lock:
+            new, reloaded = self._poll()
+            if len(new):
+                self._chunks.append(new)
+            return len(new)
+
+    def frame(self):
+        """The complete parsed log as one frame."""
+        with self._lock:
+            if len(self._chunks) > 1:
+                self._chunks = [pd.concat(self._chunks, ignore_index=True)]
+            return self._chunks[0] if self._chunks else self.empty()
+
+    def load(self):
+        """Return the complete parsed log, reading only the new part of the file."""
+        self.refresh()
+        return self.frame()
+
+
+class TailLoader(ChunkedFrame):
+    """Keep a parsed copy of a growing log and only parse what was appended.
+
+    Works for any csv that only grows at the end: the v1 long log, the v2
+    wide log and the rollups. The header (a column line, in v2 preceded by
+    the '# greenbox sensor log v2' line) is skipped and its columns are passed
+    to parse.
+    """
+
+    def __init__(self, path=LOGFILE, parse=parse_long_chunk, empty=empty_long_frame):
+        self.path = path
+        self.parse = parse
+        self.empty = empty
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self._reset()
+
+    def _reset(self):
+        self._offset = 0       # byte offset after the last complete line parsed
+        self._ident = None     # (device, inode) of the file we are reading
+        self._head = b''       # header lines of the file, used to spot rotation
+        self.columns = None
+        self._chunks = []      # parsed rows, see ChunkedFrame
+        self.rows = 0
+
+    def _needs_reload(self, st, f):
+        if self._ident is None:
+            return True
+        if (st.st_dev, st.st_ino) != self._ident:
+            return True   # file was replaced (rotation)
+        if st.st_size < self._offset:
+            return True   # file was truncated
+        if self._head:
+            f.seek(0)
+            if f.read(len(self._head)) != self._head:
+                return True   # rewritten in place
+        return False
+
+    def poll(self):
+        """Parse rows appended since the last call and return them.
+
+        Returns a tuple (new_rows, reloaded). When the file was truncated or
+        rotated the whole file is parsed again and reloaded is True.
+        """
+        with self._lock:
+            return self._poll()
+
+    def _poll(self):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            reloaded = self._ident is not None
+            self._reset()
+            return self.empty(), reloaded
+        with f:
+            st = os.fstat(f.fileno())
+            reloaded = self._needs_reload(st, f)
+            if reloaded:
+                self._reset()
+                self._ident = (st.st_dev, st.st_ino)
+                self.reloads += 1
+            if st.st_size == self._offset:
+                return self.empty(), reloaded
+            f.seek(self._offset)
+            raw = f.read(st.st_size - self._offset)
+
+        # only consume complete lines, a partial last line is read next time
+        end = raw.rfind(b'\n')
+        if end < 0:
+            return self.empty(), reloaded
+        raw = raw[:end + 1]
+        if self._offset == 0:
+            # skip comment lines and the column line
+            pos = 0
+            while raw.startswith(b'#', pos):
+                pos = raw.find(b'\n', pos) + 1
+            nl = raw.find(b'\n', pos)
+            if nl < 0:
+                return self.empty(), reloaded   # header not complete yet
+            self.columns = raw[pos:nl].decode().strip().split(',')
+            self._head = raw[:nl + 1]
+            self._offset = nl + 1
+            raw = raw[nl + 1:]
+        self._offset += len(raw)
+
+        new = self.parse(raw, self.columns)
+        self.rows += len(new)
+        return new, reloaded
+
+
+
+def records_to_long(rec, channels):
+    """Turn binary log records into the long frame the dashboards expect."""
+    return wide_to_long(rec['ts'], {c: rec[c] for c in channels})
+
+
+class BinaryTailLoader(ChunkedFrame):
+    """Same interface as TailLoader for the binary log written by sensorlog.py."""
+
+    def __init__(self, path=BINFILE):
+        self.path = path
+        self.empty = empty_long_frame
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self._reset()
+
+    def _reset(self):
+        self._count = 0        # records read so far
+        self._size = 0         # file size at the last read
+        self._ident = None
+        self._chunks = []      # parsed rows, see ChunkedFrame
+        self.rows = 0
+
+    def poll(self):
+        with self._lock:
+            return self._poll()
+
+    def _poll(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            reloaded = self._ident is not None
+            self._reset()
+            return self.empty(), reloaded
+        ident = (st.st_dev, st.st_ino)
+        # a new inode means rotation, a smaller file means truncation
+        reloaded = ident != self._ident or st.st_size < self._size
+        if reloaded:
+            self._reset()
+            self._ident = ident
+            self.reloads += 1
+        self._size = st.st_size
+        rec, channels = read_binlog(self.path, start=self._count)
+        self._count += len(rec)
+        new = records_to_long(rec, channels)
+        self.rows += len(new)
+        return new, reloaded
+
+
+
+def open_log(backend=None, prefix=''):
+    """Return a loader for the log the logger writes.
+
+    backend is the log format, sensorlog.LOG_BACKEND by default, so the
+    dashboards follow the logger and not files left over from a conversion.
+    """
+    backend = backend or sensorlog.LOG_BACKEND
+    path = sensorlog.log_path(backend, prefix)
+    if backend == 'binary':
+        return BinaryTailLoader(path)
+    if backend == 'csv2':
+        return TailLoader(path, parse=parse_v2_chunk)
+    return TailLoader(path)
+
+
+def loader_for(path):
+    """Return the loader for one log file of any format."""
+    version = detect_version(path)
+    if version == 'binary':
+        return BinaryTailLoader(path)
+    if version == 2:
+        return TailLoader(path, parse=parse_v2_chunk)
+    return TailLoader(path)
+
+
+################################################################
+# Shared snapshot
+###############################################################
+
+# All dashboard callbacks (and all browser sessions) ask for the data on their
+# own interval. A snapshot is built once per data version, i.e. once per change
+# of the log file, and the same immutable object is handed to every caller.
+
+class Snapshot:
+    """Immutable view of all series at one data version."""
+
+    def __init__(self, version, series):
+        self.version = version
+        self.series = series   # {name: (times, values)} array views
+
+    def get(self, name):
+        empty = (np.empty(0, dtype='datetime64[ns]'), np.empty(0))
+        return self.series.get(name, empty)
+
+    def latest(self, name):
+        times, values = self.get(name)
+        if not len(values):
+            return None, None
+        return times[-1], values[-1]
+
+
+class SnapshotCache:
+    """Hand out one shared snapshot per version of the log file.
+
+    New rows from the loader are appended to a SeriesStore, so building a
+    snapshot costs as much as the new data. Safe to call from concurrent Dash
+    callbacks: only one thread reloads while the others wait for it and then
+    get the same snapshot. Callers must treat the returned arrays as read-only.
+    """
+
+    def __init__(self, loader, store=None, derive=None):
+        self.loader = loader
+        # derive: optional function applied to every batch of new rows,
+        # e.g. derived.with_derived to compute VPD on read
+        self.derive = derive
+        self.store = store if store is not None else SeriesStore()
+        self._lock = threading.Lock()
+        self._snapshot = Snapshot(None, {})
+        self.builds = 0
+
+    def _version(self):
+        try:
+            st = os.stat(self.loader.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self):
+        version = self._version()
+        snap = self._snapshot
+        if snap.version == version and version is not None:
+            return snap
+        with self._lock:
+            # another thread may have built it while we were waiting
+            snap = self._snapshot
+            if snap.version == version and version is not None:
+                return snap
+            new, reloaded = self.loader.poll()
+            if reloaded:
+                self.store.clear()
+            if self.derive is not None:
+                new = self.derive(new)
+            self.store.extend_long(new)
+            snap = Snapshot(version, self.store.views())
+            self._snapshot = snap
+            self.builds += 1
+            return snap
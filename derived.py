@@ -0,0 +1,165 @@
+################################################################
+# Derived climate metrics
+###############################################################
+
+# VPD, dew point and absolute humidity from temperature (°C) and relative
+# humidity (%). All functions take scalars or NumPy arrays, so a whole
+# history is computed in one call.
+#
+# The dashboards compute these on read from Temp1/Humid1 and Temp2/Humid2,
+# so the vpd rows stored by older versions of main_scheduler.py (which
+# multiplied by the relative humidity twice) are not used for display.
+# To correct the stored values as well (stop the logger first):
+#   python derived.py backfill [logfile]
+
+import os
+import shutil
+import sys
+
+import numpy as np
+
+# Magnus / Tetens coefficients over water, as in calcvpd()
+A = 17.27
+B = 237.3    # °C
+E0 = 0.61078  # kPa
+
+# sensor number -> (temperature, humidity) series
+SENSORS = {'1': ('Temp1', 'Humid1'), '2': ('Temp2', 'Humid2')}
+
+
+def svp(T):
+    """Saturation vapour pressure in kPa."""
+    T = np.asarray(T, dtype='float64')
+    return E0 * np.exp(A * T / (T + B))
+
+
+def vpd(T, humidity):
+    """Vapour pressure deficit in kPa."""
+    return svp(T) * (1 - np.asarray(humidity, dtype='float64') / 100)
+
+
+def dew_point(T, humidity):
+    """Dew point in °C."""
+    T = np.asarray(T, dtype='float64')
+    rh = np.clip(np.asarray(humidity, dtype='float64'), 1e-3, None) / 100
+    gamma = np.log(rh) + A * T / (T + B)
+    return B * gamma / (A - gamma)
+
+
+def absolute_humidity(T, humidity):
+    """Absolute humidity in g/m³."""
+    T = np.asarray(T, dtype='float64')
+    e = svp(T) * np.asarray(humidity, dtype='float64') / 100   # kPa
+    # ideal gas law for water vapour: 1000 * e / (R_v * T), R_v = 461.5 J/(kg K)
+    return 1e6 * e / (461.5 * (T + 273.15))
+
+
+METRICS = {'vpd': vpd, 'dew': dew_point, 'ah': absolute_humidity}
+
+
+def derive_long(df):
+    """Derived series for new rows of the long frame (date, value, type).
+
+    Returns rows for vpd1/vpd2, dew1/dew2 and ah1/ah2 in the same format,
+    computed from the temperature and humidity of each sample.
+    """
+    import pandas as pd
+    from dataloader import empty_long_frame
+    if not len(df):
+        return empty_long_frame()
+    wide = df.pivot_table(index='date', columns='type', values='value', aggfunc='last')
+    parts = []
+    for n, (t, h) in SENSORS.items():
+        if t not in wide or h not in wide:
+            continue
+        both = wide[[t, h]].dropna()
+        for metric, f in METRICS.items():
+            parts.append(pd.DataFrame({'date': both.index.to_numpy(),
+                                       'value': f(both[t].to_numpy(), both[h].to_numpy()),
+                                       'type': metric + n}))
+    if not parts:
+        return empty_long_frame()
+    return pd.concat(parts, ignore_index=True)
+
+
+def with_derived(df):
+    """Replace stored vpd rows by VPD, dew point and absolute humidity computed on read."""
+    import pandas as pd
+    raw = df[~df['type'].isin(['vpd1', 'vpd2'])]
+    derived = derive_long(raw)
+    if not len(derived):
+        return raw
+    return pd.concat([raw, derived], ignore_index=True)
+
+
+################################################################
+# Backfill: correct the stored vpd values of a whole log
+###############################################################
+
+def _backfill_v1(src, dst):
+    import pandas as pd
+    from sensorlog import CHANNELS
+    # dates stay strings, so the file keeps its exact timestamps and order
+    df = pd.read_csv(src, dtype={'date': str, 'type': str}, skipinitialspace=True)
+    df['type'] = df['type'].str.strip()
+    wide = df.pivot_table(index='date', columns='type', values='value', aggfunc='last', sort=False)
+    for n, (t, h) in SENSORS.items():
+        wide['vpd' + n] = vpd(wide[t], wide[h]) if t in wide and h in wide else np.nan
+    wide = wide.reindex(columns=[c for c in CHANNELS if c in wide])
+    long = wide.stack().dropna().reset_index()
+    long.columns = ['date', 'type', 'value']
+    with open(dst, 'w') as f:
+        f.write('date,value,type\n')
+        f.write(''.join(d + ',' + str(round(v, 2)) + ',' + c + '\n'
+                        for d, c, v in zip(long['date'], long['type'], long['value'])))
+    return len(wide)
+
+
+def _backfill_v2(src, dst):
+    import pandas as pd
+    from sensorlog import V2_MAGIC
+    df = pd.read_csv(src, skiprows=1)
+    for n, (t, h) in SENSORS.items():
+        df['vpd' + n] = vpd(df[t], df[h]).round(2)
+    with open(dst, 'w') as f:
+        f.write(V2_MAGIC + '\n')
+        df.to_csv(f, index=False)
+    return len(df)
+
+
+def _backfill_binary(src, dst):
+    from sensorlog import append_records, create_binlog, read_binlog
+    rec, channels = read_binlog(src)
+    for n, (t, h) in SENSORS.items():
+        if 'vpd' + n in channels:
+            rec['vpd' + n] = vpd(rec[t], rec[h])
+    create_binlog(dst, channels)
+    append_records(dst, rec)
+    return len(rec)
+
+
+def backfill(path):
+    """Recompute vpd1/vpd2 for every sample of a log in one pass.
+
+    The corrected log replaces the original, which is kept as <path>.bak.
+    """
+    from sensorlog import detect_version
+    version = detect_version(path)
+    if version is None:
+        raise FileNotFoundError(path)
+    fill = {1: _backfill_v1, 2: _backfill_v2, 'binary': _backfill_binary}[version]
+    tmp = path + '.tmp'
+    samples = fill(path, tmp)
+    shutil.copy2(path, path + '.bak')
+    os.replace(tmp, path)
+    print("recomputed vpd for {} samples in {} (original kept as {}.bak)".format(samples, path, path))
+    print("rebuild the rollups with: python rollup.py build")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) in (2, 3) and sys.argv[1] == 'backfill':
+        from dataloader import open_log
+        backfill(sys.argv[2] if len(sys.argv) == 3 else open_log().path)
+    else:
+        print("usage: python derived.py backfill [logfile]")
+        sys.exit(1)
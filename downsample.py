@@ -0,0 +1,109 @@
+################################################################
+# Downsampling for the time series charts
+###############################################################
+
+# A chart that is 500 px wide can't show more than about 500 points per
+# trace, so there is no point in sending tens of thousands to the browser.
+# Both methods keep peaks and troughs, unlike taking every n-th point:
+#  - lttb:   Largest-Triangle-Three-Buckets (Steinarsson 2013), keeps the
+#            visual shape of the line
+#  - minmax: min and max of every bucket, keeps every extreme value
+
+import numpy as np
+
+
+def _numeric(x):
+    # datetimes as int64 nanoseconds, everything else as float
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype('int64').astype('float64')
+    return x.astype('float64')
+
+
+def lttb_indices(x, y, n):
+    """Indices of the n points LTTB keeps out of (x, y)."""
+    size = len(y)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x = _numeric(x)
+    y = np.asarray(y, dtype='float64')
+    # bucket i (for the points between the first and the last) covers
+    # edges[i]:edges[i + 1]
+    edges = (np.arange(n - 1) * (size - 2) / (n - 2)).astype(np.int64) + 1
+    edges[-1] = size - 1
+    idx = np.empty(n, dtype=np.int64)
+    idx[0] = 0
+    idx[-1] = size - 1
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket (the last point for the last bucket)
+        nstart = end
+        nend = edges[i + 2] if i + 2 < len(edges) else size
+        avg_x = x[nstart:nend].mean()
+        avg_y = y[nstart:nend].mean()
+        # triangle area between point a, the candidates and the average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+
+def minmax_indices(x, y, n):
+    """Indices of the minimum and maximum of n // 2 buckets, in order."""
+    size = len(y)
+    if n >= size or n < 2:
+        return np.arange(size)
+    y = np.asarray(y, dtype='float64')
+    buckets = n // 2
+    edges = np.linspace(0, size, buckets + 1).astype(np.int64)
+    idx = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end <= start:
+            continue
+        part = y[start:end]
+        lo = start + int(np.argmin(part))
+        hi = start + int(np.argmax(part))
+        idx.extend(sorted({lo, hi}))
+    return np.array(idx, dtype=np.int64)
+
+
+METHODS = {'lttb': lttb_indices, 'minmax': minmax_indices}
+
+
+def envelope(x, lo, hi, max_points):
+    """Reduce a band (lo, hi at the same x) to at most max_points points.
+
+    Both edges share the buckets: each bucket gives its first x, the min of
+    lo and the max of hi, and the last point is kept, so a filled band
+    between the two traces joins matching points and ends with the data.
+    """
+    x = np.asarray(x)
+    lo = np.asarray(lo, dtype='float64')
+    hi = np.asarray(hi, dtype='float64')
+    if max_points is None or len(x) <= max_points:
+        return x, lo, hi
+    if max_points < 2:
+        return x[-1:], lo[-1:], hi[-1:]
+    starts = np.unique(np.linspace(0, len(x) - 1, max_points).astype(np.int64)[:-1])
+    with np.errstate(invalid='ignore'):
+        band_lo = np.fmin.reduceat(lo[:-1], starts)
+        band_hi = np.fmax.reduceat(hi[:-1], starts)
+    return (np.append(x[starts], x[-1]), np.append(band_lo, lo[-1]),
+            np.append(band_hi, hi[-1]))
+
+
+def downsample(x, y, max_points, method='lttb'):
+    """Reduce (x, y) to at most max_points points, keeping peaks and troughs.
+
+    NaN values are dropped first. max_points=None returns the data unchanged.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if max_points is None or len(y) <= max_points:
+        return x, y
+    ok = ~np.isnan(y)
+    if not ok.all():
+        x, y = x[ok], y[ok]
+    idx = METHODS[method](x, y, max_points)
+    return x[idx], y[idx]
@@ -0,0 +1,181 @@
+################################################################
+# Figures for the dashboards
+###############################################################
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from downsample import downsample, envelope as band
+
+
+# visible_range() result for a relayout that doesn't change the x range
+UNCHANGED = 'unchanged'
+
+
+def visible_range(relayout):
+    """Visible x range from a graph's relayoutData, None when showing all.
+
+    Zooming, the rangeslider and the rangeselector buttons all report the
+    new range as xaxis.range; the "all" button and a double click report
+    xaxis.autorange. Any other event (autosize, pan mode, a zoom of the y
+    axis) returns UNCHANGED: the chart keeps its range and resolution.
+    """
+    if not relayout:
+        return None
+    if relayout.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range' in relayout:
+        start, end = relayout['xaxis.range'][:2]
+    elif 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        start, end = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    else:
+        return UNCHANGED
+    return pd.Timestamp(start).to_datetime64(), pd.Timestamp(end).to_datetime64()
+
+
+def range_data(x_range):
+    """x_range for a dcc.Store, read back with stored_range()."""
+    return None if x_range is None else [str(x_range[0]), str(x_range[1])]
+
+
+def stored_range(data):
+    return None if not data else (np.datetime64(data[0]), np.datetime64(data[1]))
+
+
+def chart_range(relayout, data):
+    """The range to draw: the new one of relayout, else the stored one."""
+    x_range = visible_range(relayout)
+    return stored_range(data) if x_range is UNCHANGED else x_range
+
+
+def _clip(times, values, x_range):
+    # the visible range plus one range width on each side, so panning a bit
+    # doesn't show an empty chart before the next update
+    start, end = x_range
+    pad = end - start
+    i0 = np.searchsorted(times, start - pad)
+    i1 = np.searchsorted(times, end + pad, side='right')
+    return times[i0:i1], values[i0:i1]
+
+
+# Rollups (see rollup.py) also have the min and max of every bucket, as the
+# series <name>_min and <name>_max. They are drawn as a shaded band around
+# the line (the envelope), so peaks that the bucket mean flattens stay
+# visible. The band traces come after the line traces; for the raw data
+# they are empty, so a chart always has the same traces. Both edges of a
+# band are reduced over the same buckets (downsample.envelope), so the
+# fill joins matching points; a band gets ENVELOPE_POINTS of the points of
+# a line, it only has to show the extremes.
+ENVELOPE = ('_min', '_max')
+ENVELOPE_POINTS = 0.25
+ENVELOPE_COLOR = 'rgba(128, 128, 128, 0.25)'
+
+
+def trace_series(names, envelope=True):
+    """Series names of the traces of line_traces(), in trace order."""
+    names = list(names)
+    if envelope:
+        names += [name + suffix for name in names for suffix in ENVELOPE]
+    return names
+
+
+def line_traces(snap, names, ylabel, xlabel="Time", legend="Sensor",
+                max_points=None, method='lttb', x_range=None, envelope=True):
+    """The traces of line_figure() as plain dicts, without building a Figure."""
+    def clipped(name):
+        times, values = snap.get(name)
+        if x_range is not None:
+            times, values = _clip(times, values, x_range)
+        return times, values
+
+    def series(name, method):
+        return downsample(*clipped(name), max_points, method)
+
+    traces = []
+    for name in names:
+        times, values = series(name, method)
+        traces.append(dict(
+            type='scatter', x=times, y=values, name=name, mode='lines', legendgroup=name,
+            hovertemplate=legend + "=" + name + "<br>" + xlabel + "=%{x}<br>"
+                          + ylabel + "=%{y}<extra></extra>"))
+    if envelope:
+        band_points = max(int(max_points * ENVELOPE_POINTS), 2) if max_points else max_points
+        for name in names:
+            times, lo = clipped(name + ENVELOPE[0])
+            hi_times, hi = clipped(name + ENVELOPE[1])
+            if not np.array_equal(times, hi_times):
+                times, i, j = np.intersect1d(times, hi_times, return_indices=True)
+                lo, hi = lo[i], hi[j]
+            times, lo, hi = band(times, lo, hi, band_points)
+            for suffix, values in zip(ENVELOPE, (lo, hi)):
+                traces.append(dict(
+                    type='scatter', x=times, y=values, name=name + suffix, mode='lines',
+                    legendgroup=name, showlegend=False, hoverinfo='skip', line=dict(width=0),
+                    fill='tonexty' if suffix == '_max' else None, fillcolor=ENVELOPE_COLOR))
+    return traces
+
+
+def line_figure(snap, names, ylabel, xlabel="Time", legend="Sensor",
+                max_points=None, method='lttb', x_range=None, envelope=True):
+    """Line chart with one trace per series, built straight from a snapshot.
+
+    Looks like px.line(df, x="date", y="value", color="type", labels=...)
+    but reads the series arrays instead of filtering a long DataFrame.
+    max_points caps the points per trace (see downsample.py), about the
+    width of the chart in pixels is enough. With x_range only the data
+    around the visible range is sent. envelope adds the min/max band of
+    rollup data.
+    """
+    fig = go.Figure(data=line_traces(snap, names, ylabel, xlabel, legend,
+                                     max_points, method, x_range, envelope))
+    fig.update_layout(xaxis_title=xlabel, yaxis_title=ylabel, legend_title=legend,
+                      legend_tracegroupgap=0, margin=dict(t=60))
+    return fig
+
+
+################################################################
+# Incremental updates
+###############################################################
+
+# After a chart is built, each interval tick only sends the points that are
+# newer than the last point the browser has, through the graph's extendData.
+# What the browser has is kept per client in a dcc.Store as a small dict:
+#   names:      the series of the traces, in trace order (trace_series())
+#   resolution: 'raw' or the rollup resolution the figure was built from
+#   last:       time of the last point of each trace (string), None if empty
+#   appended:   points sent through extendData since the figure was built
+#   live:       False when the chart shows a range before the newest data,
+#               then there is nothing to append
+#   range:      the visible range the figure was built for (range_data())
+
+def tail_state(fig, snap, names, resolution='raw', x_range=None):
+    """Store data describing what a client has after receiving fig."""
+    last = [str(trace.x[-1]) if trace.x is not None and len(trace.x) else None
+            for trace in fig.data]
+    newest = [snap.get(name)[0][-1] for name in names if len(snap.get(name)[0])]
+    live = x_range is None or not newest or x_range[1] >= max(newest)
+    return dict(names=list(names), resolution=resolution, last=last, appended=0, live=live,
+                range=range_data(x_range))
+
+
+def extend_data(snap, state):
+    """Points newer than the client's state, for a graph's extendData.
+
+    Returns (extendData, new state); extendData is None when there is
+    nothing new. The work and the payload are proportional to the new points.
+    """
+    xs, ys, traces, last = [], [], [], list(state['last'])
+    for i, name in enumerate(state['names']):
+        times, values = snap.get(name)
+        start = 0 if last[i] is None else np.searchsorted(times, np.datetime64(last[i]), side='right')
+        if start < len(times):
+            xs.append(times[start:])
+            ys.append(values[start:])
+            traces.append(i)
+            last[i] = str(times[-1])
+    appended = state['appended'] + sum(len(x) for x in xs)
+    state = dict(state, last=last, appended=appended)
+    if not traces:
+        return None, state
+    return [dict(x=xs, y=ys), traces], state
@@ -0,0 +1,157 @@
+################################################################
+# Bounded worker pool for scheduled jobs
+###############################################################
+
+# run_threaded() used to start a new thread for every job run. When the
+# camera or the I2C bus hangs, copies of the same job pile up and all wait on
+# the same device. JobRunner runs jobs on a fixed pool of threads and keeps
+# per-job limits:
+#  - max_concurrency: how many runs of the job (or of all jobs sharing the
+#    same key, e.g. everything that talks to the I2C bus) may run at once
+#  - max_queue: how many further runs may wait; more are skipped
+#  - timeout: a run taking longer is reported as overrun. Python can't kill
+#    a thread, but while it hangs the limits above keep new runs from
+#    piling up behind it.
+# With a Metrics object (metrics.py) the runner also records how long every
+# job runs and waits for a thread, and exposes the counters of stats().
+
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobStats:
+    def __init__(self):
+        self.running = 0
+        self.queue = collections.deque()
+        self.started = {}       # run id -> (start time, timeout, job name)
+        self.runs = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.errors = 0
+
+
+class JobRunner:
+    def __init__(self, max_workers=4, metrics=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)    # notified when a run ends
+        self._jobs = collections.defaultdict(JobStats)
+        self._ids = 0
+        self._late = set()      # runs already counted as overrun
+        self._durations = self._waits = None
+        if metrics is not None:
+            self._durations = metrics.histogram('scheduler_job_duration_seconds',
+                                                'Run time of the scheduled jobs.', 'job')
+            self._waits = metrics.histogram('scheduler_job_wait_seconds',
+                                            'Time a job waited for a pool thread.', 'job')
+            metrics.collector(self._collect)
+
+    def submit(self, func, key=None, max_concurrency=1, max_queue=0, timeout=None):
+        """Run func on the pool, unless its limits are reached.
+
+        Returns True if the run was started or queued, False if it was skipped.
+        """
+        key = key or func.__name__
+        with self._lock:
+            self._check_overruns()
+            st = self._jobs[key]
+            if st.running < max_concurrency:
+                st.running += 1
+                self._start(key, func, timeout)
+                return True
+            if len(st.queue) < max_queue:
+                st.queue.append((func, timeout, time.monotonic()))
+                return True
+            st.skipped += 1
+        print("Skipped {}: {} still running".format(func.__name__, key))
+        return False
+
+    def _start(self, key, func, timeout, submitted=None):
+        # called with the lock held
+        self._ids += 1
+        self._executor.submit(self._run, key, func, timeout, self._ids,
+                              time.monotonic() if submitted is None else submitted)
+
+    def _run(self, key, func, timeout, run_id, submitted):
+        st = self._jobs[key]
+        started = time.monotonic()
+        if self._waits is not None:
+            self._waits.observe(started - submitted, func.__name__)
+        with self._lock:
+            st.started[run_id] = (started, timeout, func.__name__)
+        failed = False
+        try:
+            func()
+        except Exception as e:
+            failed = True
+            print("Job {} failed: {!r}".format(func.__name__, e))
+        finally:
+            if self._durations is not None:
+                self._durations.observe(time.monotonic() - started, func.__name__)
+            with self._lock:
+                start, timeout, name = st.started.pop(run_id)
+                st.runs += 1
+                st.errors += failed
+                if timeout is not None and time.monotonic() - start > timeout and run_id not in self._late:
+                    st.overruns += 1
+                self._late.discard(run_id)
+                if st.queue:
+                    # hand the slot to the next waiting run
+                    func, timeout, submitted = st.queue.popleft()
+                    self._start(key, func, timeout, submitted)
+                else:
+                    st.running -= 1
+                    self._idle.notify_all()
+
+    def _check_overruns(self):
+        # called with the lock held, on every submit
+        now = time.monotonic()
+        for key, st in self._jobs.items():
+            for run_id, (start, timeout, name) in st.started.items():
+                if timeout is not None and now - start > timeout and run_id not in self._late:
+                    self._late.add(run_id)
+                    st.overruns += 1
+                    print("Job {} overran its timeout of {} s ({:.0f} s so far)".format(
+                        name, timeout, now - start))
+
+    def stats(self):
+        """{key: dict(running, queued, runs, skipped, overruns, errors)}"""
+        with self._lock:
+            return {key: dict(running=st.running, queued=len(st.queue), runs=st.runs,
+                              skipped=st.skipped, overruns=st.overruns, errors=st.errors)
+                    for key, st in self._jobs.items()}
+
+    def _collect(self):
+        from metrics import labels
+        stats = self.stats()
+        families = []
+        for field, kind, help in (
+                ('runs', 'counter', 'Finished runs.'),
+                ('skipped', 'counter', 'Runs skipped because the job was still running.'),
+                ('overruns', 'counter', 'Runs that took longer than their timeout.'),
+                ('errors', 'counter', 'Runs that raised an exception.'),
+                ('running', 'gauge', 'Runs in progress.'),
+                ('queued', 'gauge', 'Runs waiting for a free slot.')):
+            name = 'scheduler_job_{}{}'.format(field, '_total' if kind == 'counter' else '')
+            families.append((name, kind, help, {labels(key=key): s[field] for key, s in stats.items()}))
+        return families
+
+    def shutdown(self, timeout=10):
+        """Drop the queued runs and wait at most timeout seconds for the
+        running ones; a job hanging on a device must not block the stop."""
+        with self._lock:
+            for st in self._jobs.values():
+                st.queue.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while True:
+                running = [key for key, st in self._jobs.items() if st.running]
+                remaining = deadline - time.monotonic()
+                if not running or remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+        if running:
+            print("Jobs still running at shutdown: {}".format(', '.join(running)))
@@ -0,0 +1,177 @@
+################################################################
+# Buffered log writer
+###############################################################
+
+# logdatalong() used to open the log, write one sample and close it again
+# every 10 s. LogWriter keeps the file open, collects samples in memory and
+# writes them in one go when max_samples are buffered or the oldest buffered
+# sample is max_delay seconds old (checked on every sample and by calling
+# flush_due() from a timer, in case the samples stop). With fsync=True
+# every flush is also forced to the SD card, so at most one batch is lost
+# on a power cut.
+#
+# A power cut can leave half a line (or half a binary record, or a run of
+# zero bytes) at the end of the log. That tail is cut off when the writer
+# opens the file, so new samples never get glued to a broken line.
+
+import os
+import threading
+import time
+
+import sensorlog
+
+
+def repair_text_log(path):
+    """Cut a trailing partial line off a csv log. Returns the bytes removed."""
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            nl = block.rfind(b'\n')
+            if nl >= 0:
+                end = pos - step + nl + 1
+                break
+            pos -= step
+        else:
+            end = 0
+        if end < size:
+            f.truncate(end)
+        return size - end
+
+
+def repair_binlog(path):
+    """Cut a partially written record and zero-filled records off the end
+    of a binary log. Returns the bytes removed."""
+    with open(path, 'rb+') as f:
+        channels, offset = sensorlog.read_header(f)
+        itemsize = sensorlog.record_dtype(channels).itemsize
+        size = f.seek(0, os.SEEK_END)
+        end = offset + (size - offset) // itemsize * itemsize
+        # a power cut can leave whole records of zeros (timestamp 1970)
+        zero = bytes(itemsize)
+        while end > offset:
+            f.seek(end - itemsize)
+            if f.read(itemsize) != zero:
+                break
+            end -= itemsize
+        if end < size:
+            f.truncate(end)
+        return size - end
+
+
+class LogWriter:
+    """Append samples to a log through an in-memory batch.
+
+    format turns the arguments of log() into the bytes of one sample. The
+    header is written when the file is new or empty.
+    """
+
+    def __init__(self, path, format, header=b'', repair=repair_text_log,
+                 max_samples=6, max_delay=60, fsync=False):
+        self.path = path
+        self.format = format
+        self.max_samples = max_samples
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._first = None      # time the oldest buffered sample was added
+        self.samples = 0
+        self.flushes = 0
+        self.bytes_written = 0
+        self.repaired = 0
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            self.repaired = repair(path)
+            if self.repaired:
+                print("{}: removed {} bytes of a partially written sample".format(path, self.repaired))
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0 and header:
+            self._file.write(header)
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def log(self, *sample):
+        self.write(self.format(*sample))
+
+    def write(self, data):
+        with self._lock:
+            if not self._buffer:
+                self._first = time.monotonic()
+            self._buffer.append(data)
+            self.samples += 1
+            if (self._file.closed or len(self._buffer) >= self.max_samples
+                    or time.monotonic() - self._first >= self.max_delay):
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        if self._file.closed:
+            # a job still running after close(), e.g. while shutting down
+            with open(self.path, 'ab') as f:
+                f.write(data)
+        else:
+            self._file.write(data)
+            self._sync()
+        self.flushes += 1
+        self.bytes_written += len(data)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def flush_due(self):
+        """Flush if the oldest buffered sample is max_delay seconds old; run
+        from a timer, so the batch is written even when no new sample comes."""
+        with self._lock:
+            if self._buffer and time.monotonic() - self._first >= self.max_delay:
+                self._flush()
+
+    def close(self):
+        """Write out the buffer and close the file; later samples are
+        appended one by one."""
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+
+################################################################
+# Writers for the log formats
+###############################################################
+
+def format_v1(date, timestamp, values):
+    # date: local timestamp string, see getSensors()
+    return ''.join(date + ',' + str(round(v, 2)) + ',' + c + '\n'
+                   for c, v in zip(sensorlog.CHANNELS, values)).encode()
+
+
+def format_v2(date, timestamp, values):
+    return sensorlog.format_v2_row(timestamp, values).encode()
+
+
+def format_binary(date, timestamp, values):
+    return sensorlog.sample_record(timestamp, values).tobytes()
+
+
+def open_logwriter(backend=None, prefix='', **policy):
+    """LogWriter for the log format backend, sensorlog.LOG_BACKEND by default.
+
+    prefix goes in front of the file name, e.g. 'replay_' for test runs.
+    Log a sample with writer.log(date_string, utc_datetime, values).
+    """
+    backend = backend or sensorlog.LOG_BACKEND
+    path = sensorlog.log_path(backend, prefix)
+    if backend == 'csv':
+        return LogWriter(path, format_v1, b'date,value,type\n', **policy)
+    if backend == 'csv2':
+        return LogWriter(path, format_v2, sensorlog.v2_header().encode(), **policy)
+    return LogWriter(path, format_binary, sensorlog.binlog_header(), repair=repair_binlog, **policy)
@@ -1,32 +1,45 @@
 import schedule
 import time
-#for threading
-import threading
+from runloop import run_forever
+from jobrunner import JobRunner
+from sampler import Sampler
+# job timings, start lag and sensor read times on http://<pi>:9108/metrics
+from metrics import Metrics, MetricsServer, METRICS_PORT
+metrics = Metrics()
 
-# for BME280 Sensors:
-import smbus2
-import bme280
+# sensors: BME280, synthetic or replay of a log (see sensors.py)
+from sensors import open_sensors
 import os
 import pytz
 # for webcam
-import cv2
-
-# BME280 sensor address (default address)
-address = 0x76
-address2 = 0x77
-# Initialize I2C bus
-bus = smbus2.SMBus(1)
-# Load calibration parameters
-calibration_params = bme280.load_calibration_params(bus, address) 
-calibration_params2 = bme280.load_calibration_params(bus, address2)
-
-# for relay control
-import RPi.GPIO as GPIO
-GPIO.setmode(GPIO.BCM) # GPIO Numbers instead of board numbers
-RELAIS_1_GPIO = 4
-RELAIS_2_GPIO = 17
-RELAIS_3_GPIO = 27
-RELAIS_4_GPIO = 22
+from camera import CameraGrabber, LivePublisher, LIVE_PATH
+from camstore import CamStore
+from timelapse import TimelapseWriter
+from relays import Actuator, RelayBank, RELAY_PINS, open_backend
+from controller import Controller, Hysteresis, channel, humidifier_device, fan_device
+# log formats
+from logwriter import open_logwriter
+# 1 min / 15 min / 1 h rollups next to the raw log
+from rollup import RollupWriter
+
+# SENSOR_BACKEND 'bme280' on the Pi; 'synthetic' or 'replay' (of REPLAY_FILE,
+# REPLAY_SPEEDUP times faster than real time) to run and load-test anywhere,
+# then with RELAY_BACKEND = 'sim'
+SENSOR_BACKEND = 'bme280'
+# loaded once at startup; may be the real log, it isn't written meanwhile
+REPLAY_FILE = 'sensor_readings_bme280_long.csv'
+REPLAY_SPEEDUP = 1000
+sensors = open_sensors(SENSOR_BACKEND, REPLAY_FILE, REPLAY_SPEEDUP)
+# made up and replayed samples go to replay_* logs and rollups, never
+# into the real ones
+LOG_PREFIX = '' if SENSOR_BACKEND == 'bme280' else 'replay_'
+rollups = RollupWriter(prefix=LOG_PREFIX + 'sensor_readings_rollup')
+
+# for relay control (see relays.py), pins in RELAY_PINS;
+# RELAY_BACKEND 'gpio' on the Pi, 'sim' to run without relays
+RELAY_BACKEND = 'gpio'
+# the dashboard switches the same relays, so the pins are read back
+relaybank = RelayBank(RELAY_PINS, open_backend(RELAY_BACKEND), shared=True)
 
 # define functions
 
@@ -34,20 +47,10 @@ RELAIS_4_GPIO = 22
 def getSensors():
 	#print("Reading Sensor Values...")
 	
-	# Read sensor data 
-	data = bme280.sample(bus, address, calibration_params) 
-	data2 = bme280.sample(bus, address2, calibration_params2)
-	# Extract temperature, pressure, humidity, and corresponding timestamp
-	timestamp = data.timestamp
-	temperature_celsius = data.temperature
-	humidity = data.humidity
-	pressure = data.pressure
-	
-	timestamp2 = data2.timestamp
-	temperature_celsius2 = data2.temperature
-	humidity2 = data2.humidity
-	pressure2 = data2.pressure
-	timestamp2 = data2.timestamp
+	# Read sensor data: timestamp (UTC) and temperature, humidity, pressure per sensor
+	timestamp, readings = sensors.read()
+	temperature_celsius, humidity, pressure = readings[0]
+	temperature_celsius2, humidity2, pressure2 = readings[1]
 	vpd1 = calcvpd(T= temperature_celsius, humidity=humidity)
 	vpd2 = calcvpd(T= temperature_celsius2, humidity=humidity2)
 	# Adjust timezone
@@ -65,15 +68,35 @@ def getSensors():
 	#print(timestamp_tz.strftime('%H:%M:%S %d/%m/%Y'))
 	#print("Temp1={0:0.1f}ºC, Temp1={1:0.1f}ºF, Humidity1={2:0.1f}%, Pressure1={3:0.2f}hPa".format(temperature_celsius, temperature_fahrenheit, humidity, pressure))
 	#print("Temp2={0:0.1f}ºC, Temp2={1:0.1f}ºF, Humidity2={2:0.1f}%, Pressure2={3:0.2f}hPa".format(temperature_celsius2, temperature_fahrenheit2, humidity2, pressure2))
-	valueList = [timestamp_out, temperature_celsius, temperature_celsius2, humidity, humidity2, pressure, pressure2, vpd1, vpd2]
+	# values[9]: the timestamp as timezone aware datetime (UTC) for the binary log
+	valueList = [timestamp_out, temperature_celsius, temperature_celsius2, humidity, humidity2, pressure, pressure2, vpd1, vpd2, timestamp.replace(tzinfo=pytz.utc)]
 	return valueList
+# the camera stays open and frames are grabbed in the background,
+# pictures are deduplicated and encoded on a worker thread (see camera.py,
+# camstore.py); CAM_DIR is the assets folder of the dashboards next to this file
+CAM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+CAM_FORMAT = 'jpg'      # 'jpg' or 'webp'
+CAM_QUALITY = 80
+CAM_WIDTH = None        # scale saved pictures to this width, None for full size
+CAM_DEDUP_THRESHOLD = 2.0   # skip pictures differing less than this (0-255), 0 to keep all
+CAM_KEEP_DAYS = 14          # full size pictures
+CAM_KEEP_THUMB_DAYS = 365   # thumbnails (assets/thumbs/)
+camera = CameraGrabber(0).start()
+camstore = CamStore(CAM_DIR, CAM_FORMAT, CAM_QUALITY, CAM_WIDTH, threshold=CAM_DEDUP_THRESHOLD,
+	keep_days=CAM_KEEP_DAYS, keep_thumb_days=CAM_KEEP_THUMB_DAYS)
+# live picture for the stream in the dashboard (on tmpfs, not the SD card)
+live = LivePublisher(camera, LIVE_PATH, fps=2)
+# every picture also goes into the timelapse of the day (see timelapse.py)
+timelapse = TimelapseWriter().start()
+
 def cam():
-	cam = cv2.VideoCapture(0)
-	frame = cam.read()[1]
-	timestr = time.strftime("%Y%m%d-%H%M%S")
-	img_name = "/home/pfeiffer/greenbox/assets/"+timestr+"cam.png"
-	cv2.imwrite(img_name, frame)
-	print("captured: {}".format(img_name))
+	frame, t, seq = camera.latest()
+	if frame is None:
+		print("no camera frame yet")
+		return
+	# saved unless it looks like the last saved picture
+	camstore.submit(frame, t)
+	timelapse.add(frame, t)
 
 # log data in wide format
 # def logdata(): 
@@ -92,85 +115,41 @@ def cam():
 # 	file.write(data[0] + "," + str(round(data[1],2))+ "," + str(round(data[2],2))+ "," + str(round(data[3],2))+ "," + str(round(data[4],2))+ "," + str(round(data[5],2))+ "," + str(round(data[6],2))+"\n")
 # 	file.close()
 
-def logdatalong():
-	import os
-	import pytz
-	# Check if the file exists before opening it in 'a' mode (append mode)
-	file_exists = os.path.isfile('sensor_readings_bme280_long.csv')
-	# Write the header to the file if the file does not exist
-	if not file_exists:
-		with open('sensor_readings_bme280_long.csv', 'a') as file:
-			file.write('date,value,type\n')
-	
-	# Read data
-	data = getSensors()
-	# Save data in *.csv file
-	#file = open('sensor_readings_bme280_long.csv', 'a')
-	#file.write(data[0] + "," + str(round(data[1],2))+ ", Temp1\n" + data[0] + "," + str(round(data[2],2))+ ", Temp2\n" + data[0] + "," + str(round(data[3],2))+ ", Humid1\n" +  data[0] + "," + str(round(data[4],2))+ ", Humid2\n" + data[0] + "," + str(round(data[5],2))+ ", Press1\n" + data[0] + "," + str(round(data[6],2))+ ", Press2\n") 
-	#file.close()
-	with open('sensor_readings_bme280_long.csv', 'a') as file:
-	    file.write(data[0] + "," + str(round(data[1],2))+ ",Temp1\n" + data[0] + "," + str(round(data[2],2))+ ",Temp2\n" + data[0] + "," + str(round(data[3],2))+ ",Humid1\n" +  data[0] + "," + str(round(data[4],2))+ ",Humid2\n" + data[0] + "," + str(round(data[5],2))+ ",Press1\n" + data[0] + "," + str(round(data[6],2))+ ",Press2\n" + data[0]+ "," + str(round(data[7],2))+ ",vpd1\n"+ data[0] + "," + str(round(data[8],2))+ ",vpd2\n")
-			
-# Turn on / off Relais 1
-def R1on():
-	GPIO.setup(RELAIS_1_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R1 on")
-	GPIO.output(RELAIS_1_GPIO, GPIO.HIGH) # on
-#	GPIO.cleanup()  
-
-def R1off():
-	GPIO.setup(RELAIS_1_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R1 off")
-	GPIO.output(RELAIS_1_GPIO, GPIO.LOW) # off
-
-# Turn on / off Relais 2
-def R2on():
-	GPIO.setup(RELAIS_2_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R2 on")
-	GPIO.output(RELAIS_2_GPIO, GPIO.HIGH) # on
-
-def R2off():
-	GPIO.setup(RELAIS_2_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R2 off")
-	GPIO.output(RELAIS_2_GPIO, GPIO.LOW) # off
-
-# Turn on / off Relais 3
-def R3on():
-	GPIO.setup(RELAIS_3_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R3 on")
-	GPIO.output(RELAIS_3_GPIO, GPIO.HIGH) # on
-
-def R3off():
-	GPIO.setup(RELAIS_3_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R3 off")
-	GPIO.output(RELAIS_3_GPIO, GPIO.LOW) # off
-
-# Turn on / off Relais 4
-def R4on():
-	GPIO.setup(RELAIS_4_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R4 on")
-	GPIO.output(RELAIS_4_GPIO, GPIO.HIGH) # on
-
-def R4off():
-	GPIO.setup(RELAIS_4_GPIO, GPIO.OUT) # GPIO Assign mode
-	print("R4 off")
-	GPIO.output(RELAIS_4_GPIO, GPIO.LOW) # off
+# log format: LOG_BACKEND in sensorlog.py, the dashboards read the same one
+# seconds between two samples in the log
+LOG_INTERVAL = 10
+# faster with the synthetic or replay backend
+SAMPLE_INTERVAL = LOG_INTERVAL / sensors.speedup
+# the log file stays open; samples are written in batches of LOG_FLUSH_SAMPLES
+# or when the oldest one is LOG_FLUSH_SECONDS old. LOG_FSYNC forces every
+# batch to the SD card (safer on power loss, more wear).
+LOG_FLUSH_SAMPLES = 6
+LOG_FLUSH_SECONDS = 60
+LOG_FSYNC = False
+logwriter = open_logwriter(prefix=LOG_PREFIX, max_samples=LOG_FLUSH_SAMPLES,
+			max_delay=LOG_FLUSH_SECONDS, fsync=LOG_FSYNC)
+if SENSOR_BACKEND == 'replay' and os.path.abspath(REPLAY_FILE) == os.path.abspath(logwriter.path):
+	logwriter.close()
+	raise SystemExit("REPLAY_FILE is the log the replay would write to: " + REPLAY_FILE)
 
+def logdatalong(data=None):
+	# Read data (or take the sample published by the sampler)
+	if data is None:
+		data = getSensors()
+	# Save data (buffered, see logwriter.py)
+	logwriter.log(data[0], data[9], data[1:9])
+	rollups.add(data[9], data[1:9])
+			
 def relaistest():
-	R1on()
-	R2on()
-	R3on()
-	R4on()
+	relaybank.apply({name: True for name in relaybank.names()})
 	time.sleep(5)
-	R1off()
-	R2off()
-	R3off()
-	R4off()
+	relaybank.all_off()
 	
 
 # get and print Sensorvalues to console
-def printSensor():
-	values = getSensors()
+def printSensor(values=None):
+	if values is None:
+		values = getSensors()
 	# Print the readings
 	print("Zeit:", values[0])
 	#print("Sensor 1: Temp: ", values[1],"Humid: ",values[3], "Pressure: ",values[5] )
@@ -181,8 +160,9 @@ def printSensor():
 	print("Sensor 2: Temperatur = {0:0.1f}ºC ".format(values[2]) + "Humidity = {0:0.1f}% ".format(values[4]) + "VPD = {0:0.2f} ".format(values[8]) + "Pressure = {0:0.2f}hPa".format(values[6]))
 	
 # Check if Humidity is to low / high
-def checker():
-	values = getSensors()
+def checker(values=None):
+	if values is None:
+		values = getSensors()
 	print("Checking Values...")
 	#print(values[1])
 	
@@ -190,25 +170,32 @@ def checker():
 		print("Humidity over 50 %")
 	if values[3]<30:
 		print("Humidity under 30 %")
-		#R1off()
+		#relaybank.off('R1')
 		
 		
+# timed relay changes run on the actuator thread (see relays.py),
+# humidon() and windon() return at once
+actuator = Actuator(relaybank)
+
+# relay steps of the devices, the same in the dashboard (see controller.py)
+humidifier = humidifier_device(actuator)
+fan = fan_device(actuator)
+
 def humidon(duration=30):
 	print("Humindifier on for "+ str(duration) +" seconds")
-	R2on()
-	time.sleep(3)
-	R3on()
-	time.sleep(1)
-	R3off()
-	time.sleep(duration)
-	R2off()
-	print("Humindifier off")
+	humidifier.run_for(duration)
 	
 def windon(duration = 30):
 	print("Wind on for " + str(duration)+ " seconds")
-	R1on()
-	time.sleep(duration)
-	R1off()
+	fan.run_for(duration)
+
+# closed-loop control on every sample (see controller.py), CONTROL = True
+# to enable; controller.py also has PID and vpd_target() modes
+CONTROL = False
+controllers = [
+	Controller(humidifier, channel('Humid1'), Hysteresis(40, 50), min_on=60, min_off=60, max_switches=20),
+	Controller(fan, channel('Humid1'), Hysteresis(55, 65, on_below=False), min_on=60, min_off=60, max_switches=20),
+]
 
 # calculate vpd 
 import math
@@ -224,19 +211,36 @@ def calcvpd(T =20, humidity=50):
 	
 	vpair = 0.61078 * math.exp(17.27 * T / (T + 237.3)) * rhumidity
 	
-	#vapor pressure deficit = saturation vapor pressure of leaf - saturation vapor pressure of air * relative humidity
-	vpd = svp-vpair* rhumidity
+	#vapor pressure deficit = saturation vapor pressure of leaf - vapor pressure of air
+	#(vpair already includes the relative humidity, see derived.py for the array version)
+	vpd = svp-vpair
 	return vpd
 
 
 
-def run_threaded(job_func):
-    job_thread = threading.Thread(target=job_func)
-    job_thread.start()
+# jobs run on a fixed pool of threads; a job that is still running is not
+# started again (see jobrunner.py). Jobs reading the sensors use the key
+# 'i2c', so they take turns on the bus instead of running at the same time.
+jobs = JobRunner(max_workers=4, metrics=metrics)
+
+def run_threaded(job_func, **policy):
+    jobs.submit(job_func, **policy)
 
-schedule.every(10).seconds.do(run_threaded, printSensor)
-schedule.every(10).seconds.do(run_threaded, logdatalong)
-schedule.every(30).seconds.do(run_threaded, cam)
+# the sensors are read once per tick and the sample goes to all subscribers
+sampler = Sampler(getSensors, metrics=metrics)
+if CONTROL:
+	# first, so the relays switch right after the read
+	for c in controllers:
+		sampler.subscribe(c.update, name='control_' + c.device.name)
+sampler.subscribe(logdatalong)
+sampler.subscribe(printSensor, every=max(1, round(10 / SAMPLE_INTERVAL)))   # console every ~10 s
+#sampler.subscribe(checker)
+
+schedule.every(SAMPLE_INTERVAL).seconds.do(run_threaded, sampler.tick, key='i2c', timeout=5)
+schedule.every(30).seconds.do(run_threaded, cam, timeout=20)
+schedule.every(1).hours.do(run_threaded, camstore.prune)
+# buffered samples reach the log within LOG_FLUSH_SECONDS even if the sensors stop
+schedule.every(10).seconds.do(run_threaded, logwriter.flush_due)
 #schedule.every(60).seconds.do(run_threaded, humidon)
 #schedule.every(60).seconds.do(run_threaded, windon)
 
@@ -246,8 +250,13 @@ schedule.every(30).seconds.do(run_threaded, cam)
 #schedule.every(3).seconds.do(logdata)
 #schedule.every(10).seconds.do(checker)
 #schedule.every(60).seconds.do(humidon, duration=30)
-#schedule.every(6).seconds.do(R1off)
+#schedule.every(6).seconds.do(relaybank.off, 'R1')
+
+
+metrics_server = MetricsServer(metrics, METRICS_PORT)
 
+# sleep until the next job is due; SIGTERM / Ctrl-C stop the loop,
+# switch the relays off and write out buffered samples first, then wait
+# (bounded) for running jobs and release the camera
+run_forever(metrics=metrics, on_stop=[actuator.stop, logwriter.close, metrics_server.stop, jobs.shutdown, live.stop, camera.stop, camstore.stop, timelapse.stop])
 
-while True:
-		schedule.run_pending()
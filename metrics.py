@@ -0,0 +1,197 @@
+################################################################
+# Scheduler metrics
+###############################################################
+
+# How long the jobs take and how late they start was only visible as the
+# occasional "Skipped" or "overran" line on the console. The scheduler
+# records into one Metrics object:
+#  - scheduler_job_duration_seconds{job}: run time of every job
+#  - scheduler_start_lag_seconds{job}: how long after the planned time the
+#    main loop started the job
+#  - scheduler_job_wait_seconds{job}: time a run waited for a pool thread,
+#    so the start lag of a pooled job is the sum of the two
+#  - scheduler_job_*_total{key}: runs, skips, overruns and errors (jobrunner.py)
+#  - sensor_read_seconds: one read of the sensors (the I2C bus)
+#  - sampler_subscriber_seconds{subscriber}: logger, console, controllers
+# MetricsServer serves them as Prometheus text on http://<pi>:9108/metrics,
+# for Prometheus or just curl; the Misc tab of dashapp_win.py shows a summary.
+
+import bisect
+import collections
+import http.server
+import math
+import re
+import threading
+import urllib.request
+
+METRICS_PORT = 9108
+# seconds, from 1 ms (a sensor read) to a minute (a hanging camera)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Prometheus histogram, optionally split by one label."""
+
+    def __init__(self, name, help, label=None, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}       # label value -> [bucket counts..., count, sum]
+
+    def observe(self, value, label=None):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def lines(self):
+        yield '# HELP {} {}'.format(self.name, self.help)
+        yield '# TYPE {} histogram'.format(self.name)
+        with self._lock:
+            series = {label: list(s) for label, s in self._series.items()}
+        for label, s in sorted(series.items(), key=lambda item: str(item[0])):
+            labels = [] if self.label is None else ['{}="{}"'.format(self.label, label)]
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), s[:-2] + [0]):
+                cumulative += n
+                le = '+Inf' if bound == math.inf else repr(bound)
+                yield '{}_bucket{{{}}} {}'.format(self.name, ','.join(labels + ['le="{}"'.format(le)]),
+                                                 cumulative if bound != math.inf else s[-2])
+            suffix = '{' + ','.join(labels) + '}' if labels else ''
+            yield '{}_count{} {}'.format(self.name, suffix, s[-2])
+            yield '{}_sum{} {!r}'.format(self.name, suffix, s[-1])
+
+
+class Metrics:
+    """Histograms plus collectors for values that are kept elsewhere.
+
+    A collector is a function returning [(name, type, help, {label dict or
+    None: value})], called for every scrape.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help, label=None, buckets=BUCKETS):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, help, label, buckets)
+            return self._histograms[name]
+
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for h in list(self._histograms.values()):
+            lines.extend(h.lines())
+        for func in self._collectors:
+            try:
+                families = func()
+            except Exception as e:
+                lines.append('# collector {} failed: {!r}'.format(getattr(func, '__name__', func), e))
+                continue
+            for name, kind, help, values in families:
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for labels, value in values.items():
+                    suffix = '{' + ','.join('{}="{}"'.format(k, v) for k, v in labels) + '}' if labels else ''
+                    lines.append('{}{} {!r}'.format(name, suffix, float(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def labels(**kwargs):
+    """Hashable label set for the values of a collector."""
+    return tuple(sorted(kwargs.items()))
+
+
+class MetricsServer:
+    """Serve metrics.render() on /metrics from a daemon thread."""
+
+    def __init__(self, metrics, port=METRICS_PORT, host=''):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass    # no line per scrape on the console
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+################################################################
+# Reading the endpoint
+###############################################################
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+
+def parse(text):
+    """{name: {label dict as tuple: value}} from Prometheus text."""
+    result = collections.defaultdict(dict)
+    for line in text.splitlines():
+        m = SAMPLE.match(line)
+        if m:
+            name, label_text, value = m.groups()
+            result[name][tuple(LABEL.findall(label_text or ''))] = float(value)
+    return result
+
+
+def fetch(url, timeout=2):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return parse(response.read().decode())
+
+
+def histogram_summary(parsed, name, label):
+    """{label value: dict(count, mean, p95)} of a histogram; p95 is
+    interpolated within its bucket, like Prometheus' histogram_quantile."""
+    summary = {}
+    counts = parsed.get(name + '_count', {})
+    for key, count in counts.items():
+        value = dict(key).get(label)
+        total = parsed.get(name + '_sum', {}).get(key, 0.0)
+        buckets = sorted((float(dict(k)['le']), n) for k, n in parsed.get(name + '_bucket', {}).items()
+                         if dict(k).get(label) == value)
+        summary[value] = dict(count=count, mean=total / count if count else None,
+                              p95=_quantile(0.95, buckets, count))
+    return summary
+
+
+def _quantile(q, buckets, count):
+    if not count:
+        return None
+    rank = q * count
+    lower, below = 0.0, 0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if bound == math.inf:
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(cumulative - below, 1)
+        lower, below = bound, cumulative
+    return lower
@@ -0,0 +1,337 @@
+################################################################
+# Relays
+###############################################################
+
+import collections
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+# BCM numbers of the relay board
+RELAY_PINS = {'R1': 4, 'R2': 17, 'R3': 27, 'R4': 22}
+
+
+################################################################
+# Relay driver
+###############################################################
+
+# The R1on() ... R4off() functions set up the pin before every write and
+# printed each change. RelayBank sets the pins up once, remembers the state
+# of every relay and skips writes that wouldn't change anything. The pins
+# are driven through a backend: GPIOBackend on the Pi, SimulatedGPIO
+# anywhere else (tests, benchmarks, running the dashboard on a PC).
+
+class GPIOBackend:
+    """RPi.GPIO, relays on when the pin is high (active_high)."""
+
+    def __init__(self, active_high=True):
+        import RPi.GPIO as GPIO     # only on the Pi
+        self.GPIO = GPIO
+        self.active_high = active_high
+        GPIO.setmode(GPIO.BCM) # GPIO Numbers instead of board numbers
+        GPIO.setwarnings(False)
+
+    def setup(self, pin):
+        self.GPIO.setup(pin, self.GPIO.OUT)
+
+    def write(self, pin, on):
+        self.GPIO.output(pin, self.GPIO.HIGH if on == self.active_high else self.GPIO.LOW)
+
+    def read(self, pin):
+        return bool(self.GPIO.input(pin)) == self.active_high
+
+
+class SimulatedGPIO:
+    """In-memory pins. latency: seconds one write takes, to mimic slow hardware."""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.pins = {}
+        self.writes = 0
+        self.log = collections.deque(maxlen=1000)   # (time, pin, on)
+
+    def setup(self, pin):
+        self.pins.setdefault(pin, False)
+
+    def write(self, pin, on):
+        if self.latency:
+            time.sleep(self.latency)
+        self.pins[pin] = on
+        self.writes += 1
+        self.log.append((time.monotonic(), pin, on))
+
+    def read(self, pin):
+        return self.pins[pin]
+
+
+def open_backend(name='gpio'):
+    """Backend 'gpio' (RPi.GPIO) or 'sim' (in memory)."""
+    if name == 'gpio':
+        return GPIOBackend()
+    if name == 'sim':
+        return SimulatedGPIO()
+    raise ValueError('unknown relay backend: {}'.format(name))
+
+
+class RelayBank:
+    """The relays of the board: set up once, state cached.
+
+    shared: another process switches the same pins (the scheduler and the
+    dashboard both do), so the pin is read back instead of trusting the cache.
+    """
+
+    def __init__(self, pins=RELAY_PINS, backend=None, shared=False):
+        self.pins = dict(pins)
+        self.backend = backend if backend is not None else SimulatedGPIO()
+        self.shared = shared
+        self._lock = threading.Lock()
+        for pin in self.pins.values():
+            self.backend.setup(pin)
+        self.state = {name: self.backend.read(pin) for name, pin in self.pins.items()}
+        self.writes = 0
+        self.skipped = 0
+
+    def names(self):
+        return list(self.pins)
+
+    def get(self, name):
+        if self.shared:
+            return self.backend.read(self.pins[name])
+        return self.state[name]
+
+    def set(self, name, on):
+        """Switch relay name on or off. Returns False if it already was."""
+        return self.apply({name: on}) == 1
+
+    def on(self, name):
+        return self.set(name, True)
+
+    def off(self, name):
+        return self.set(name, False)
+
+    def apply(self, changes):
+        """Set several relays at once, {name: on}. Returns the number of pins written."""
+        written = 0
+        with self._lock:
+            for name, on in changes.items():
+                pin = self.pins[name]
+                on = bool(on)
+                current = self.backend.read(pin) if self.shared else self.state[name]
+                if current == on:
+                    self.skipped += 1
+                    continue
+                self.backend.write(pin, on)
+                self.state[name] = on
+                written += 1
+            self.writes += written
+        return written
+
+    def all_off(self):
+        self.apply({name: False for name in self.pins})
+
+
+################################################################
+# Actuation service
+###############################################################
+
+# windon() and humidon() used to switch a relay, sleep for the duration and
+# switch it off again, blocking a Dash request (or a job thread) for the
+# whole run. The Actuator runs all timed relay changes on one thread with a
+# heap of due times; callers only queue the steps and return at once.
+#
+# An action is a named list of steps (seconds from now, relay, on/off), e.g.
+#   actuator.run('fan', [(0, 'R1', True), (60, 'R1', False)])
+# Starting an action that is still running replaces its remaining steps, so
+# pressing the fan button again restarts the countdown. keep_running() does
+# that without repeating the first steps (the humidifier button, a pulse
+# that toggles it). extend() moves the end of an action (its last steps)
+# later, cancel() drops the remaining
+# steps and switches the relays of the action off. status() tells which
+# relays are on and how long each action still runs.
+
+class Actuator:
+    """Timed relay changes of a RelayBank on one thread."""
+
+    def __init__(self, bank):
+        self.bank = bank
+        self._cond = threading.Condition()
+        self._heap = []             # (due, seq, action, generation, relay, on)
+        self._actions = {}          # name -> (generation, [(due, relay, on)] pending)
+        self._on_start = {}         # name -> (generation, callback)
+        self._seq = itertools.count()
+        self._generation = itertools.count(1)
+        self._stop = False
+        self.switches = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._loop, name='actuator', daemon=True)
+        self._thread.start()
+
+    def run(self, name, steps, on_start=None):
+        """Start action name with steps [(seconds from now, relay, on)].
+
+        on_start(t) is called on the actuator thread right after the first
+        step was switched, t is the unix time of the switch.
+        """
+        now = time.monotonic()
+        for offset, relay, on in steps:
+            if relay not in self.bank.pins:
+                raise KeyError('unknown relay: {}'.format(relay))
+        with self._cond:
+            self._schedule(name, [(now + offset, relay, on) for offset, relay, on in steps])
+            if on_start is not None:
+                self._on_start[name] = (self._actions[name][0], on_start)
+            else:
+                self._on_start.pop(name, None)
+
+    def _schedule(self, name, pending):
+        # called with the lock held; entries of an older generation of the
+        # action stay in the heap and are skipped when they come up
+        generation = next(self._generation)
+        self._actions[name] = (generation, pending)
+        for due, relay, on in pending:
+            heapq.heappush(self._heap, (due, next(self._seq), name, generation, relay, on))
+        self._cond.notify()
+
+    def on(self, relay, duration=None):
+        """Switch relay on, and off again after duration seconds."""
+        steps = [(0, relay, True)]
+        if duration is not None:
+            steps.append((duration, relay, False))
+        self.run(relay, steps)
+
+    def off(self, relay):
+        self.run(relay, [(0, relay, False)])
+
+    def extend(self, name, seconds):
+        """Move the last steps of action name by seconds. False if it isn't running."""
+        return self._move_end(name, lambda end: end + seconds)
+
+    def keep_running(self, name, seconds):
+        """Let action name end seconds from now, moving its last steps.
+
+        False if it isn't running; then start it with run(). For devices
+        switched by a button pulse, where running the steps again would
+        toggle them off.
+        """
+        return self._move_end(name, lambda end: time.monotonic() + seconds)
+
+    def _move_end(self, name, new_end):
+        with self._cond:
+            if name not in self._actions or not self._actions[name][1]:
+                return False
+            generation, pending = self._actions[name]
+            end = max(due for due, relay, on in pending)
+            # never before the other steps, e.g. the pulse of a button that
+            # would then be pressed with the power already off
+            earlier = [due for due, relay, on in pending if due != end]
+            shift = max([new_end(end)] + earlier) - end
+            self._schedule(name, [(due + shift if due == end else due, relay, on)
+                                  for due, relay, on in pending])
+            return True
+
+    def cancel(self, name, switch_off=True):
+        """Drop the remaining steps of action name and switch its relays off."""
+        with self._cond:
+            if name not in self._actions:
+                return False
+            generation, pending = self._actions.pop(name)
+            if switch_off:
+                now = time.monotonic()
+                relays = sorted(set(relay for due, relay, on in pending))
+                self._schedule(name, [(now, relay, False) for relay in relays])
+            return True
+
+    def status(self):
+        """{'relays': {relay: on}, 'actions': {name: seconds until its last step}}"""
+        now = time.monotonic()
+        with self._cond:
+            actions = {name: max(0, max(due for due, relay, on in pending) - now)
+                       for name, (generation, pending) in self._actions.items() if pending}
+        return dict(relays={name: self.bank.get(name) for name in self.bank.names()},
+                    actions=actions)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stop and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stop:
+                    return
+                # all steps due now go to the bank as one batch
+                changes = {}
+                started = []
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    due, seq, name, generation, relay, on = heapq.heappop(self._heap)
+                    if name not in self._actions or self._actions[name][0] != generation:
+                        continue    # replaced, extended or cancelled
+                    pending = self._actions[name][1]
+                    pending.remove((due, relay, on))
+                    if not pending:
+                        del self._actions[name]
+                    if name in self._on_start and self._on_start[name][0] == generation:
+                        started.append(self._on_start.pop(name)[1])
+                    changes[relay] = on
+            if changes:
+                self._switch(changes)
+                t = time.time()
+                for callback in started:
+                    try:
+                        callback(t)
+                    except Exception as e:
+                        print("Relay callback failed: {!r}".format(e))
+
+    def _switch(self, changes):
+        try:
+            self.switches += self.bank.apply(changes)
+        except Exception as e:
+            self.errors += 1
+            print("Relays {} failed: {!r}".format(changes, e))
+
+    def stop(self, all_off=True):
+        """Stop the thread, by default switching every relay off."""
+        with self._cond:
+            self._stop = True
+            self._actions.clear()
+            self._heap.clear()
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        if all_off:
+            self._switch({name: False for name in self.bank.names()})
+
+
+################################################################
+# Benchmark
+###############################################################
+
+def benchmark(n=100000, latency=0):
+    """Switching latency and throughput of RelayBank on the simulator."""
+    bank = RelayBank(RELAY_PINS, SimulatedGPIO(latency))
+    names = bank.names()
+    start = time.perf_counter()
+    for i in range(n):
+        bank.set(names[i % len(names)], (i // len(names)) % 2 == 0)
+    toggle = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(n):
+        bank.set(names[0], True)
+    cached = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(n // len(names)):
+        bank.apply({name: i % 2 == 0 for name in names})
+    batch = time.perf_counter() - start
+    print("{} switches: {:.2f} us each, {:.0f} per s".format(n, 1e6 * toggle / n, n / toggle))
+    print("{} unchanged: {:.2f} us each (write skipped)".format(n, 1e6 * cached / n))
+    print("{} batches of {}: {:.2f} us per batch".format(n // len(names), len(names),
+                                                        1e6 * batch / (n // len(names))))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+                  float(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    else:
+        print("usage: python relays.py bench [switches] [write latency in s]")
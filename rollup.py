@@ -0,0 +1,247 @@
+################################################################
+# Multi-resolution rollups of the sensor log
+###############################################################
+
+# Next to the raw data the logger keeps per-series rollups in 1 min, 15 min
+# and 1 h buckets (min/max/mean/count), one csv file per resolution:
+#   start,type,min,max,mean,count
+# start is the bucket start in seconds since the epoch (UTC). A bucket is
+# written once it is complete, so the files only ever grow at the end.
+#
+# The dashboard picks the coarsest resolution that still gives about one
+# point per pixel for the visible time range, so "all" over months of data
+# stays cheap and zooming in gets the raw data.
+#
+# Build the rollups for an existing log:
+#   python rollup.py build
+
+import io
+import os
+import sys
+import threading
+
+import numpy as np
+
+from sensorlog import CHANNELS, LOCAL_TZ
+
+# name -> bucket size in seconds, finest first
+RESOLUTIONS = {'1min': 60, '15min': 900, '1h': 3600}
+ROLLUP_COLUMNS = ['start', 'type', 'min', 'max', 'mean', 'count']
+
+
+def rollup_path(resolution, prefix='sensor_readings_rollup'):
+    return '{}_{}.csv'.format(prefix, resolution)
+
+
+def _format_row(start, name, mn, mx, mean, count):
+    return '{},{},{:.2f},{:.2f},{:.3f},{}\n'.format(start, name, mn, mx, mean, count)
+
+
+class RollupWriter:
+    """Keep the open bucket of every resolution and append completed ones.
+
+    Call add() with every sample that goes to the raw log. A bucket that is
+    still open when the logger stops is dropped, so after a restart no bucket
+    is written twice.
+    """
+
+    def __init__(self, channels=CHANNELS, resolutions=RESOLUTIONS, prefix='sensor_readings_rollup'):
+        self.channels = list(channels)
+        self.resolutions = dict(resolutions)
+        self.paths = {r: rollup_path(r, prefix) for r in self.resolutions}
+        self._lock = threading.Lock()
+        k = len(self.channels)
+        self._start = {r: None for r in self.resolutions}
+        self._min = {r: np.full(k, np.nan) for r in self.resolutions}
+        self._max = {r: np.full(k, np.nan) for r in self.resolutions}
+        self._sum = {r: np.zeros(k) for r in self.resolutions}
+        self._count = {r: np.zeros(k, dtype=np.int64) for r in self.resolutions}
+
+    def _flush(self, r):
+        rows = []
+        for i, name in enumerate(self.channels):
+            n = self._count[r][i]
+            if n:
+                rows.append(_format_row(self._start[r], name, self._min[r][i], self._max[r][i],
+                                        self._sum[r][i] / n, n))
+        if rows:
+            path = self.paths[r]
+            new = not os.path.isfile(path)
+            with open(path, 'a') as f:
+                if new:
+                    f.write(','.join(ROLLUP_COLUMNS) + '\n')
+                f.write(''.join(rows))
+
+    def add(self, timestamp, values):
+        # timestamp: timezone aware datetime, values: one float per channel
+        t = int(timestamp.timestamp())
+        v = np.asarray(values, dtype='float64')
+        ok = ~np.isnan(v)
+        with self._lock:
+            for r, size in self.resolutions.items():
+                start = t - t % size
+                if start != self._start[r]:
+                    if self._start[r] is not None and start < self._start[r]:
+                        continue   # late sample for a bucket that is already written
+                    if self._start[r] is not None:
+                        self._flush(r)
+                    self._start[r] = start
+                    self._min[r][:] = np.nan
+                    self._max[r][:] = np.nan
+                    self._sum[r][:] = 0
+                    self._count[r][:] = 0
+                self._min[r] = np.fmin(self._min[r], v)
+                self._max[r] = np.fmax(self._max[r], v)
+                self._sum[r][ok] += v[ok]
+                self._count[r][ok] += 1
+
+
+def rollup_arrays(t, v, size):
+    """Vectorised rollup of one series: t in epoch seconds, v the values.
+
+    Returns (start, min, max, mean, count) arrays, one entry per bucket.
+    """
+    import pandas as pd
+    ok = ~np.isnan(v)
+    df = pd.DataFrame({'start': t[ok] - t[ok] % size, 'v': v[ok]})
+    g = df.groupby('start')['v'].agg(['min', 'max', 'mean', 'count'])
+    return (g.index.to_numpy(), g['min'].to_numpy(), g['max'].to_numpy(),
+            g['mean'].to_numpy(), g['count'].to_numpy())
+
+
+def build_rollups(df, resolutions=RESOLUTIONS, prefix='sensor_readings_rollup'):
+    """Write the rollup files for a whole long frame (date, value, type).
+
+    Only complete buckets are written: the bucket of the last sample is
+    still open, the RollupWriter of the logger writes it when it is done.
+    """
+    from sensorlog import local_to_epoch_ms
+    df = df.sort_values('date', kind='stable')
+    t = local_to_epoch_ms(df['date']) // 1000
+    last = t.max() if len(t) else 0
+    for r, size in resolutions.items():
+        out = io.StringIO()
+        out.write(','.join(ROLLUP_COLUMNS) + '\n')
+        parts = []
+        for name in df['type'].unique():
+            mask = (df['type'] == name).to_numpy()
+            start, mn, mx, mean, count = rollup_arrays(t[mask], df['value'].to_numpy()[mask], size)
+            parts.append((start, name, mn, mx, mean, count))
+        # write buckets in time order, like the logger does
+        rows = [(s, name, a, b, c, n) for start, name, mn, mx, mean, count in parts
+                for s, a, b, c, n in zip(start, mn, mx, mean, count) if s + size <= last]
+        rows.sort(key=lambda row: (row[0], CHANNELS.index(row[1]) if row[1] in CHANNELS else 99))
+        for row in rows:
+            out.write(_format_row(*row))
+        with open(rollup_path(r, prefix), 'w') as f:
+            f.write(out.getvalue())
+        print("{}: {} buckets".format(rollup_path(r, prefix), len(rows)))
+
+
+################################################################
+# Reading rollups in the dashboard
+###############################################################
+
+def parse_rollup_chunk(raw, columns=None):
+    """Parse rollup lines into the long frame (date, value, type) used by SeriesStore.
+
+    date is the bucket start in local time. Every bucket gives three rows:
+    the mean as the series itself and the min and max as <name>_min and
+    <name>_max, for the envelope of the charts (see figures.py).
+    """
+    import pandas as pd
+    from dataloader import empty_long_frame
+    if not raw.strip():
+        return empty_long_frame()
+    df = pd.read_csv(io.BytesIO(raw), names=ROLLUP_COLUMNS, header=None)
+    dates = (pd.to_datetime(df['start'], unit='s', utc=True)
+             .dt.tz_convert(LOCAL_TZ).dt.tz_localize(None).astype('datetime64[ns]'))
+    types = df['type'].astype(str)
+    return pd.concat([
+        pd.DataFrame({'date': dates, 'value': df[column].astype('float64'), 'type': types + suffix})
+        for column, suffix in (('mean', ''), ('min', '_min'), ('max', '_max'))], ignore_index=True)
+
+
+def join_raw(snap, raw, size):
+    """Rollup snapshot with the raw samples after its last bucket appended.
+
+    The rollup files only have closed buckets, the raw data after them is
+    added to every series, also as <name>_min and <name>_max, so the charts
+    reach the newest sample.
+    """
+    from dataloader import Snapshot
+    series = {}
+    for name, (times, values) in snap.series.items():
+        base = name
+        for suffix in ('_min', '_max'):
+            if name.endswith(suffix) and name[:-len(suffix)] in raw.series:
+                base = name[:-len(suffix)]
+        raw_times, raw_values = raw.get(base)
+        start = times[-1] + np.timedelta64(size, 's') if len(times) else None
+        i = np.searchsorted(raw_times, start) if start is not None else len(raw_times)
+        if i < len(raw_times):
+            times = np.concatenate([times, raw_times[i:]])
+            values = np.concatenate([values, raw_values[i:]])
+        series[name] = (times, values)
+    return Snapshot((snap.version, raw.version), series)
+
+
+class RollupSnapshots:
+    """One SnapshotCache per resolution, plus the raw one."""
+
+    def __init__(self, raw, resolutions=RESOLUTIONS, prefix='sensor_readings_rollup'):
+        from dataloader import SnapshotCache, TailLoader
+        self.raw = raw
+        self.resolutions = dict(resolutions)
+        self.caches = {r: SnapshotCache(TailLoader(rollup_path(r, prefix), parse=parse_rollup_chunk))
+                       for r in self.resolutions}
+        self._joined = {}       # resolution -> snapshot of join_raw()
+
+    def get(self, resolution):
+        """Snapshot of a resolution returned by select(), 'raw' for the raw data."""
+        if resolution == 'raw':
+            return self.raw.get()
+        return self._join(resolution, self.caches[resolution].get())
+
+    def _join(self, resolution, snap):
+        raw = self.raw.get()
+        joined = self._joined.get(resolution)
+        if joined is None or joined.version != (snap.version, raw.version):
+            joined = join_raw(snap, raw, self.resolutions[resolution])
+            self._joined[resolution] = joined
+        return joined
+
+    def select(self, x_range, max_points):
+        """Return (resolution, snapshot) for the visible x_range.
+
+        x_range is (start, end) as datetime64 or None for all data. The
+        coarsest resolution that still has at least max_points buckets in the
+        range is used, with the raw samples after its last closed bucket
+        (join_raw()); when none has, the raw data is.
+        """
+        raw = self.raw.get()
+        if x_range is None:
+            firsts = [t[0] for t, v in raw.series.values() if len(t)]
+            lasts = [t[-1] for t, v in raw.series.values() if len(t)]
+            if not firsts:
+                return 'raw', raw
+            x_range = (min(firsts), max(lasts))
+        span = (x_range[1] - x_range[0]) / np.timedelta64(1, 's')
+        if span > 0 and max_points:
+            for r, size in sorted(self.resolutions.items(), key=lambda item: -item[1]):
+                if span / size >= max_points:
+                    snap = self.caches[r].get()
+                    if snap.series:
+                        return r, self._join(r, snap)
+        return 'raw', raw
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'build':
+        from dataloader import open_log
+        from derived import with_derived
+        # vpd from temperature and humidity, not the stored values
+        build_rollups(with_derived(open_log().load()))
+    else:
+        print("usage: python rollup.py build")
+        sys.exit(1)
@@ -0,0 +1,97 @@
+################################################################
+# Scheduler main loop
+###############################################################
+
+# `while True: schedule.run_pending()` spins a full CPU core. run_forever()
+# runs the due jobs and then sleeps until the next one is due. The sleep is
+# an Event.wait, so SIGTERM (systemctl stop) or Ctrl-C wake it up at once and
+# the loop ends cleanly, running the on_stop callbacks (e.g. flushing the log).
+# With a Metrics object (metrics.py) it records how long after its planned
+# time every job was started.
+
+import datetime
+import signal
+import threading
+import time
+
+import schedule
+
+
+class CpuReport:
+    """CPU use of the process and of the loop itself since the last report."""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._wall = time.monotonic()
+        self._cpu = time.process_time()
+        self._loop = time.thread_time()
+
+    def line(self):
+        wall = max(time.monotonic() - self._wall, 1e-9)
+        cpu = time.process_time() - self._cpu
+        loop = time.thread_time() - self._loop
+        self._reset()
+        return "CPU over the last {:.0f} s: process {:.1f} %, scheduler loop {:.2f} %".format(
+            wall, 100 * cpu / wall, 100 * loop / wall)
+
+
+def job_name(job):
+    """Name of a schedule job; run_threaded(func, ...) jobs are named after
+    func, like in jobrunner.py."""
+    func = job.job_func
+    for arg in getattr(func, 'args', ()):
+        if callable(arg):
+            return getattr(arg, '__name__', repr(arg))
+    return getattr(getattr(func, 'func', func), '__name__', repr(func))
+
+
+def run_forever(scheduler=schedule.default_scheduler, on_stop=(), report_every=600,
+                max_sleep=60, metrics=None):
+    """Run scheduled jobs until SIGTERM or SIGINT.
+
+    report_every: seconds between two CPU use reports (None to disable).
+    max_sleep: upper bound for one sleep, so jobs added from other threads
+    are picked up.
+    """
+    lags = None
+    if metrics is not None:
+        lags = metrics.histogram('scheduler_start_lag_seconds',
+                                 'Time between the planned and the actual start of a job.', 'job')
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Stopping ({})...".format(signal.Signals(signum).name))
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    cpu = CpuReport()
+    next_report = time.monotonic() + report_every if report_every else None
+    try:
+        while not stop.is_set():
+            if lags is not None:
+                now = datetime.datetime.now()
+                for job in scheduler.jobs:
+                    if job.should_run:
+                        lags.observe(max((now - job.next_run).total_seconds(), 0), job_name(job))
+            scheduler.run_pending()
+            idle = scheduler.idle_seconds
+            sleep = max_sleep if idle is None else min(max(idle, 0), max_sleep)
+            if next_report is not None:
+                now = time.monotonic()
+                if now >= next_report:
+                    print(cpu.line())
+                    next_report = now + report_every
+                sleep = min(sleep, max(next_report - now, 0))
+            stop.wait(sleep)
+    finally:
+        for callback in on_stop:
+            # one failing callback must not skip the others (relays off, log flush)
+            try:
+                callback()
+            except Exception as e:
+                print("Stop callback {} failed: {!r}".format(getattr(callback, '__name__', callback), e))
+        print(cpu.line())
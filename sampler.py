@@ -0,0 +1,94 @@
+################################################################
+# Sampling service
+###############################################################
+
+# printSensor() and logdatalong() used to read both BME280s on their own, so
+# every tick hit the I2C bus twice and the console and the log showed
+# different readings. The Sampler reads the sensors once per tick and hands
+# the same immutable Sample to every subscriber (logger, console, checker,
+# controllers), however many there are.
+# With a Metrics object (metrics.py) the duration of every sensor read and
+# of every subscriber is recorded.
+
+import collections
+import threading
+import time
+
+from sensorlog import CHANNELS
+
+# same order as the list returned by getSensors(), so sample[1] is Temp1,
+# sample[3] is Humid1 and so on, and code written for that list keeps working
+Sample = collections.namedtuple('Sample', ['date'] + CHANNELS + ['timestamp'])
+
+
+class Subscriber:
+    def __init__(self, callback, every, name=None):
+        self.callback = callback
+        self.every = every
+        self.name = name or getattr(callback, '__name__', repr(callback))
+        self.errors = 0
+
+
+class Sampler:
+    """Read the sensors once per tick and publish the sample.
+
+    read: function returning the getSensors() list.
+    """
+
+    def __init__(self, read, metrics=None):
+        self.read = read
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.latest = None
+        self.ticks = 0
+        self.read_seconds = 0.0    # duration of the last sensor read
+        self._reads = self._handlers = None
+        if metrics is not None:
+            self._reads = metrics.histogram('sensor_read_seconds', 'Duration of one read of the sensors.')
+            self._handlers = metrics.histogram('sampler_subscriber_seconds',
+                                               'Time a subscriber took for one sample.', 'subscriber')
+            metrics.collector(self._collect)
+
+    def subscribe(self, callback, every=1, name=None):
+        """Call callback(sample) for every `every`-th sample."""
+        with self._lock:
+            self._subscribers.append(Subscriber(callback, every, name))
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s.callback is not callback]
+
+    def publish(self, sample):
+        self.latest = sample
+        self.ticks += 1
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for s in subscribers:
+            if self.ticks % s.every:
+                continue
+            start = time.perf_counter()
+            try:
+                s.callback(sample)
+            except Exception as e:
+                # one broken consumer must not stop the others
+                s.errors += 1
+                print("Subscriber {} failed: {!r}".format(s.name, e))
+            if self._handlers is not None:
+                self._handlers.observe(time.perf_counter() - start, s.name)
+
+    def tick(self):
+        start = time.perf_counter()
+        sample = Sample(*self.read())
+        self.read_seconds = time.perf_counter() - start
+        if self._reads is not None:
+            self._reads.observe(self.read_seconds)
+        self.publish(sample)
+        return sample
+
+    def _collect(self):
+        from metrics import labels
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return [('sampler_ticks_total', 'counter', 'Samples read.', {None: self.ticks}),
+                ('sampler_subscriber_errors_total', 'counter', 'Subscriber calls that raised.',
+                 {labels(subscriber=s.name): s.errors for s in subscribers})]
@@ -0,0 +1,375 @@
+################################################################
+# Sensor log formats
+###############################################################
+
+# v1: the long text format (date,value,type) with local timestamps
+#     '%H:%M:%S %d/%m/%Y', eight rows per sample
+# v2: a versioned wide csv, one row per sample with a UTC epoch timestamp:
+#       # greenbox sensor log v2
+#       ts,Temp1,Temp2,Humid1,Humid2,Press1,Press2,vpd1,vpd2
+#       1714464949,21.29,20.66,82.58,43.79,...
+# binary: one fixed-size record per sample with a typed UTC timestamp and one
+#     float32 per channel. Records are plain NumPy structured arrays, so a
+#     whole file is loaded with a single np.fromfile call.
+#
+# Convert an existing long csv:
+#   python sensorlog.py convert sensor_readings_bme280_long.csv sensor_readings_bme280.bin
+#   python sensorlog.py convert-v2 sensor_readings_bme280_long.csv sensor_readings_bme280_v2.csv
+
+import datetime
+import heapq
+import json
+import os
+import struct
+import sys
+import zoneinfo
+
+import numpy as np
+
+# channel order as returned by getSensors() (values[1] .. values[8])
+CHANNELS = ['Temp1', 'Temp2', 'Humid1', 'Humid2', 'Press1', 'Press2', 'vpd1', 'vpd2']
+# local timezone of the timestamps in the long csv
+LOCAL_TZ = 'Europe/Berlin'
+
+V1FILE = 'sensor_readings_bme280_long.csv'
+BINFILE = 'sensor_readings_bme280.bin'
+BIN_MAGIC = b'GBOXBIN1'
+
+V2FILE = 'sensor_readings_bme280_v2.csv'
+V2_MAGIC = '# greenbox sensor log v2'
+
+# the log format the logger writes and the dashboards read:
+#  'csv'    v1 long text format, local timestamps
+#  'csv2'   v2 wide csv, one row per sample with UTC epoch timestamps
+#  'binary' typed records
+LOG_BACKEND = 'csv'
+LOG_FILES = {'csv': V1FILE, 'csv2': V2FILE, 'binary': BINFILE}
+
+
+def log_path(backend=None, prefix=''):
+    """File of the log format backend (LOG_BACKEND by default)."""
+    backend = backend or LOG_BACKEND
+    if backend not in LOG_FILES:
+        raise ValueError('unknown log backend: {}'.format(backend))
+    return prefix + LOG_FILES[backend]
+# v1 timestamp format, see getSensors() in main_scheduler.py
+V1_DATE_FORMAT = '%H:%M:%S %d/%m/%Y'
+
+
+def detect_version(path):
+    """Return 1 or 2 for csv logs, 'binary' for binary logs, None if missing."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(64)
+    except FileNotFoundError:
+        return None
+    if head.startswith(BIN_MAGIC):
+        return 'binary'
+    if head.startswith(V2_MAGIC.encode()):
+        return 2
+    return 1
+
+
+################################################################
+# Schema v2: wide csv with epoch timestamps
+###############################################################
+
+def v2_header(channels=CHANNELS):
+    return V2_MAGIC + '\n' + ','.join(['ts'] + list(channels)) + '\n'
+
+
+def format_v2_row(timestamp, values):
+    # timestamp: timezone aware datetime or epoch seconds
+    if isinstance(timestamp, datetime.datetime):
+        timestamp = timestamp.timestamp()
+    cells = ['' if v is None or v != v else str(round(v, 2)) for v in values]
+    return str(int(timestamp)) + ',' + ','.join(cells) + '\n'
+
+
+def append_v2(path, timestamp, values, channels=CHANNELS):
+    new = not os.path.isfile(path)
+    with open(path, 'a') as f:
+        if new:
+            f.write(v2_header(channels))
+        f.write(format_v2_row(timestamp, values))
+
+
+def _v1_epoch(date, tz, state):
+    # local v1 timestamp -> epoch seconds. In the repeated hour at the end of
+    # DST the clock goes back; state remembers the last local time so that the
+    # second pass through that hour is read as winter time (fold=1).
+    local = datetime.datetime.strptime(date, V1_DATE_FORMAT)
+    last = state.get('last')
+    if last is not None and local < last - datetime.timedelta(minutes=30):
+        state['fold'] = 1   # the clock went back
+    if local.replace(tzinfo=tz, fold=0).utcoffset() == local.replace(tzinfo=tz, fold=1).utcoffset():
+        state['fold'] = 0   # not in the repeated hour
+    state['last'] = local
+    aware = local.replace(tzinfo=tz, fold=state.get('fold', 0))
+    return int(aware.timestamp())
+
+
+def _in_order(samples, window, late):
+    """Yield (ts, item) pairs sorted by ts, holding back up to window pairs.
+
+    The logger wrote from several threads, so a sample can come a little
+    after a newer one. Samples older than one already yielded are dropped
+    and counted in late[0].
+    """
+    heap = []
+    last = None
+    for seq, (ts, item) in enumerate(samples):
+        heapq.heappush(heap, (ts, seq, item))
+        if len(heap) > window:
+            ts, seq, item = heapq.heappop(heap)
+            if last is not None and ts < last:
+                late[0] += 1
+                continue
+            last = ts
+            yield ts, item
+    while heap:
+        ts, seq, item = heapq.heappop(heap)
+        if last is not None and ts < last:
+            late[0] += 1
+            continue
+        last = ts
+        yield ts, item
+
+
+def convert_v1_to_v2(src, dst, tz=LOCAL_TZ, channels=CHANNELS, window=64):
+    """Stream a v1 long csv into a v2 wide csv with constant memory.
+
+    The eight rows of a sample are collected by their timestamp; rows of up to
+    `window` samples may be interleaved (the logger wrote from several
+    threads). The samples are written in time order, as far as they are out
+    of order within `window` samples. Missing channels stay empty.
+    """
+    tz = zoneinfo.ZoneInfo(tz)
+    index = {c: i for i, c in enumerate(channels)}
+    state = {}
+    counts = {'rows': 0, 'samples': 0}
+    late = [0]
+
+    def samples(f):
+        pending = {}    # date string -> values, in order of appearance
+        for line in f:
+            parts = [p.strip() for p in line.split(',')]
+            if len(parts) != 3 or parts[0] == 'date':
+                continue
+            date, value, name = parts
+            if name not in index:
+                continue
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+            if date not in pending:
+                if len(pending) >= window:
+                    first = next(iter(pending))
+                    yield _v1_epoch(first, tz, state), pending.pop(first)
+                pending[date] = [None] * len(channels)
+            pending[date][index[name]] = value
+            counts['rows'] += 1
+        while pending:
+            first = next(iter(pending))
+            yield _v1_epoch(first, tz, state), pending.pop(first)
+
+    with open(src) as f, open(dst, 'w') as out:
+        out.write(v2_header(channels))
+        for ts, values in _in_order(samples(f), window, late):
+            out.write(format_v2_row(ts, values))
+            counts['samples'] += 1
+    print("converted {} rows into {} samples: {} -> {} ({} -> {} bytes)".format(
+        counts['rows'], counts['samples'], src, dst, os.path.getsize(src), os.path.getsize(dst)))
+    if late[0]:
+        print("dropped {} samples older than samples already written".format(late[0]))
+
+
+################################################################
+# Binary log
+###############################################################
+
+def record_dtype(channels=CHANNELS):
+    # ts: milliseconds since the epoch (UTC)
+    return np.dtype([('ts', '<i8')] + [(c, '<f4') for c in channels])
+
+
+def binlog_header(channels=CHANNELS):
+    meta = json.dumps({'ts': 'epoch_ms_utc', 'channels': list(channels)}).encode()
+    return BIN_MAGIC + struct.pack('<I', len(meta)) + meta
+
+
+def read_header(f):
+    """Read the header of a binary log, return (channels, header_size)."""
+    f.seek(0)
+    magic = f.read(len(BIN_MAGIC))
+    if magic != BIN_MAGIC:
+        raise ValueError('not a greenbox binary log')
+    (n,) = struct.unpack('<I', f.read(4))
+    meta = json.loads(f.read(n))
+    return meta['channels'], len(BIN_MAGIC) + 4 + n
+
+
+def create_binlog(path, channels=CHANNELS):
+    with open(path, 'wb') as f:
+        f.write(binlog_header(channels))
+
+
+def append_records(path, records):
+    """Append a structured array (see record_dtype) to a binary log."""
+    if not os.path.isfile(path):
+        create_binlog(path, records.dtype.names[1:])
+    with open(path, 'ab') as f:
+        f.write(records.tobytes())
+
+
+def sample_record(timestamp, values, channels=CHANNELS):
+    # timestamp: timezone aware datetime, values: one float per channel
+    rec = np.zeros(1, dtype=record_dtype(channels))
+    rec['ts'] = round(timestamp.timestamp() * 1000)
+    for c, v in zip(channels, values):
+        rec[c] = np.nan if v is None else v
+    return rec
+
+
+def append_sample(path, timestamp, values, channels=CHANNELS):
+    append_records(path, sample_record(timestamp, values, channels))
+
+
+def read_binlog(path, start=0):
+    """Load records from a binary log.
+
+    start is the index of the first record to read, which makes it cheap to
+    fetch only the records appended since the last call. A partially written
+    trailing record (e.g. after a power loss) is ignored.
+    Returns (records, channels).
+    """
+    with open(path, 'rb') as f:
+        channels, offset = read_header(f)
+        dtype = record_dtype(channels)
+        size = os.fstat(f.fileno()).st_size
+        count = (size - offset) // dtype.itemsize - start
+        if count <= 0:
+            return np.zeros(0, dtype=dtype), channels
+        f.seek(offset + start * dtype.itemsize)
+        return np.fromfile(f, dtype=dtype, count=count), channels
+
+
+################################################################
+# Conversion from the long csv
+###############################################################
+
+def local_to_epoch_ms(dates, tz=LOCAL_TZ):
+    # naive local datetimes -> epoch milliseconds (UTC)
+    import pandas as pd
+    dates = pd.DatetimeIndex(dates)
+    try:
+        aware = dates.tz_localize(tz, ambiguous='infer', nonexistent='shift_forward')
+    except Exception:
+        # the repeated hour at the end of DST can't always be inferred from a
+        # chunk of data; treat it as summer time then
+        aware = dates.tz_localize(tz, ambiguous=True, nonexistent='shift_forward')
+    return aware.tz_convert('UTC').as_unit('ms').asi8
+
+
+def long_to_records(df, channels=CHANNELS):
+    """Pivot a parsed long frame (date,value,type) into binary log records."""
+    wide = df.pivot_table(index='date', columns='type', values='value', aggfunc='last')
+    rec = np.zeros(len(wide), dtype=record_dtype(channels))
+    rec['ts'] = local_to_epoch_ms(wide.index)
+    for c in channels:
+        rec[c] = wide[c].to_numpy(dtype='float32') if c in wide else np.nan
+    return rec
+
+
+def _sorted_chunks(chunks, window, late):
+    """Sort chunks of records by ts, also across chunk borders.
+
+    The last `window` records of a chunk are held back and sorted together
+    with the next chunk. Records older than one already returned are
+    dropped and counted in late[0].
+    """
+    held = None
+    last = None
+    for rec in chunks:
+        if held is not None:
+            rec = np.concatenate([held, rec])
+        rec = rec[np.argsort(rec['ts'], kind='stable')]
+        if last is not None:
+            keep = rec['ts'] >= last
+            late[0] += len(rec) - int(keep.sum())
+            rec = rec[keep]
+        held = rec[max(len(rec) - window, 0):]
+        rec = rec[:max(len(rec) - window, 0)]
+        if len(rec):
+            last = rec['ts'][-1]
+            yield rec
+    if held is not None and len(held):
+        yield held
+
+
+def _v2_chunks(src, chunksize):
+    import pandas as pd
+    for chunk in pd.read_csv(src, skiprows=1, chunksize=chunksize):
+        rec = np.zeros(len(chunk), dtype=record_dtype())
+        rec['ts'] = chunk['ts'].to_numpy(dtype='int64') * 1000
+        for c in CHANNELS:
+            rec[c] = chunk[c].to_numpy(dtype='float32') if c in chunk else np.nan
+        yield rec
+
+
+def _v1_chunks(src, chunksize, counts):
+    import pandas as pd
+    from dataloader import LONG_COLUMNS
+    carry = None
+    for chunk in pd.read_csv(src, names=LONG_COLUMNS, header=0, skipinitialspace=True,
+                             chunksize=chunksize):
+        chunk['date'] = pd.to_datetime(chunk['date'], format=V1_DATE_FORMAT, errors='coerce')
+        chunk['type'] = chunk['type'].astype(str).str.strip()
+        chunk = chunk.dropna(subset=['date'])
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if not len(chunk):
+            continue
+        # the rows of the last sample may continue in the next chunk
+        last = chunk['date'].iloc[-1]
+        carry = chunk[chunk['date'] == last]
+        chunk = chunk[chunk['date'] != last]
+        counts['rows'] += len(chunk)
+        yield long_to_records(chunk)
+    if carry is not None and len(carry):
+        counts['rows'] += len(carry)
+        yield long_to_records(carry)
+
+
+def convert_csv(src, dst, chunksize=200000, window=1000):
+    """Convert a csv log (v1 or v2) into a binary log, reading it in chunks.
+
+    The records are written in time order (see _sorted_chunks()).
+    """
+    counts = {'rows': 0}
+    late = [0]
+    if detect_version(src) == 2:
+        chunks = _v2_chunks(src, chunksize)
+    else:
+        chunks = _v1_chunks(src, chunksize, counts)
+    create_binlog(dst)
+    samples = 0
+    for rec in _sorted_chunks(chunks, window, late):
+        append_records(dst, rec)
+        samples += len(rec)
+    print("converted {} rows into {} samples: {} -> {} ({} -> {} bytes)".format(
+        counts['rows'] or samples, samples, src, dst, os.path.getsize(src), os.path.getsize(dst)))
+    if late[0]:
+        print("dropped {} samples older than samples already written".format(late[0]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'convert':
+        convert_csv(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 4 and sys.argv[1] == 'convert-v2':
+        convert_v1_to_v2(sys.argv[2], sys.argv[3])
+    else:
+        print("usage: python sensorlog.py convert <log.csv> <out.bin>")
+        print("       python sensorlog.py convert-v2 <long.csv> <out_v2.csv>")
+        sys.exit(1)
@@ -0,0 +1,146 @@
+################################################################
+# Sensor backends
+###############################################################
+
+# getSensors() used to open the I2C bus and load the BME280 calibration at
+# import time, so nothing started without a Pi. The sensors are now read
+# through a backend:
+#  - BME280Sensors: the two BME280 on the I2C bus
+#  - SyntheticSensors: made up values with a daily cycle and some noise
+#  - ReplaySensors: the samples of a recorded log (v1, v2 or binary), one per
+#    read, with the timestamps moved to the start of the replay
+# speedup: how much faster than real time the backend runs. main_scheduler.py
+# reads the sensors every LOG_INTERVAL / speedup seconds, so replaying a log
+# with speedup=1000 writes months of data in minutes, through the logger,
+# the rollups and the controllers, with the dashboards reading the result.
+#
+# read() returns (timestamp, [(temperature, humidity, pressure) per sensor]),
+# the timestamp as naive UTC datetime like bme280.sample().
+
+import datetime
+import math
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from sensorlog import CHANNELS, LOCAL_TZ, V1FILE
+
+# BME280 sensor addresses
+ADDRESSES = (0x76, 0x77)
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class BME280Sensors:
+    """BME280 sensors on the I2C bus."""
+
+    speedup = 1
+
+    def __init__(self, addresses=ADDRESSES, bus=1):
+        # only on the Pi
+        import smbus2
+        import bme280
+        self._bme280 = bme280
+        self.addresses = addresses
+        self.bus = smbus2.SMBus(bus)
+        # calibration is read once, not for every sample
+        self.calibration = [bme280.load_calibration_params(self.bus, a) for a in addresses]
+
+    def read(self):
+        data = [self._bme280.sample(self.bus, a, c) for a, c in zip(self.addresses, self.calibration)]
+        return data[0].timestamp, [(d.temperature, d.humidity, d.pressure) for d in data]
+
+
+class SyntheticSensors:
+    """Made up readings: daily temperature and humidity cycle plus noise.
+
+    With speedup > 1 the clock of the readings runs that much faster than
+    real time, starting now.
+    """
+
+    def __init__(self, sensors=2, speedup=1, seed=None):
+        self.sensors = sensors
+        self.speedup = speedup
+        self._random = random.Random(seed)
+        self._start = _utcnow()
+        self._started = time.monotonic()
+
+    def read(self):
+        elapsed = (time.monotonic() - self._started) * self.speedup
+        t = self._start + datetime.timedelta(seconds=elapsed)
+        hour = t.hour + t.minute / 60
+        day = math.sin(2 * math.pi * (hour - 9) / 24)     # warmest in the afternoon
+        weather = math.sin(2 * math.pi * elapsed / (3 * 86400))
+        readings = []
+        for i in range(self.sensors):
+            noise = self._random.gauss
+            readings.append((22 + 3 * day + 0.5 * i + noise(0, 0.1),
+                             60 - 10 * day - 2 * i + noise(0, 0.5),
+                             1013 + 5 * weather + 0.3 * i + noise(0, 0.05)))
+        return t, readings
+
+
+def load_samples(path=V1FILE):
+    """(times, values) of all samples of a log: UTC datetime64 and an array
+    with temperature, humidity and pressure per sensor, as in read()."""
+    from dataloader import loader_for
+    df = loader_for(path).load()
+    wide = df.pivot_table(index='date', columns='type', values='value', aggfunc='last')
+    names = [c for c in CHANNELS if not c.startswith('vpd')]
+    wide = wide.reindex(columns=names).dropna().sort_index()
+    # local time in the log; the repeated hour in autumn can't be told apart
+    utc = wide.index.tz_localize(LOCAL_TZ, ambiguous='NaT', nonexistent='NaT').tz_convert('UTC')
+    keep = ~utc.isna()
+    return utc[keep].tz_localize(None).values, wide.values[keep]
+
+
+class ReplaySensors:
+    """Replay the samples of a recorded log, one per read.
+
+    The timestamps are moved so the first sample is now and the following
+    keep their spacing; when the log is used up it starts again, later on.
+    speedup only tells main_scheduler.py how fast to read.
+    """
+
+    def __init__(self, path=V1FILE, speedup=1000, loop=True):
+        self.path = path
+        self.speedup = speedup
+        self.loop = loop
+        self.times, self.values = load_samples(path)
+        if not len(self.times):
+            raise ValueError('no samples in {}'.format(path))
+        self._next = 0
+        self._offset = np.datetime64(_utcnow()) - self.times[0]
+        self.replayed = 0
+
+    def read(self):
+        if self._next >= len(self.times):
+            if not self.loop:
+                raise EOFError('replay of {} finished'.format(self.path))
+            # continue after the end, one sample interval later
+            step = np.median(np.diff(self.times)) if len(self.times) > 1 else np.timedelta64(10, 's')
+            self._offset += self.times[-1] - self.times[0] + step
+            self._next = 0
+        i = self._next
+        self._next += 1
+        self.replayed += 1
+        t = pd.Timestamp(self.times[i] + self._offset).to_pydatetime()
+        row = self.values[i]
+        # columns: Temp1, Temp2, Humid1, Humid2, Press1, Press2
+        n = len(row) // 3
+        return t, [(row[s], row[n + s], row[2 * n + s]) for s in range(n)]
+
+
+def open_sensors(backend='bme280', replay=V1FILE, speedup=1000):
+    """Sensor backend 'bme280', 'synthetic' or 'replay'."""
+    if backend == 'bme280':
+        return BME280Sensors()
+    if backend == 'synthetic':
+        return SyntheticSensors(speedup=speedup)
+    if backend == 'replay':
+        return ReplaySensors(replay, speedup)
+    raise ValueError('unknown sensor backend: {}'.format(backend))
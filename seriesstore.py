@@ -0,0 +1,131 @@
+################################################################
+# In-memory per-series store
+###############################################################
+
+# The dashboards used to keep one long DataFrame and pick a sensor out of it
+# with df[df['type'] == 'Temp1'] on every refresh. Here every series (Temp1,
+# Humid2, vpd1, ...) has its own preallocated arrays of timestamps and values,
+# so a chart gets its data as an array view and the current value is simply
+# the last element.
+
+import threading
+
+import numpy as np
+
+
+class Series:
+    """Append-only typed arrays for one sensor series.
+
+    The arrays grow by doubling, so appending is amortised O(1). times() and
+    values() return views of the filled part; a view stays valid (and
+    unchanged) while more data is appended, because appends either write
+    behind it or move the data into a new, bigger array.
+
+    The times are kept sorted, the charts search them (np.searchsorted): a
+    batch is sorted before it is appended. Points older than the last stored
+    one (a late sample, or the repeated local hour when DST ends) are merged
+    into new arrays, so views handed out before stay unchanged; they are
+    counted in `late`.
+    """
+
+    def __init__(self, capacity=1024):
+        self._t = np.empty(capacity, dtype='datetime64[ns]')
+        self._v = np.empty(capacity, dtype='float64')
+        self.n = 0
+        self.late = 0
+
+    def _reserve(self, n):
+        if n <= len(self._t):
+            return
+        capacity = max(n, 2 * len(self._t))
+        t = np.empty(capacity, dtype=self._t.dtype)
+        v = np.empty(capacity, dtype=self._v.dtype)
+        t[:self.n] = self._t[:self.n]
+        v[:self.n] = self._v[:self.n]
+        self._t, self._v = t, v
+
+    def extend(self, times, values):
+        times = np.asarray(times, dtype='datetime64[ns]')
+        values = np.asarray(values, dtype='float64')
+        if len(times) > 1 and np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind='stable')
+            times, values = times[order], values[order]
+        if self.n and len(times) and times[0] < self._t[self.n - 1]:
+            self._merge(times, values)
+            return
+        k = len(times)
+        self._reserve(self.n + k)
+        self._t[self.n:self.n + k] = times
+        self._v[self.n:self.n + k] = values
+        self.n += k
+
+    def _merge(self, times, values):
+        # O(stored points), but only for the rare batch that goes back in time
+        self.late += int(np.count_nonzero(times < self._t[self.n - 1]))
+        t = np.concatenate([self._t[:self.n], times])
+        v = np.concatenate([self._v[:self.n], values])
+        order = np.argsort(t, kind='stable')
+        n = len(t)
+        capacity = len(self._t) if n <= len(self._t) else max(n, 2 * len(self._t))
+        self._t = np.empty(capacity, dtype=self._t.dtype)
+        self._v = np.empty(capacity, dtype=self._v.dtype)
+        self._t[:n] = t[order]
+        self._v[:n] = v[order]
+        self.n = n
+
+    def append(self, time, value):
+        self.extend([time], [value])
+
+    def times(self):
+        return self._t[:self.n]
+
+    def values(self):
+        return self._v[:self.n]
+
+    def latest(self):
+        if not self.n:
+            return None, None
+        return self._t[self.n - 1], self._v[self.n - 1]
+
+    def __len__(self):
+        return self.n
+
+
+class SeriesStore:
+    """Series keyed by name, fed with new rows of the long log."""
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def extend(self, name, times, values):
+        with self._lock:
+            if name not in self._series:
+                self._series[name] = Series()
+            self._series[name].extend(times, values)
+
+    def extend_long(self, df):
+        # df: new rows in long format (date, value, type)
+        if not len(df):
+            return
+        for name, rows in df.groupby('type', sort=False):
+            self.extend(name, rows['date'].to_numpy(), rows['value'].to_numpy())
+
+    def names(self):
+        return list(self._series)
+
+    def get(self, name):
+        return self._series.get(name)
+
+    def latest(self, name):
+        s = self._series.get(name)
+        return s.latest() if s is not None else (None, None)
+
+    def views(self):
+        """Return {name: (times, values)} views of the data stored right now."""
+        with self._lock:
+            return {name: (s.times(), s.values()) for name, s in self._series.items()}
@@ -0,0 +1,98 @@
+import datetime
+import time
+import types
+
+from controller import Controller, Device, Hysteresis, channel
+from relays import RELAY_PINS, Actuator, RelayBank, SimulatedGPIO
+
+
+def sample(humid):
+    return types.SimpleNamespace(Humid1=humid, timestamp=datetime.datetime.now(datetime.timezone.utc))
+
+
+def humidifier():
+    gpio = SimulatedGPIO()
+    actuator = Actuator(RelayBank(RELAY_PINS, gpio))
+    # R2 powers it, a pulse on R3 presses its button
+    device = Device(actuator, 'humidifier', [(0, 'R2', True), (0.05, 'R3', True), (0.1, 'R3', False)],
+                    [(0, 'R2', False)], relay='R2')
+    return device, gpio
+
+
+def test_no_decision_while_the_device_is_busy():
+    device, gpio = humidifier()
+    control = Controller(device, channel('Humid1'), Hysteresis(40, 50))
+    device.run_for(0.3)                 # started by hand, still running
+    control.update(sample(30))
+    assert control.switches == 0
+    time.sleep(0.2)
+    assert [on for t, pin, on in gpio.log if pin == RELAY_PINS['R3']] == [True, False]
+    device.actuator.stop(all_off=False)
+
+
+class FakeDevice:
+    """Switches at once, like a relay that is never busy."""
+
+    name = 'humidifier'
+
+    def __init__(self):
+        self.on = False
+        self.switched = []
+
+    def switch(self, on, on_start=None):
+        self.on = on
+        self.switched.append(on)
+
+    def is_on(self):
+        return self.on
+
+    def busy(self):
+        return False
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def controller(monkeypatch, **limits):
+    import controller as module
+    clock = Clock()
+    monkeypatch.setattr(module.time, 'monotonic', clock)
+    device = FakeDevice()
+    return Controller(device, channel('Humid1'), Hysteresis(40, 50), **limits), device, clock
+
+
+def test_hysteresis(monkeypatch):
+    control, device, clock = controller(monkeypatch)
+    for humid in (45, 39, 45, 49, 51, 45, 39):
+        control.update(sample(humid))
+    assert device.switched == [True, False, True]
+    assert control.update(sample(float('nan'))) is None and control.value == 39
+
+
+def test_min_on_holds_the_device_on(monkeypatch):
+    control, device, clock = controller(monkeypatch, min_on=60, min_off=60)
+    control.update(sample(30))
+    clock.now += 30
+    control.update(sample(60))
+    assert device.switched == [True] and control.limited == 1
+    clock.now += 31
+    control.update(sample(60))
+    assert device.switched == [True, False]
+
+
+def test_max_switches_per_hour(monkeypatch):
+    control, device, clock = controller(monkeypatch, max_switches=1)
+    for humid in (30, 60, 30):
+        control.update(sample(humid))
+        clock.now += 1
+    # switching off is always allowed, the next switch on waits for the hour
+    assert device.switched == [True, False]
+    assert control.limited == 1
+    clock.now += 3600
+    control.update(sample(30))
+    assert device.switched == [True, False, True]
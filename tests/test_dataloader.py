@@ -0,0 +1,75 @@
+import numpy as np
+
+import dataloader
+
+HEADER = 'date,value,type\n'
+
+
+def rows(start, n):
+    return ''.join('{:02d}:00:00 01/01/2024,{},temperature_1\n'.format(i % 24, float(i))
+                   for i in range(start, start + n))
+
+
+def test_tail_loader_collects_chunks(tmp_path):
+    path = tmp_path / 'log.csv'
+    path.write_text(HEADER + rows(0, 3))
+    loader = dataloader.TailLoader(str(path))
+    assert len(loader.load()) == 3
+    for i in range(3):
+        with open(path, 'a') as f:
+            f.write(rows(3 + i, 1))
+        assert loader.refresh() == 1
+    assert len(loader._chunks) == 4      # nothing concatenated yet
+    df = loader.frame()
+    assert len(loader._chunks) == 1
+    assert list(df['value']) == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    assert loader.frame() is df          # no new rows, no copy
+
+
+def test_tail_loader_reload_after_truncation(tmp_path):
+    path = tmp_path / 'log.csv'
+    path.write_text(HEADER + rows(0, 5))
+    loader = dataloader.TailLoader(str(path))
+    assert len(loader.load()) == 5
+    path.write_text(HEADER + rows(0, 2))
+    assert len(loader.load()) == 2
+
+
+def test_live_store_keeps_repeated_hour_at_dst_end(tmp_path):
+    import datetime
+
+    import logwriter
+    import sensorlog
+    path = str(tmp_path / 'log.bin')
+    w = logwriter.LogWriter(path, logwriter.format_binary, sensorlog.binlog_header(),
+                            logwriter.repair_binlog, max_samples=1)
+    live = dataloader.SnapshotCache(dataloader.BinaryTailLoader(path))
+    # 00:00 - 02:00 UTC on 2024-10-27: local 02:00 - 03:00 happens twice
+    start = datetime.datetime(2024, 10, 27, tzinfo=datetime.timezone.utc)
+    for i in range(720):
+        w.log('', start + datetime.timedelta(seconds=10 * i), [float(i)] * len(sensorlog.CHANNELS))
+        if i % 10 == 9:
+            live.get()
+    w.close()
+    times, values = live.get().get('Temp1')
+    cold_times, cold_values = dataloader.SnapshotCache(dataloader.BinaryTailLoader(path)).get().get('Temp1')
+    assert len(values) == len(cold_values) == 720
+    assert np.array_equal(times, cold_times)
+    assert np.array_equal(values, cold_values)
+    assert np.all(np.diff(times) >= np.timedelta64(0))
+
+
+def test_open_log_follows_log_backend(tmp_path, monkeypatch):
+    import logwriter
+    import sensorlog
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / sensorlog.BINFILE).write_bytes(sensorlog.binlog_header())   # left from a conversion
+    monkeypatch.setattr(sensorlog, 'LOG_BACKEND', 'csv')
+    writer = logwriter.open_logwriter()
+    loader = dataloader.open_log()
+    assert isinstance(loader, dataloader.TailLoader)
+    assert loader.path == writer.path == sensorlog.V1FILE
+    writer.close()
+    monkeypatch.setattr(sensorlog, 'LOG_BACKEND', 'binary')
+    assert isinstance(dataloader.open_log(), dataloader.BinaryTailLoader)
+    assert dataloader.open_log(prefix='replay_').path == 'replay_' + sensorlog.BINFILE
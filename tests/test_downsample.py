@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from downsample import downsample, lttb_indices, minmax_indices
+
+
+def wave(n=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.datetime64('2024-05-01T00:00') + np.arange(n) * np.timedelta64(10, 's')
+    y = np.sin(np.arange(n) / 300) + rng.normal(0, 0.1, n)
+    return x, y
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+def test_point_cap_and_endpoints(method):
+    x, y = wave()
+    dx, dy = downsample(x, y, 500, method)
+    assert 2 < len(dx) <= 500
+    assert np.all(np.diff(dx) > np.timedelta64(0))
+
+
+def test_lttb_keeps_first_and_last_point():
+    x, y = wave()
+    idx = lttb_indices(x, y, 200)
+    assert len(idx) == 200
+    assert idx[0] == 0 and idx[-1] == len(y) - 1
+
+
+def test_minmax_keeps_the_extremes():
+    x, y = wave()
+    idx = minmax_indices(x, y, 100)
+    assert len(idx) <= 100
+    assert y[idx].min() == y.min()
+    assert y[idx].max() == y.max()
+
+
+def test_small_series_and_none_are_unchanged():
+    x, y = wave(100)
+    for max_points in (None, 100, 1000):
+        dx, dy = downsample(x, y, max_points)
+        assert dx is x or np.array_equal(dx, x)
+        assert len(dy) == 100
+
+
+def test_nan_values_are_dropped():
+    x, y = wave(1000)
+    y[::7] = np.nan
+    dx, dy = downsample(x, y, 100, 'minmax')
+    assert not np.isnan(dy).any()
+
@@ -0,0 +1,37 @@
+import numpy as np
+
+import figures
+
+
+def test_visible_range():
+    assert figures.visible_range(None) is None
+    assert figures.visible_range({'xaxis.autorange': True, 'yaxis.autorange': True}) is None
+    start, end = figures.visible_range({'xaxis.range[0]': '2024-05-01 10:00', 'xaxis.range[1]': '2024-05-01 12:00'})
+    assert end - start == np.timedelta64(2, 'h')
+    assert figures.visible_range({'xaxis.range': ['2024-05-01 10:00', '2024-05-01 12:00']}) == (start, end)
+
+
+def test_relayout_without_x_range_keeps_range():
+    stored = figures.range_data((np.datetime64('2024-05-01T10:00'), np.datetime64('2024-05-01T12:00')))
+    for relayout in ({'autosize': True}, {'dragmode': 'pan'},
+                     {'yaxis.range[0]': 20, 'yaxis.range[1]': 25}):
+        assert figures.visible_range(relayout) is figures.UNCHANGED
+        assert figures.chart_range(relayout, stored) == figures.stored_range(stored)
+    assert figures.chart_range({'dragmode': 'pan'}, None) is None
+    assert figures.chart_range({'xaxis.autorange': True}, stored) is None
+
+
+def test_envelope_edges_share_x_and_end_with_the_line():
+    from dataloader import Snapshot
+    rng = np.random.default_rng(0)
+    times = np.datetime64('2024-05-01T00:00') + np.arange(5000) * np.timedelta64(1, 'm')
+    mean = 20 + rng.normal(0, 1, len(times))
+    snap = Snapshot(1, {'Temp1': (times, mean), 'Temp1_min': (times, mean - rng.random(len(times))),
+                        'Temp1_max': (times, mean + rng.random(len(times)))})
+    line, lo, hi = figures.line_traces(snap, ['Temp1'], 'T', max_points=400)
+    assert np.array_equal(lo['x'], hi['x'])
+    assert len(lo['x']) <= 400 * figures.ENVELOPE_POINTS
+    assert lo['x'][-1] == hi['x'][-1] == line['x'][-1] == times[-1]
+    assert lo['y'].min() == snap.get('Temp1_min')[1].min()
+    assert hi['y'].max() == snap.get('Temp1_max')[1].max()
+    assert np.all(lo['y'] <= hi['y'])
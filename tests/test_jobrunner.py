@@ -0,0 +1,72 @@
+import threading
+import time
+
+from jobrunner import JobRunner
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_second_run_is_skipped_while_the_first_runs():
+    runner = JobRunner(max_workers=2)
+    release = threading.Event()
+
+    def read():
+        release.wait(2)
+    assert runner.submit(read, key='i2c')
+    assert not runner.submit(read, key='i2c')
+    stats = runner.stats()['i2c']
+    assert stats['running'] == 1 and stats['skipped'] == 1
+    release.set()
+    assert wait_for(lambda: runner.stats()['i2c']['runs'] == 1)
+    runner.shutdown()
+
+
+def test_queued_run_starts_when_the_slot_is_free():
+    runner = JobRunner(max_workers=2)
+    release = threading.Event()
+    order = []
+
+    def job():
+        order.append(len(order))
+        release.wait(2)
+    assert runner.submit(job, max_queue=1)
+    assert runner.submit(job, max_queue=1)
+    assert runner.stats()['job']['queued'] == 1
+    release.set()
+    assert wait_for(lambda: runner.stats()['job']['runs'] == 2)
+    assert order == [0, 1]
+    runner.shutdown()
+
+
+def test_overrun_and_errors_are_counted():
+    runner = JobRunner(max_workers=2)
+
+    def slow():
+        time.sleep(0.1)
+
+    def broken():
+        raise RuntimeError('sensor gone')
+    runner.submit(slow, timeout=0.01)
+    runner.submit(broken)
+    assert wait_for(lambda: runner.stats()['slow']['runs'] == 1 and runner.stats()['broken']['runs'] == 1)
+    assert runner.stats()['slow']['overruns'] == 1
+    assert runner.stats()['broken']['errors'] == 1
+    runner.shutdown()
+
+
+def test_shutdown_does_not_wait_for_a_hanging_job():
+    runner = JobRunner(max_workers=1)
+    release = threading.Event()
+
+    def hang():
+        release.wait(5)
+    runner.submit(hang)
+    start = time.monotonic()
+    runner.shutdown(timeout=0.2)
+    assert time.monotonic() - start < 1
+    release.set()
@@ -0,0 +1,50 @@
+import datetime
+import time
+
+import numpy as np
+
+import logwriter
+import sensorlog
+
+VALUES = [21.5, 21.0, 55.0, 54.0, 1013.2, 1013.5, 1.1, 1.2]
+
+
+def write_binlog(path, samples):
+    w = logwriter.LogWriter(
+        str(path), logwriter.format_binary, sensorlog.binlog_header(), logwriter.repair_binlog)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(samples):
+        w.log('', start + datetime.timedelta(seconds=10 * i), VALUES)
+    w.close()
+
+
+def test_repair_binlog_drops_zero_filled_tail(tmp_path):
+    path = tmp_path / 'log.bin'
+    write_binlog(path, 3)
+    itemsize = sensorlog.record_dtype().itemsize
+    with open(path, 'ab') as f:
+        f.write(bytes(2 * itemsize + 5))     # two zero records and a partial one
+    assert logwriter.repair_binlog(str(path)) == 2 * itemsize + 5
+    records, channels = sensorlog.read_binlog(str(path))
+    assert len(records) == 3
+    assert np.all(np.diff(records['ts']) > 0)
+
+
+def test_repair_binlog_keeps_intact_log(tmp_path):
+    path = tmp_path / 'log.bin'
+    write_binlog(path, 3)
+    assert logwriter.repair_binlog(str(path)) == 0
+
+
+def test_flush_due_writes_old_samples(tmp_path):
+    path = tmp_path / 'log.csv'
+    w = logwriter.LogWriter(str(path), logwriter.format_v1, b'date,value,type\n',
+                            max_samples=100, max_delay=0.05)
+    w.log('00:00:00 01/01/2024', None, VALUES)
+    w.flush_due()
+    assert w.flushes == 0
+    time.sleep(0.06)
+    w.flush_due()
+    assert w.flushes == 1
+    assert path.read_text().count('\n') == 1 + len(VALUES)
+    w.close()
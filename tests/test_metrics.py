@@ -0,0 +1,69 @@
+from metrics import Histogram, Metrics, MetricsServer, fetch, histogram_summary, labels, parse
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram('job_seconds', 'Run time', label='job', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        h.observe(value, 'log')
+    samples = parse('\n'.join(h.lines()))
+    buckets = samples['job_seconds_bucket']
+    assert buckets[(('job', 'log'), ('le', '0.1'))] == 1
+    assert buckets[(('job', 'log'), ('le', '1'))] == 3
+    assert buckets[(('job', 'log'), ('le', '+Inf'))] == 4
+    assert samples['job_seconds_count'][(('job', 'log'),)] == 4
+    assert samples['job_seconds_sum'][(('job', 'log'),)] == 6.05
+
+
+def test_render_includes_histograms_and_collectors():
+    m = Metrics()
+    m.histogram('read_seconds', 'Sensor read').observe(0.002)
+    assert m.histogram('read_seconds', 'Sensor read') is m.histogram('read_seconds', 'again')
+
+    @m.collector
+    def runs():
+        return [('job_runs_total', 'counter', 'Runs', {labels(key='i2c'): 3, None: 1})]
+
+    text = m.render()
+    assert '# TYPE read_seconds histogram' in text
+    assert '# TYPE job_runs_total counter' in text
+    samples = parse(text)
+    assert samples['read_seconds_count'][()] == 1
+    assert samples['job_runs_total'] == {(('key', 'i2c'),): 3.0, (): 1.0}
+
+
+def test_failing_collector_does_not_break_the_scrape():
+    m = Metrics()
+    m.histogram('read_seconds', 'Sensor read').observe(0.002)
+
+    @m.collector
+    def broken():
+        raise RuntimeError('gone')
+
+    text = m.render()
+    assert '# collector broken failed' in text
+    assert parse(text)['read_seconds_count'][()] == 1
+
+
+def test_histogram_summary():
+    h = Histogram('job_seconds', 'Run time', label='job', buckets=(1, 2))
+    for _ in range(10):
+        h.observe(0.5, 'fast')
+    for _ in range(10):
+        h.observe(1.5, 'slow')
+    summary = histogram_summary(parse('\n'.join(h.lines())), 'job_seconds', 'job')
+    assert summary['fast']['count'] == 10 and summary['fast']['mean'] == 0.5
+    assert summary['slow']['mean'] == 1.5
+    assert 0 < summary['fast']['p95'] <= 1
+    assert 1 < summary['slow']['p95'] <= 2
+
+
+def test_server_serves_metrics():
+    m = Metrics()
+    m.histogram('read_seconds', 'Sensor read').observe(0.002)
+    server = MetricsServer(m, port=0, host='127.0.0.1')
+    try:
+        port = server.server.server_address[1]
+        samples = fetch('http://127.0.0.1:{}/metrics'.format(port))
+        assert samples['read_seconds_count'][()] == 1
+    finally:
+        server.stop()
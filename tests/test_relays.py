@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+from relays import RELAY_PINS, Actuator, RelayBank, SimulatedGPIO
+
+PIN_NAMES = {pin: name for name, pin in RELAY_PINS.items()}
+
+
+def actuator():
+    gpio = SimulatedGPIO()
+    return Actuator(RelayBank(RELAY_PINS, gpio)), gpio
+
+
+def switches(gpio):
+    """[(relay, on)] in the order they were written."""
+    return [(PIN_NAMES[pin], on) for t, pin, on in gpio.log]
+
+
+def test_keep_running_never_moves_the_end_before_a_pulse():
+    a, gpio = actuator()
+    a.run('humidifier', [(0, 'R2', True), (0.1, 'R3', True), (0.2, 'R3', False), (5, 'R2', False)])
+    assert a.keep_running('humidifier', 0)
+    time.sleep(0.4)
+    a.stop(all_off=False)
+    assert switches(gpio) == [('R2', True), ('R3', True), ('R3', False), ('R2', False)]
+
+
+def test_steps_run_in_order():
+    a, gpio = actuator()
+    a.run('fan', [(0.1, 'R1', False), (0, 'R1', True)])
+    a.run('lamp', [(0.05, 'R4', True)])
+    time.sleep(0.2)
+    assert switches(gpio) == [('R1', True), ('R4', True), ('R1', False)]
+    a.stop(all_off=False)
+
+
+def test_run_again_replaces_the_remaining_steps():
+    a, gpio = actuator()
+    a.run('fan', [(0, 'R1', True), (0.1, 'R1', False)])
+    time.sleep(0.05)
+    a.run('fan', [(0, 'R1', True), (0.3, 'R1', False)])
+    time.sleep(0.15)
+    assert a.bank.get('R1')         # the first off step was dropped
+    time.sleep(0.25)
+    assert not a.bank.get('R1')
+    a.stop(all_off=False)
+
+
+def test_extend_moves_the_end():
+    a, gpio = actuator()
+    a.run('fan', [(0, 'R1', True), (0.1, 'R1', False)])
+    assert a.extend('fan', 0.2)
+    time.sleep(0.2)
+    assert a.bank.get('R1')
+    assert 0 < a.status()['actions']['fan'] < 0.2
+    time.sleep(0.2)
+    assert not a.bank.get('R1')
+    assert not a.extend('fan', 1)   # not running any more
+    a.stop(all_off=False)
+
+
+def test_cancel_switches_off():
+    a, gpio = actuator()
+    a.run('fan', [(0, 'R1', True), (10, 'R1', False)])
+    time.sleep(0.05)
+    assert a.status()['relays']['R1']
+    assert a.cancel('fan')
+    time.sleep(0.05)
+    assert not a.bank.get('R1')
+    assert 'fan' not in a.status()['actions']
+    assert not a.cancel('fan')
+    a.stop(all_off=False)
+
+
+def test_unknown_relay_is_refused():
+    a, gpio = actuator()
+    with pytest.raises(KeyError):
+        a.run('fan', [(0, 'R9', True)])
+    a.stop(all_off=False)
+
+
+def test_bank_skips_writes_that_change_nothing():
+    gpio = SimulatedGPIO()
+    bank = RelayBank(RELAY_PINS, gpio)
+    assert bank.on('R1')
+    assert not bank.on('R1')
+    assert bank.apply({'R1': True, 'R2': True, 'R3': False}) == 1
+    assert gpio.writes == 2
+    assert bank.skipped == 3
+    assert bank.get('R2') and not bank.get('R3')
+    bank.all_off()
+    assert not any(gpio.pins.values())
+
+
+def test_pins_are_set_up_once():
+    class CountingGPIO(SimulatedGPIO):
+        setups = 0
+
+        def setup(self, pin):
+            CountingGPIO.setups += 1
+            super().setup(pin)
+    bank = RelayBank(RELAY_PINS, CountingGPIO())
+    for _ in range(3):
+        bank.on('R1')
+        bank.off('R1')
+    assert CountingGPIO.setups == len(RELAY_PINS)
+
+
+def test_shared_bank_reads_the_pins_back():
+    gpio = SimulatedGPIO()
+    ours = RelayBank(RELAY_PINS, gpio, shared=True)
+    other = RelayBank(RELAY_PINS, gpio, shared=True)   # e.g. the dashboard
+    other.on('R2')
+    assert ours.get('R2')
+    assert not ours.on('R2')
+    assert ours.off('R2')
+    assert not other.get('R2')
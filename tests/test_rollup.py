@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+import rollup
+from dataloader import SnapshotCache, TailLoader
+
+
+def write_log(path, minutes, start='2024-05-01 00:00:00'):
+    """v1 log with one Temp1 sample per minute, value = minute."""
+    dates = pd.date_range(start, periods=minutes, freq='min')
+    df = pd.DataFrame({'date': dates, 'value': np.arange(minutes, dtype='float64'), 'type': 'Temp1'})
+    out = df.assign(date=df['date'].dt.strftime('%H:%M:%S %d/%m/%Y'))
+    out.to_csv(path, index=False)
+    return df
+
+
+def test_select_reaches_newest_sample(tmp_path):
+    log = str(tmp_path / 'log.csv')
+    prefix = str(tmp_path / 'rollup')
+    df = write_log(log, 2 * 24 * 60 + 30)       # 48 h and half an hour
+    rollup.build_rollups(df, prefix=prefix)
+    snapshots = rollup.RollupSnapshots(SnapshotCache(TailLoader(log)), prefix=prefix)
+    resolution, snap = snapshots.select(None, max_points=10)
+    assert resolution == '1h'
+    times, values = snap.get('Temp1')
+    # closed buckets, then the raw samples of the open hour
+    assert times[-1] == df['date'].iloc[-1].to_datetime64()
+    assert np.all(np.diff(times) > np.timedelta64(0))
+    assert values[-1] == df['value'].iloc[-1]
+    band_times, _ = snap.get('Temp1_max')
+    assert band_times[-1] == times[-1]
+    assert snapshots.get('1h') is snapshots.get('1h')
+
+
+def test_rollup_writer_writes_closed_buckets(tmp_path):
+    import datetime
+    prefix = str(tmp_path / 'rollup')
+    w = rollup.RollupWriter(['Temp1', 'Temp2'], {'1min': 60}, prefix=prefix)
+    start = datetime.datetime(2024, 5, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def add(seconds, values):
+        w.add(start + datetime.timedelta(seconds=seconds), values)
+    add(0, [20.0, 10.0])
+    add(30, [22.0, np.nan])
+    add(59, [21.0, 12.0])
+    path = rollup.rollup_path('1min', prefix)
+    assert not (tmp_path / 'rollup_1min.csv').exists()      # bucket still open
+    add(60, [30.0, 30.0])
+    add(40, [99.0, 99.0])       # late, its bucket is written already
+    add(125, [30.0, 30.0])
+    rows = pd.read_csv(path)
+    assert list(rows.columns) == rollup.ROLLUP_COLUMNS
+    first = rows[rows['start'] == int(start.timestamp())].set_index('type')
+    assert first.loc['Temp1', 'min'] == 20.0 and first.loc['Temp1', 'max'] == 22.0
+    assert first.loc['Temp1', 'mean'] == 21.0 and first.loc['Temp1', 'count'] == 3
+    assert first.loc['Temp2', 'count'] == 2 and first.loc['Temp2', 'max'] == 12.0
+    second = rows[rows['start'] == int(start.timestamp()) + 60]
+    assert list(second['count']) == [1, 1]
+    assert len(rows) == 4       # the bucket at 120 s is still open
+
+
+def test_select_resolution_by_visible_range(tmp_path):
+    log = str(tmp_path / 'log.csv')
+    prefix = str(tmp_path / 'rollup')
+    df = write_log(log, 3 * 24 * 60)
+    rollup.build_rollups(df, prefix=prefix)
+    snapshots = rollup.RollupSnapshots(SnapshotCache(TailLoader(log)), prefix=prefix)
+    end = df['date'].iloc[-1].to_datetime64()
+
+    def resolution(minutes, max_points=60):
+        return snapshots.select((end - np.timedelta64(minutes, 'm'), end), max_points)[0]
+    assert resolution(30) == 'raw'
+    assert resolution(2 * 60) == '1min'
+    assert resolution(24 * 60) == '15min'
+    assert resolution(72 * 60) == '1h'
+    assert snapshots.select(None, None)[0] == 'raw'
@@ -0,0 +1,41 @@
+import datetime
+
+from sampler import Sampler
+from sensorlog import CHANNELS
+
+
+def reading():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return ['12:00:00 01/05/2024'] + [float(i) for i in range(len(CHANNELS))] + [now]
+
+
+def test_one_read_per_tick_for_all_subscribers():
+    reads = []
+
+    def read():
+        reads.append(1)
+        return reading()
+    sampler = Sampler(read)
+    seen, every_other = [], []
+    sampler.subscribe(seen.append)
+    sampler.subscribe(every_other.append, every=2)
+    for _ in range(4):
+        sampler.tick()
+    assert len(reads) == 4
+    assert len(seen) == 4 and len(every_other) == 2
+    assert seen[-1] is sampler.latest
+    assert seen[-1].Humid1 == seen[-1][3] == 2.0
+
+
+def test_failing_subscriber_does_not_stop_the_others():
+    sampler = Sampler(reading)
+    seen = []
+
+    def broken(sample):
+        raise RuntimeError('disk full')
+    sampler.subscribe(broken)
+    sampler.subscribe(seen.append)
+    sampler.tick()
+    sampler.tick()
+    assert len(seen) == 2
+    assert sampler._subscribers[0].errors == 2
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+import sensorlog
+from seriesstore import Series
+
+# sample times in the order the logger wrote them, 12:00:10 came late
+TIMES = ['12:00:00', '12:00:20', '12:00:10', '12:00:30', '12:00:40']
+
+
+def write_v1(path, times=TIMES):
+    with open(path, 'w') as f:
+        f.write('date,value,type\n')
+        for i, t in enumerate(times):
+            for c in sensorlog.CHANNELS:
+                f.write('{} 01/05/2024,{},{}\n'.format(t, 20.0 + i, c))
+
+
+def test_convert_v1_to_v2_sorts_samples(tmp_path):
+    src, dst = tmp_path / 'log.csv', tmp_path / 'log_v2.csv'
+    write_v1(src)
+    sensorlog.convert_v1_to_v2(str(src), str(dst), window=4)
+    ts = pd.read_csv(dst, skiprows=1)['ts'].to_numpy()
+    assert len(ts) == len(TIMES)
+    assert np.all(np.diff(ts) > 0)
+
+
+def test_convert_csv_sorts_across_chunks(tmp_path):
+    src, dst = tmp_path / 'log.csv', tmp_path / 'log.bin'
+    write_v1(src)
+    # two samples per chunk, so the late sample is in another chunk
+    sensorlog.convert_csv(str(src), str(dst), chunksize=2 * len(sensorlog.CHANNELS), window=4)
+    records, channels = sensorlog.read_binlog(str(dst))
+    assert len(records) == len(TIMES)
+    assert np.all(np.diff(records['ts']) > 0)
+
+
+def test_series_keeps_times_sorted():
+    t = np.array(['2024-05-01T12:00:00', '2024-05-01T12:00:20', '2024-05-01T12:00:10'],
+                 dtype='datetime64[ns]')
+    s = Series()
+    s.extend(t, [0.0, 2.0, 1.0])
+    assert list(s.values()) == [0.0, 1.0, 2.0]
+    view = s.values()
+    s.extend(t[:1], [5.0])     # older than what is stored
+    assert s.late == 1
+    assert len(s) == 4
+    assert list(s.values()) == [0.0, 5.0, 1.0, 2.0]
+    assert list(view) == [0.0, 1.0, 2.0]    # views handed out don't change
+    assert np.all(np.diff(s.times()) >= np.timedelta64(0))
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from seriesstore import Series, SeriesStore
+
+
+def minutes(start, n):
+    return np.datetime64('2024-05-01T00:00') + (start + np.arange(n)) * np.timedelta64(1, 'm')
+
+
+def test_series_grows_and_keeps_views():
+    s = Series(capacity=4)
+    s.extend(minutes(0, 3), [0.0, 1.0, 2.0])
+    times, values = s.times(), s.values()
+    s.extend(minutes(3, 10), np.arange(3, 13, dtype='float64'))     # moves to a bigger array
+    assert len(s) == 13
+    assert list(s.values()) == list(range(13))
+    assert list(values) == [0.0, 1.0, 2.0]
+    assert len(times) == 3
+    assert s.latest() == (minutes(12, 1)[0], 12.0)
+
+
+def test_empty_series():
+    s = Series()
+    assert s.latest() == (None, None)
+    assert len(s.times()) == 0
+
+
+def test_store_splits_long_rows_per_series():
+    store = SeriesStore()
+    df = pd.DataFrame({'date': np.repeat(minutes(0, 3), 2), 'value': np.arange(6, dtype='float64'),
+                       'type': ['Temp1', 'Humid1'] * 3})
+    store.extend_long(df)
+    store.extend_long(df.iloc[:0])
+    assert sorted(store.names()) == ['Humid1', 'Temp1']
+    views = store.views()
+    assert list(views['Temp1'][1]) == [0.0, 2.0, 4.0]
+    assert list(views['Humid1'][1]) == [1.0, 3.0, 5.0]
+    assert store.latest('Humid1') == (minutes(2, 1)[0], 5.0)
+    assert store.latest('vpd1') == (None, None)
+    store.clear()
+    assert store.views() == {}
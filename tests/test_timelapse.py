@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+import pytest
+
+import timelapse
+
+
+def touch(directory, *names):
+    for name in names:
+        (directory / name).write_bytes(b'')
+
+
+def test_segments_sort_parts_as_numbers(tmp_path):
+    touch(tmp_path, '2024-05-01.webm', '2024-05-01_10.webm', '2024-05-01_2.webm', '2024-05-02.webm')
+    assert timelapse.segments(str(tmp_path)) == [
+        '2024-05-01.webm', '2024-05-01_2.webm', '2024-05-01_10.webm', '2024-05-02.webm']
+
+
+def test_default_is_the_newest_finished_segment(tmp_path):
+    pytest.importorskip('cv2')
+    touch(tmp_path, '2024-05-01.webm')
+    writer = timelapse.TimelapseWriter(str(tmp_path), width=64, reorder=0)
+    writer.push(1714600000, np.zeros((48, 64, 3), dtype=np.uint8))     # 2024-05-01
+    names = timelapse.segments(str(tmp_path))
+    assert timelapse.writing(str(tmp_path)) == os.path.basename(writer.path)
+    assert timelapse.newest_closed(names, str(tmp_path)) == '2024-05-01.webm'
+    writer.close()
+    assert timelapse.writing(str(tmp_path)) is None
+    assert names[-1] == '2024-05-01_1.webm'
+    assert timelapse.newest_closed(names, str(tmp_path)) == names[-1]
@@ -0,0 +1,225 @@
+################################################################
+# Timelapse
+###############################################################
+
+# Every picture taken by cam() is also written into a timelapse video as it
+# comes in, so nothing has to be re-encoded later. There is one segment file
+# per day (SEGMENT is a strftime pattern, e.g. '%Y-%m-%d_%H' for one per
+# hour), the segment of the current day is finished at midnight or when the
+# scheduler stops.
+#  - frames are written on a worker thread, the queue is short and frames
+#    are dropped when the worker can't keep up
+#  - frames arriving out of order are sorted in a window of `reorder` frames;
+#    anything older than the last written frame is dropped
+#  - after a gap of more than max_gap seconds (camera unplugged, scheduler
+#    stopped) a new part of the segment is started, e.g. 2024-05-01_1.webm
+#  - the name of the segment being written is kept in timelapse/.writing,
+#    it can't be played before it is finished
+# Memory use is a few frames, however long the timelapse gets.
+#
+# Build a timelapse from pictures already saved in assets/:
+#   python timelapse.py build [assets_dir] [timelapse_dir]
+
+import heapq
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+from camera import _cv2
+
+TIMELAPSE_DIR = 'timelapse'
+SEGMENT = '%Y-%m-%d'
+# VP8 in WebM plays in every browser and needs no extra codec on the Pi
+FOURCC = 'VP80'
+EXTENSION = '.webm'
+# name of the segment being written
+WRITING = '.writing'
+
+# pictures saved by cam(), e.g. 20240501-123000cam.jpg (local time)
+PICTURE = re.compile(r'^(\d{8}-\d{6})cam\.(jpg|webp|png)$')
+
+
+def picture_time(name):
+    """Unix time of a picture saved by cam(), None for other files."""
+    m = PICTURE.match(name)
+    if m is None:
+        return None
+    return time.mktime(time.strptime(m.group(1), '%Y%m%d-%H%M%S'))
+
+
+def segment_key(name):
+    # numbers compare as numbers: 2024-05-01_2 before 2024-05-01_10
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def segments(directory=TIMELAPSE_DIR):
+    """File names of the timelapse segments, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted((f for f in os.listdir(directory) if f.endswith(EXTENSION)), key=segment_key)
+
+
+def writing(directory=TIMELAPSE_DIR):
+    """File name of the segment being written, None if there is none."""
+    try:
+        with open(os.path.join(directory, WRITING)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def newest_closed(names, directory=TIMELAPSE_DIR):
+    """The newest of the segments names that is finished, else the newest."""
+    open_segment = writing(directory)
+    closed = [name for name in names if name != open_segment]
+    return closed[-1] if closed else (names[-1] if names else None)
+
+
+class TimelapseWriter:
+    """Append frames to per-day timelapse videos."""
+
+    def __init__(self, directory=TIMELAPSE_DIR, fps=24, width=640, reorder=8,
+                 max_gap=3600, segment=SEGMENT, maxsize=4):
+        self.directory = directory
+        self.fps = fps
+        self.width = width
+        self.reorder = reorder
+        self.max_gap = max_gap
+        self.segment = segment
+        self._heap = []
+        self._seq = 0
+        self._writer = None
+        self._name = None
+        self._size = None
+        self._last = None       # time of the last written frame
+        self.path = None        # segment being written
+        self.frames = 0
+        self.dropped = 0        # queue full
+        self.late = 0           # older than the last written frame
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._loop, name='timelapse', daemon=True)
+        self._thread.start()
+        return self
+
+    def add(self, frame, t):
+        """Queue a frame taken at unix time t. Returns False if it was dropped."""
+        try:
+            self._queue.put_nowait((t, frame))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self.push(*item)
+            except Exception as e:
+                print("Timelapse: {!r}".format(e))
+        self.close()
+
+    def push(self, t, frame):
+        """Sort a frame into the reorder window, writing the oldest when it is full."""
+        self._seq += 1
+        heapq.heappush(self._heap, (t, self._seq, frame))
+        while len(self._heap) > self.reorder:
+            t, _, frame = heapq.heappop(self._heap)
+            self._write(t, frame)
+
+    def _write(self, t, frame):
+        if self._last is not None and t <= self._last:
+            self.late += 1
+            return
+        name = time.strftime(self.segment, time.localtime(t))
+        if (self._writer is None or name != self._name
+                or t - self._last > self.max_gap):
+            self._open(name, frame)
+        if (frame.shape[1], frame.shape[0]) != self._size:
+            frame = _cv2().resize(frame, self._size, interpolation=_cv2().INTER_AREA)
+        self._writer.write(frame)
+        self._last = t
+        self.frames += 1
+
+    def _open(self, name, frame):
+        cv2 = _cv2()
+        self._release()
+        # a finished video can't be appended to: continue in a new part
+        path = os.path.join(self.directory, name + EXTENSION)
+        part = 0
+        while os.path.exists(path):
+            part += 1
+            path = os.path.join(self.directory, '{}_{}{}'.format(name, part, EXTENSION))
+        height, width = frame.shape[:2]
+        if self.width and width > self.width:
+            height = round(height * self.width / width)
+            width = self.width
+        # the encoder wants even dimensions
+        self._size = (width - width % 2, height - height % 2)
+        self._writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*FOURCC), self.fps, self._size)
+        if not self._writer.isOpened():
+            self._writer = None
+            raise RuntimeError('could not open video writer for ' + path)
+        self._name = name
+        self.path = path
+        with open(os.path.join(self.directory, WRITING), 'w') as f:
+            f.write(os.path.basename(path))
+        print("Timelapse: writing {}".format(path))
+
+    def _release(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+            try:
+                os.remove(os.path.join(self.directory, WRITING))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Write the frames still in the reorder window and finish the segment."""
+        while self._heap:
+            t, _, frame = heapq.heappop(self._heap)
+            self._write(t, frame)
+        self._release()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=60)
+            self._thread = None
+
+
+def build(src, directory=TIMELAPSE_DIR, **options):
+    """Write the pictures saved in src into timelapse segments, one at a time."""
+    cv2 = _cv2()
+    pictures = sorted((t, name) for t, name in
+                      ((picture_time(name), name) for name in os.listdir(src))
+                      if t is not None)
+    os.makedirs(directory, exist_ok=True)
+    writer = TimelapseWriter(directory, **options)
+    for t, name in pictures:
+        frame = cv2.imread(os.path.join(src, name))
+        if frame is None:
+            print("Skipping unreadable picture {}".format(name))
+            continue
+        writer.push(t, frame)
+    writer.close()
+    return writer.frames
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'build':
+        src = sys.argv[2] if len(sys.argv) > 2 else 'assets'
+        directory = sys.argv[3] if len(sys.argv) > 3 else TIMELAPSE_DIR
+        print("{} frames written".format(build(src, directory)))
+    else:
+        print("usage: python timelapse.py build [assets_dir] [timelapse_dir]")